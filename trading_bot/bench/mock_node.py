@@ -0,0 +1,551 @@
+import json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import rlp
+from eth_abi import decode, encode
+from eth_account import Account
+from eth_account._utils.legacy_transactions import Transaction
+from web3 import Web3
+
+ZERO = '0x' + '00' * 20
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+APPROVAL_TOPIC = Web3.to_hex(Web3.keccak(text="Approval(address,address,uint256)"))
+VAULT_UPDATED_TOPIC = Web3.to_hex(Web3.keccak(text="VaultUpdated(address,address,uint256,uint256,uint256)"))
+VAULT_CLOSED_TOPIC = Web3.to_hex(Web3.keccak(text="VaultClosed()"))
+
+# (name, input types, output types, state mutability) of the functions the mock contracts answer
+ERC20_FUNCTIONS = [
+    ('decimals', [], ['uint8'], 'view'),
+    ('symbol', [], ['string'], 'view'),
+    ('totalSupply', [], ['uint256'], 'view'),
+    ('balanceOf', ['address'], ['uint256'], 'view'),
+    ('allowance', ['address', 'address'], ['uint256'], 'view'),
+    ('approve', ['address', 'uint256'], ['bool'], 'nonpayable'),
+    ('transfer', ['address', 'uint256'], ['bool'], 'nonpayable'),
+]
+FACTORY_FUNCTIONS = [
+    ('getPair', ['address', 'address'], ['address'], 'view'),
+    ('allPairsLength', [], ['uint256'], 'view'),
+]
+ROUTER_FUNCTIONS = [
+    ('factory', [], ['address'], 'view'),
+    ('WETH', [], ['address'], 'view'),
+    ('getAmountsOut', ['uint256', 'address[]'], ['uint256[]'], 'view'),
+    ('getAmountsIn', ['uint256', 'address[]'], ['uint256[]'], 'view'),
+    ('swapExactTokensForTokens', ['uint256', 'uint256', 'address[]', 'address', 'uint256'], ['uint256[]'], 'nonpayable'),
+    ('swapTokensForExactTokens', ['uint256', 'uint256', 'address[]', 'address', 'uint256'], ['uint256[]'], 'nonpayable'),
+]
+PAIR_FUNCTIONS = [
+    ('getReserves', [], ['uint112', 'uint112', 'uint32'], 'view'),
+    ('token0', [], ['address'], 'view'),
+    ('token1', [], ['address'], 'view'),
+]
+VAULT_FUNCTIONS = [
+    ('getVaultState', [], ['uint256', 'uint256', 'uint256', 'bool', 'bool'], 'view'),
+    ('runTimestamp', [], ['uint256'], 'view'),
+    ('stopTimestamp', [], ['uint256'], 'view'),
+    ('manager', [], ['address'], 'view'),
+    ('callWhitelisted', ['address', 'bytes'], ['bytes'], 'nonpayable'),
+    ('updateVault', ['address', 'address', 'uint256', 'uint256', 'uint256'], [], 'nonpayable'),
+    ('withdraw', [], [], 'nonpayable'),
+]
+
+
+def build_abi(functions: list) -> list:
+    """
+    Contract ABI of (name, input types, output types, mutability) entries
+    """
+    return [{
+        'type': 'function',
+        'name': name,
+        'inputs': [{'name': f'arg{i}', 'type': t, 'internalType': t} for i, t in enumerate(inputs)],
+        'outputs': [{'name': '', 'type': t, 'internalType': t} for t in outputs],
+        'stateMutability': mutability,
+    } for name, inputs, outputs, mutability in functions]
+
+
+def _selectors(functions: list) -> dict:
+    return {
+        Web3.to_hex(Web3.keccak(text=f"{name}({','.join(inputs)})")[:4]): (name, inputs, outputs)
+        for name, inputs, outputs, _ in functions
+    }
+
+
+ERC20_ABI, FACTORY_ABI, ROUTER_ABI, PAIR_ABI, VAULT_ABI = (
+    build_abi(f) for f in (ERC20_FUNCTIONS, FACTORY_FUNCTIONS, ROUTER_FUNCTIONS, PAIR_FUNCTIONS, VAULT_FUNCTIONS))
+SELECTORS = {
+    'token': _selectors(ERC20_FUNCTIONS),
+    'factory': _selectors(FACTORY_FUNCTIONS),
+    'router': _selectors(ROUTER_FUNCTIONS),
+    'pair': _selectors(PAIR_FUNCTIONS),
+    'vault': _selectors(VAULT_FUNCTIONS),
+}
+
+
+class Revert(Exception):
+    pass
+
+
+class RpcError(Exception):
+    def __init__(self, message: str, code: int = -32000) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+def _topic(address: str) -> str:
+    return '0x' + '0' * 24 + address.lower().replace('0x', '')
+
+
+def _int(value) -> int:
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+class MockChain():
+    def __init__(self, chain_id: int = 296, gas_price: int = 10 ** 9, confirm_delay: float = 0.) -> None:
+        """
+        In-memory stand-in of a Hedera JSON-RPC relay with a Uniswap V2 style DEX:
+        ERC-20 tokens, factory, router (constant product, 0.3% fee), pairs and bot vaults
+        (callWhitelisted runs a call as the vault). Signed legacy transactions are decoded and executed,
+        one block per transaction, with Transfer logs, receipts and eth_getLogs.
+        confirm_delay: seconds before a sent transaction is mined (its receipt shows up)
+        """
+        self.chain_id = chain_id
+        self.gas_price = gas_price
+        self.confirm_delay = confirm_delay
+        self.kinds = {}         # address -> 'token' / 'factory' / 'router' / 'pair' / 'vault'
+        self.tokens = {}        # token address -> {'symbol', 'decimals', 'balances', 'allowances'}
+        self.symbols = {}       # symbol -> token address
+        self.pairs = {}         # frozenset(token a, token b) -> pair address
+        self.pair_tokens = {}   # pair address -> (token0, token1)
+        self.vaults = {}        # vault address -> {'manager', 'token1', 'token2', 'run', 'stop', 'shares', 'holders', 'closed'}
+        self.nonces = {}        # sender -> next nonce
+        self.pending = []       # (mine at, tx hash, sender, to, data, gas price)
+        self.receipts = {}      # tx hash -> receipt
+        self.logs = []
+        self.blocks = [time.time()]  # block number -> timestamp
+        self.calls = {}         # method -> count
+        self._next_address = 0x1000
+        self._lock = threading.RLock()
+        self.factory = self._new_address('factory')
+        self.router = self._new_address('router')
+
+    def _new_address(self, kind: str) -> str:
+        self._next_address += 1
+        address = Web3.to_checksum_address('0x%040x' % self._next_address)
+        self.kinds[address] = kind
+        return address
+
+    # === setup ===
+    def add_token(self, symbol: str, decimals: int = 18) -> str:
+        address = self._new_address('token')
+        self.tokens[address] = {'symbol': symbol, 'decimals': decimals, 'balances': {}, 'allowances': {}}
+        self.symbols[symbol] = address
+        return address
+
+    def add_pair(self, symbol_a: str, symbol_b: str, reserve_a: float, reserve_b: float) -> str:
+        """
+        Pool of two tokens holding reserve_a / reserve_b (token units)
+        """
+        a, b = self.symbols[symbol_a], self.symbols[symbol_b]
+        address = self._new_address('pair')
+        self.pairs[frozenset((a, b))] = address
+        self.pair_tokens[address] = tuple(sorted((a, b), key=lambda t: int(t, 16)))
+        self.mint(symbol_a, address, reserve_a)
+        self.mint(symbol_b, address, reserve_b)
+        return address
+
+    def add_vault(self, manager: str, symbol_1: str, symbol_2: str, run: float = None, stop: float = None) -> str:
+        now = time.time()
+        address = self._new_address('vault')
+        self.vaults[address] = {
+            'manager': Web3.to_checksum_address(manager),
+            'token1': self.symbols[symbol_1], 'token2': self.symbols[symbol_2],
+            'run': int(run if run is not None else now - 60), 'stop': int(stop if stop is not None else now + 86400),
+            'shares': 0, 'holders': 0, 'closed': False,
+        }
+        return address
+
+    def mint(self, symbol: str, owner: str, amount: float) -> None:
+        token = self.tokens[self.symbols[symbol]]
+        owner = Web3.to_checksum_address(owner)
+        token['balances'][owner] = token['balances'].get(owner, 0) + int(amount * 10 ** token['decimals'])
+
+    def balance(self, symbol: str, owner: str) -> float:
+        token = self.tokens[self.symbols[symbol]]
+        return token['balances'].get(Web3.to_checksum_address(owner), 0) / 10 ** token['decimals']
+
+    def mine_pending(self) -> None:
+        """
+        Mine every sent transaction now, whatever its confirm delay
+        """
+        with self._lock:
+            self.pending = [(0, *tx[1:]) for tx in self.pending]
+            self._mine()
+
+    def contract_info(self) -> dict:
+        """
+        contract_info of a SwapBroker talking to this chain
+        """
+        return {
+            'router': [self.router, ROUTER_ABI],
+            'factory': [self.factory, FACTORY_ABI],
+            'vault': [next(iter(self.vaults), ZERO), VAULT_ABI],
+            'tokens': {t['symbol']: [address, ERC20_ABI] for address, t in self.tokens.items()},
+        }
+
+    # === JSON-RPC ===
+    def handle(self, method: str, params: list):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self._mine()
+            handler = getattr(self, 'rpc_' + method, None)
+            if handler is None:
+                raise RpcError(f"the method {method} does not exist/is not available", -32601)
+            return handler(*params)
+
+    def rpc_eth_chainId(self):
+        return hex(self.chain_id)
+
+    def rpc_net_version(self):
+        return str(self.chain_id)
+
+    def rpc_web3_clientVersion(self):
+        return 'trading_bot-mock/0.1'
+
+    def rpc_eth_blockNumber(self):
+        return hex(len(self.blocks) - 1)
+
+    def rpc_eth_gasPrice(self):
+        return hex(self.gas_price)
+
+    def rpc_eth_getTransactionCount(self, address, block='latest'):
+        return hex(self.nonces.get(Web3.to_checksum_address(address), 0))
+
+    def rpc_eth_getBlockByNumber(self, number, full=False):
+        n = len(self.blocks) - 1 if number in ('latest', 'pending', 'safe', 'finalized') else _int(number)
+        if n >= len(self.blocks):
+            return None
+        h = '0x%064x' % n
+        return {
+            'number': hex(n), 'hash': h, 'parentHash': '0x%064x' % max(0, n - 1), 'timestamp': hex(int(self.blocks[n])),
+            'transactions': [], 'uncles': [], 'extraData': '0x', 'gasLimit': hex(15_000_000), 'gasUsed': '0x0',
+            'miner': ZERO, 'difficulty': '0x0', 'totalDifficulty': '0x0', 'logsBloom': '0x' + '00' * 256,
+            'nonce': '0x' + '00' * 8, 'receiptsRoot': h, 'sha3Uncles': h, 'stateRoot': h, 'transactionsRoot': h,
+            'size': '0x0', 'baseFeePerGas': hex(self.gas_price),
+        }
+
+    def rpc_eth_estimateGas(self, txn, block=None):
+        return hex(150_000)
+
+    def rpc_eth_call(self, txn, block='latest'):
+        to = Web3.to_checksum_address(txn['to'])
+        data = txn.get('data') or txn.get('input') or '0x'
+        try:
+            return Web3.to_hex(self._call(Web3.to_checksum_address(txn.get('from') or ZERO), to, data, write=False))
+        except Revert as e:
+            raise RpcError(f"execution reverted: {e}", 3)
+
+    def rpc_eth_sendRawTransaction(self, raw):
+        raw = Web3.to_bytes(hexstr=raw)
+        txn = rlp.decode(raw, Transaction)
+        sender = Account.recover_transaction(raw)
+        expected = self.nonces.get(sender, 0)
+        if txn.nonce < expected:
+            raise RpcError(f"nonce too low: next nonce {expected}, tx nonce {txn.nonce}")
+        self.nonces[sender] = txn.nonce + 1
+        tx_hash = Web3.to_hex(Web3.keccak(raw))
+        to = Web3.to_checksum_address(txn.to) if txn.to else ZERO
+        self.pending.append((time.time() + self.confirm_delay, tx_hash, sender, to, Web3.to_hex(txn.data), txn.gasPrice))
+        self._mine()
+        return tx_hash
+
+    def rpc_eth_getTransactionReceipt(self, tx_hash):
+        return self.receipts.get(tx_hash.lower() if isinstance(tx_hash, str) else Web3.to_hex(tx_hash))
+
+    def rpc_eth_getLogs(self, query):
+        latest = len(self.blocks) - 1
+        start = _int(query.get('fromBlock', latest)) if query.get('fromBlock') not in (None, 'latest') else latest
+        end = _int(query.get('toBlock', latest)) if query.get('toBlock') not in (None, 'latest') else latest
+        addresses = query.get('address')
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = {a.lower() for a in addresses} if addresses else None
+        topics = query.get('topics') or []
+        return [log for log in self.logs if start <= _int(log['blockNumber']) <= end
+                and (addresses is None or log['address'].lower() in addresses)
+                and self._topics_match(log['topics'], topics)]
+
+    @staticmethod
+    def _topics_match(log_topics: list, topics: list) -> bool:
+        for i, wanted in enumerate(topics):
+            if wanted is None:
+                continue
+            if i >= len(log_topics):
+                return False
+            if log_topics[i] not in [t.lower() for t in (wanted if isinstance(wanted, list) else [wanted])]:
+                return False
+        return True
+
+    # === execution ===
+    def _mine(self) -> None:
+        now = time.time()
+        while self.pending and self.pending[0][0] <= now:
+            _, tx_hash, sender, to, data, gas_price = self.pending.pop(0)
+            self.blocks.append(now)
+            block = len(self.blocks) - 1
+            logs = []
+            try:
+                self._call(sender, to, data, write=True, logs=logs)
+                status = 1
+            except Revert as e:
+                logs, status = [], 0
+                print(f"Mock chain: {tx_hash} reverted: {e}")
+            for i, log in enumerate(logs):
+                log.update({
+                    'blockNumber': hex(block), 'blockHash': '0x%064x' % block, 'transactionHash': tx_hash,
+                    'transactionIndex': '0x0', 'logIndex': hex(i), 'removed': False,
+                })
+            self.logs += logs
+            self.receipts[tx_hash] = {
+                'transactionHash': tx_hash, 'transactionIndex': '0x0', 'blockHash': '0x%064x' % block,
+                'blockNumber': hex(block), 'from': sender, 'to': to, 'cumulativeGasUsed': hex(120_000),
+                'gasUsed': hex(120_000), 'effectiveGasPrice': hex(gas_price), 'contractAddress': None,
+                'logs': logs, 'logsBloom': '0x' + '00' * 256, 'status': hex(status), 'type': '0x0',
+            }
+
+    def _call(self, sender: str, to: str, data: str, write: bool, logs: list = None) -> bytes:
+        kind = self.kinds.get(to)
+        if kind is None:
+            return b''  # no code at the address
+        selector, args = data[:10], Web3.to_bytes(hexstr=data)[4:]
+        if selector not in SELECTORS[kind]:
+            raise Revert(f"{kind} has no function {selector}")
+        name, inputs, outputs = SELECTORS[kind][selector]
+        values = decode(inputs, args) if inputs else ()
+        result = getattr(self, f"_{kind}_{name}")(sender, to, *values, write=write, logs=logs if logs is not None else [])
+        if not outputs:
+            return b''
+        return encode(outputs, result if isinstance(result, (tuple, list)) and len(outputs) > 1 else [result])
+
+    def _transfer(self, token: str, source: str, target: str, amount: int, logs: list) -> None:
+        balances = self.tokens[token]['balances']
+        if balances.get(source, 0) < amount:
+            raise Revert(f"{self.tokens[token]['symbol']} balance of {source} too low")
+        balances[source] = balances.get(source, 0) - amount
+        balances[target] = balances.get(target, 0) + amount
+        logs.append({'address': token, 'topics': [TRANSFER_TOPIC, _topic(source), _topic(target)], 'data': '0x%064x' % amount})
+
+    # tokens
+    def _token_decimals(self, sender, to, write, logs):
+        return self.tokens[to]['decimals']
+
+    def _token_symbol(self, sender, to, write, logs):
+        return self.tokens[to]['symbol']
+
+    def _token_totalSupply(self, sender, to, write, logs):
+        return sum(self.tokens[to]['balances'].values())
+
+    def _token_balanceOf(self, sender, to, owner, write, logs):
+        return self.tokens[to]['balances'].get(Web3.to_checksum_address(owner), 0)
+
+    def _token_allowance(self, sender, to, owner, spender, write, logs):
+        return self.tokens[to]['allowances'].get((Web3.to_checksum_address(owner), Web3.to_checksum_address(spender)), 0)
+
+    def _token_approve(self, sender, to, spender, amount, write, logs):
+        if write:
+            self.tokens[to]['allowances'][(sender, Web3.to_checksum_address(spender))] = amount
+            logs.append({'address': to, 'topics': [APPROVAL_TOPIC, _topic(sender), _topic(spender)], 'data': '0x%064x' % amount})
+        return True
+
+    def _token_transfer(self, sender, to, target, amount, write, logs):
+        if write:
+            self._transfer(to, sender, Web3.to_checksum_address(target), amount, logs)
+        return True
+
+    # factory / pairs
+    def _factory_getPair(self, sender, to, a, b, write, logs):
+        return self.pairs.get(frozenset((Web3.to_checksum_address(a), Web3.to_checksum_address(b))), ZERO)
+
+    def _factory_allPairsLength(self, sender, to, write, logs):
+        return len(self.pairs)
+
+    def _reserves(self, pair: str, token_in: str, token_out: str) -> tuple:
+        return (self.tokens[token_in]['balances'].get(pair, 0), self.tokens[token_out]['balances'].get(pair, 0))
+
+    def _pair_getReserves(self, sender, to, write, logs):
+        token0, token1 = self.pair_tokens[to]
+        return (*self._reserves(to, token0, token1), int(self.blocks[-1]) % 2 ** 32)
+
+    def _pair_token0(self, sender, to, write, logs):
+        return self.pair_tokens[to][0]
+
+    def _pair_token1(self, sender, to, write, logs):
+        return self.pair_tokens[to][1]
+
+    # router
+    def _router_factory(self, sender, to, write, logs):
+        return self.factory
+
+    def _router_WETH(self, sender, to, write, logs):
+        return self.symbols.get('WHBAR', ZERO)
+
+    def _hops(self, path: list) -> list:
+        hops = []
+        for token_in, token_out in zip(path[:-1], path[1:]):
+            pair = self.pairs.get(frozenset((Web3.to_checksum_address(token_in), Web3.to_checksum_address(token_out))))
+            if pair is None:
+                raise Revert("UniswapV2Library: PAIR_NOT_FOUND")
+            hops.append((pair, Web3.to_checksum_address(token_in), Web3.to_checksum_address(token_out)))
+        return hops
+
+    def _amounts_out(self, amount_in: int, path: list) -> list:
+        amounts = [amount_in]
+        for pair, token_in, token_out in self._hops(path):
+            reserve_in, reserve_out = self._reserves(pair, token_in, token_out)
+            if reserve_in == 0 or reserve_out == 0:
+                raise Revert("UniswapV2Library: INSUFFICIENT_LIQUIDITY")
+            amount_in_fee = amounts[-1] * 997
+            amounts.append(amount_in_fee * reserve_out // (reserve_in * 1000 + amount_in_fee))
+        return amounts
+
+    def _amounts_in(self, amount_out: int, path: list) -> list:
+        amounts = [amount_out]
+        for pair, token_in, token_out in reversed(self._hops(path)):
+            reserve_in, reserve_out = self._reserves(pair, token_in, token_out)
+            if amounts[0] >= reserve_out:
+                raise Revert("ds-math-sub-underflow")
+            amounts.insert(0, reserve_in * amounts[0] * 1000 // ((reserve_out - amounts[0]) * 997) + 1)
+        return amounts
+
+    def _router_getAmountsOut(self, sender, to, amount_in, path, write, logs):
+        return self._amounts_out(amount_in, list(path))
+
+    def _router_getAmountsIn(self, sender, to, amount_out, path, write, logs):
+        return self._amounts_in(amount_out, list(path))
+
+    def _swap(self, sender: str, amounts: list, path: list, recipient: str, logs: list) -> list:
+        token_in = Web3.to_checksum_address(path[0])
+        allowances = self.tokens[token_in]['allowances']
+        allowed = allowances.get((sender, self.router), 0)
+        if allowed < amounts[0]:
+            raise Revert("TransferHelper: TRANSFER_FROM_FAILED")
+        allowances[(sender, self.router)] = allowed - amounts[0]
+        hops = self._hops(path)
+        self._transfer(token_in, sender, hops[0][0], amounts[0], logs)
+        for i, (pair, _, token_out) in enumerate(hops):
+            target = hops[i + 1][0] if i + 1 < len(hops) else Web3.to_checksum_address(recipient)
+            self._transfer(token_out, pair, target, amounts[i + 1], logs)
+        return amounts
+
+    def _router_swapExactTokensForTokens(self, sender, to, amount_in, amount_out_min, path, recipient, deadline, write, logs):
+        amounts = self._amounts_out(amount_in, list(path))
+        if amounts[-1] < amount_out_min:
+            raise Revert("UniswapV2Router: INSUFFICIENT_OUTPUT_AMOUNT")
+        return self._swap(sender, amounts, list(path), recipient, logs) if write else amounts
+
+    def _router_swapTokensForExactTokens(self, sender, to, amount_out, amount_in_max, path, recipient, deadline, write, logs):
+        amounts = self._amounts_in(amount_out, list(path))
+        if amounts[0] > amount_in_max:
+            raise Revert("UniswapV2Router: EXCESSIVE_INPUT_AMOUNT")
+        return self._swap(sender, amounts, list(path), recipient, logs) if write else amounts
+
+    # vaults
+    def _vault_getVaultState(self, sender, to, write, logs):
+        v = self.vaults[to]
+        balance = self.tokens[v['token1']]['balances'].get(to, 0)
+        return (v['shares'], balance, v['holders'], time.time() >= v['run'], v['closed'])
+
+    def _vault_runTimestamp(self, sender, to, write, logs):
+        return self.vaults[to]['run']
+
+    def _vault_stopTimestamp(self, sender, to, write, logs):
+        return self.vaults[to]['stop']
+
+    def _vault_manager(self, sender, to, write, logs):
+        return self.vaults[to]['manager']
+
+    def _vault_callWhitelisted(self, sender, to, target, data, write, logs):
+        if sender != self.vaults[to]['manager']:
+            raise Revert("Vault: Only manager can call this function")
+        return self._call(to, Web3.to_checksum_address(target), Web3.to_hex(data), write=write, logs=logs)
+
+    def _vault_updateVault(self, sender, to, token1, token2, run, stop, max_shareholders, write, logs):
+        v = self.vaults[to]
+        if sender != v['manager']:
+            raise Revert("Vault: Only manager can call this function")
+        if write:
+            v.update({'token1': Web3.to_checksum_address(token1), 'token2': Web3.to_checksum_address(token2),
+                      'run': run, 'stop': stop, 'closed': False})
+            logs.append({'address': to, 'topics': [VAULT_UPDATED_TOPIC, _topic(token1), _topic(token2)],
+                         'data': Web3.to_hex(encode(['uint256'] * 3, [run, stop, max_shareholders]))})
+
+    def _vault_withdraw(self, sender, to, write, logs):
+        v = self.vaults[to]
+        if sender != v['manager']:
+            raise Revert("Vault: Only manager can call this function")
+        if time.time() < v['stop']:
+            raise Revert("Vault: not stopped yet")
+        if write:
+            v['closed'] = True
+            logs.append({'address': to, 'topics': [VAULT_CLOSED_TOPIC], 'data': '0x'})
+
+
+class MockNode():
+    def __init__(self, chain: MockChain, latency: float = 0., method_latency: dict = None, host: str = '127.0.0.1', port: int = 0) -> None:
+        """
+        Serve chain over HTTP JSON-RPC (single requests and batches) from a background thread
+        latency: seconds added to every HTTP request, the network round trip to the relay
+        method_latency: extra seconds per call of a method, e.g. {'eth_sendRawTransaction': 0.2}
+        """
+        self.chain = chain
+        self.latency = latency
+        self.method_latency = method_latency or {}
+        self.requests = 0
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the relays
+            disable_nagle_algorithm = True  # headers and body go out in two writes
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+                calls = body if isinstance(body, list) else [body]
+                node.requests += 1
+                delay = node.latency + sum(node.method_latency.get(c.get('method'), 0.) for c in calls)
+                if delay > 0:
+                    time.sleep(delay)
+                responses = [node._answer(c) for c in calls]
+                out = json.dumps(responses if isinstance(body, list) else responses[0]).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def _answer(self, call: dict) -> dict:
+        try:
+            return {'jsonrpc': '2.0', 'id': call.get('id'), 'result': self.chain.handle(call['method'], call.get('params') or [])}
+        except RpcError as e:
+            return {'jsonrpc': '2.0', 'id': call.get('id'), 'error': {'code': e.code, 'message': str(e)}}
+        except Exception as e:
+            return {'jsonrpc': '2.0', 'id': call.get('id'), 'error': {'code': -32603, 'message': repr(e)}}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockNode':
+        self._thread = threading.Thread(target=self.server.serve_forever, name='mock-node', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,241 @@
+"""
+Offline benchmarks of the broker and bot hot paths against the mock node of bench/mock_node.py,
+no network, no Postgres:
+
+    python -m bench.run --latency 0.02 --out logs/bench/base.json
+    python -m bench.run --latency 0.02 --compare logs/bench/base.json
+"""
+import argparse, json, os, platform, statistics, subprocess, sys, time
+os.environ['DB_URL'] = 'sqlite:///:memory:'  # before db is imported, the bot writes its orders and trades here
+
+from eth_account import Account
+from bench.mock_node import MockChain, MockNode, VAULT_ABI
+from db import init_db
+from lib.metrics import METRICS
+from lib.trading import OrderPlan, Strategy, TradingBot
+from lib.broker.dex.hedera_swap import SwapBroker
+
+
+class BenchStrategy(Strategy):
+    def __init__(self, interval: str = '5m', price: float = 0.2):
+        """
+        Synthetic candles, one new bar per call, buy and sell signals in turn
+        """
+        super().__init__(interval=interval, price=price, bar=0, start=int(time.time()) // 300 * 300 - 300 * 100_000)
+
+    def get_data(self, tokens: list, currency: str):
+        import pandas as pd
+        self.bar += 1
+        rows = []
+        for token in tokens:
+            for i in range(60):
+                close = self.price * (1 + 0.001 * ((i + self.bar) % 7 - 3))
+                rows.append({'symbol': token + currency, 'timestamp': self.start + 300 * (i + self.bar),
+                             'open': close, 'high': close * 1.001, 'low': close * 0.999, 'close': close, 'volume': 1000.})
+        return pd.DataFrame(rows)
+
+    def run(self, pair: list, data, budget: float, bot: TradingBot):
+        price = float(data['close'].iloc[-1])
+        if self.bar % 2:
+            amount = budget * 0.1
+            bot.buy(pair, price, amount / price, amount)
+        else:
+            bot.sell(pair, price)
+        return None
+
+
+class Bench():
+    def __init__(self, latency: float = 0., method_latency: dict = None, confirm_delay: float = 0.) -> None:
+        """
+        A chain with USDC / WHBAR / SAUCE pools, a vault managed by a fresh wallet,
+        a SwapBroker and a TradingBot on it, served by a MockNode with the given latency
+        """
+        init_db()
+        chain = self.chain = MockChain(confirm_delay=confirm_delay)
+        for symbol, decimals in (('USDC', 6), ('WHBAR', 8), ('SAUCE', 6)):
+            chain.add_token(symbol, decimals)
+        chain.add_pair('USDC', 'WHBAR', 5_000_000, 25_000_000)  # 0.2 USDC per HBAR
+        chain.add_pair('WHBAR', 'SAUCE', 10_000_000, 2_000_000)
+        wallet = Account.create()
+        vault = chain.add_vault(wallet.address, 'USDC', 'WHBAR')
+        chain.mint('USDC', vault, 100_000)
+        chain.mint('WHBAR', vault, 20_000)
+        self.node = MockNode(chain, latency=latency, method_latency=method_latency).start()
+
+        self.broker = SwapBroker(rpcs=[self.node.url], ecosystem_token='WHBAR', contract_info=chain.contract_info())
+        self.bot = TradingBot(
+            id='bench_bot',
+            tokens=['WHBAR'],
+            currency='USDC',
+            call_budget=0.5,
+            invest_amount=50_000,
+            broker=self.broker,
+            strategy=BenchStrategy(),
+            wallet={'address': wallet.address, 'private': wallet.key},
+            vault=self.broker.gateway.eth.contract(address=vault, abi=VAULT_ABI),
+            notif_on=False,
+            lazy=True,
+        )
+        # prepare() registers the bot in the trade_bot schema of Postgres, the balance check is all the bench needs
+        self.bot.update_balance()
+        self.bot.update_fund()
+        self.bot._prepared = True
+
+    def plan(self, side: str = 'buy', qty: float = 10.) -> OrderPlan:
+        return OrderPlan(action='open', side=side, pair=['USDC', 'WHBAR'], qty=qty, price=0.2, estimated_amount=qty * 0.2)
+
+    def cases(self, trades: int = 10) -> dict:
+        """
+        name -> (setup, run): setup() is not timed, its result is passed to run()
+        """
+        bot, broker, chain = self.bot, self.broker, self.chain
+
+        def open_trades():
+            # one swap per trade still waiting for its receipt when checked: the receipts are held back,
+            # and each plan is submitted alone so the netter does not merge the identical plans into one swap
+            delay, chain.confirm_delay = chain.confirm_delay, 60.
+            try:
+                for _ in range(trades):
+                    bot.open_trade(self.plan(qty=1.), place=False)
+                    bot.submit_orders(flush=True)
+            finally:
+                chain.confirm_delay = delay
+
+        def check(_):
+            bot.checking_orders()
+            # keep the book the same size from one run to the next
+            chain.mine_pending()
+            bot.process_trades['opening'].clear()
+            bot.open_trades.clear()
+
+        def cycle(_):
+            from main import bot_run_with_vault_check
+            for _ in bot_run_with_vault_check(bot, 'WHBAR', 'USDC'):
+                pass  # no sleeping between the steps, the mock mines every tx at once
+
+        return {
+            'estimate': (None, lambda _: broker.estimate(['USDC', 'WHBAR'], broker.to_wei('WHBAR', 10))),
+            'check_balance': (None, lambda _: broker.check_balance(bot)),
+            'check_balance_recheck': (None, lambda _: broker.check_balance(bot, re_check=True)),
+            'place_order': (None, lambda _: broker.place_order(self.plan(), bot)),
+            'update_order': (lambda: broker.place_order(self.plan(), bot), lambda order: broker.update_order(order)),
+            f'checking_orders_{trades}': (open_trades, check),
+            'bot_cycle': (None, cycle),
+        }
+
+    def measure(self, setup, run, repeat: int = 20, warmup: int = 2) -> dict:
+        """
+        Time run over repeat calls after warmup ones: latency in ms and RPC calls per run
+        """
+        times, calls, methods = [], 0, {}
+        requests = self.node.requests
+        for i in range(warmup + repeat):
+            arg = setup() if setup else None
+            if i == warmup:
+                requests = self.node.requests
+            # process totals rather than METRICS.tally(): checking_orders updates its orders from worker threads
+            before = rpc_counts()
+            t = time.perf_counter()
+            run(arg)
+            elapsed = time.perf_counter() - t
+            after = rpc_counts()
+            if i < warmup:
+                continue
+            times.append(elapsed * 1000)
+            for name, n in after.items():
+                if n > before.get(name, 0):
+                    calls += n - before.get(name, 0)
+                    methods[name] = methods.get(name, 0) + n - before.get(name, 0)
+        times.sort()
+        return {
+            'runs': repeat,
+            'mean_ms': statistics.mean(times),
+            'p50_ms': times[len(times) // 2],
+            'p90_ms': times[min(len(times) - 1, int(len(times) * 0.9))],
+            'min_ms': times[0],
+            'max_ms': times[-1],
+            'rpc': calls / repeat,
+            'http_requests': (self.node.requests - requests) / repeat,  # setup included, a batch is one request
+            'rpc_by_method': {k: v / repeat for k, v in sorted(methods.items(), key=lambda kv: -kv[1])},
+        }
+
+
+def rpc_counts() -> dict:
+    counts = {}
+    for r in METRICS.snapshot():
+        name = f"{r['method']}:{r['function']}" if r['function'] else r['method']
+        counts[name] = counts.get(name, 0) + r['count']
+    return counts
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(base: dict, current: dict) -> None:
+    """
+    Print the p50 and RPC count change of every case against a previous result file
+    """
+    print(f"\n{'case':<28} {'p50 base':>10} {'p50 now':>10} {'change':>8}   {'rpc base':>8} {'rpc now':>8}")
+    for name, now in current['results'].items():
+        was = base.get('results', {}).get(name)
+        if was is None:
+            print(f"{name:<28} {'-':>10} {now['p50_ms']:10.2f} {'new':>8}   {'-':>8} {now['rpc']:8.1f}")
+            continue
+        change = (now['p50_ms'] - was['p50_ms']) / was['p50_ms'] * 100 if was['p50_ms'] else 0.
+        print(f"{name:<28} {was['p50_ms']:10.2f} {now['p50_ms']:10.2f} {change:+7.1f}%   {was['rpc']:8.1f} {now['rpc']:8.1f}")
+    if base.get('settings') != current.get('settings'):
+        print(f"Settings differ: base {base.get('settings')} now {current.get('settings')}")
+
+
+def main(argv: list = None) -> dict:
+    parser = argparse.ArgumentParser(description='Benchmark the broker and bot hot paths against a local mock node')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every HTTP request')
+    parser.add_argument('--method-latency', type=json.loads, default={}, help='json, e.g. {"eth_sendRawTransaction": 0.2}')
+    parser.add_argument('--confirm-delay', type=float, default=0., help='seconds before a sent tx has its receipt')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--trades', type=int, default=10, help='trades in process for checking_orders')
+    parser.add_argument('--only', nargs='*', help='run these cases only')
+    parser.add_argument('--out', help='write the results to this json file')
+    parser.add_argument('--compare', help='result file of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    settings = {'latency': args.latency, 'method_latency': args.method_latency, 'confirm_delay': args.confirm_delay,
+                'repeat': args.repeat, 'trades': args.trades}
+    bench = Bench(latency=args.latency, method_latency=args.method_latency, confirm_delay=args.confirm_delay)
+    results = {}
+    for name, (setup, run) in bench.cases(trades=args.trades).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = r = bench.measure(setup, run, repeat=args.repeat, warmup=args.warmup)
+        print(f"{name:<28} p50 {r['p50_ms']:9.2f}ms p90 {r['p90_ms']:9.2f}ms mean {r['mean_ms']:9.2f}ms "
+              f"{r['rpc']:6.1f} rpc {r['http_requests']:6.1f} http")
+    bench.node.stop()
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results,
+    }
+    if args.out:
+        folder = os.path.dirname(args.out)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(args.out, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
 import os
 from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, inspect
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
+from sqlalchemy.schema import CreateColumn
 from db.connection import get_engine
 from db.models.order import Order
-from db.models.trade import Trade 
+from db.models.trade import Trade
+from db.models.rollup import Rollup
 Base = declarative_base()
 
 def init_db():
@@ -17,3 +19,44 @@ def init_db():
     if 'orders' not in existing_tables:
         print("Creating 'orders' table...")
         Order.__table__.create(bind=engine, checkfirst=True)
+    if 'equity_rollups' not in existing_tables:
+        print("Creating 'equity_rollups' table...")
+        Rollup.__table__.create(bind=engine, checkfirst=True)
+    # tables created by an older version: add the new columns and indexes
+    for model in (Order, Trade, Rollup):
+        if model.__tablename__ in existing_tables:
+            upgrade_table(engine, model.__table__)
+
+def upgrade_table(engine, table):
+    """
+    Add the columns and indexes of table missing in the database. On MySQL / MariaDB, existing numeric columns
+    whose signedness differs from the model (trades.profit was unsigned) are modified too,
+    other existing columns are left untouched.
+    """
+    inspector = inspect(engine)
+    columns = {c['name']: c for c in inspector.get_columns(table.name)}
+    indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+    mysql = engine.dialect.name in ('mysql', 'mariadb')
+    with engine.begin() as conn:
+        for column in table.columns:
+            ddl = CreateColumn(column).compile(dialect=engine.dialect)
+            if column.name not in columns:
+                print(f"Adding column {table.name}.{column.name}...")
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+            elif mysql and signed_changed(columns[column.name]['type'], column.type):
+                # an unsigned column rejects (strict mode) or clamps to 0 the negative values of a signed one
+                print(f"Changing the signedness of {table.name}.{column.name}...")
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} MODIFY {ddl}")
+    for index in table.indexes:
+        if index.name not in indexes:
+            print(f"Creating index {index.name} on {table.name}...")
+            index.create(bind=engine, checkfirst=True)
+
+def signed_changed(current, wanted) -> bool:
+    """
+    Whether a reflected numeric column type and the model one differ in signedness (MySQL UNSIGNED)
+    """
+    # only the MySQL numeric types know signedness, strings and dates never differ here
+    if not hasattr(current, 'unsigned') and not hasattr(wanted, 'unsigned'):
+        return False
+    return bool(getattr(current, 'unsigned', False)) != bool(getattr(wanted, 'unsigned', False))
@@ -0,0 +1,295 @@
+from decimal import Decimal
+from typing import Iterator, Optional
+from sqlalchemy import select, func, case, and_, or_, union_all
+from sqlalchemy.engine import Engine
+from db.connection import get_engine
+from db.models.order import Order
+from db.models.trade import Trade
+from db.models.rollup import Rollup
+
+BUCKETS = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+
+
+def _row(row) -> dict:
+    # DECIMAL sums come back as Decimal on some dialects
+    return {k: float(v) if isinstance(v, Decimal) else v for k, v in row._mapping.items()}
+
+
+class TradeAnalytics():
+    def __init__(self, engine: Engine = None, page_size: int = 500) -> None:
+        """
+        Read-only queries on the trades and orders tables, aggregated by the database.
+        Lists are paginated with a keyset cursor (the last (time, id) seen) instead of OFFSET,
+        so a page costs the same on page 1 and page 10000. iter_* stream through a server-side cursor.
+        Times are the epoch seconds stored in the tables.
+        page_size: default number of rows per page
+        """
+        self.engine = engine
+        self.page_size = page_size
+
+    def _connect(self):
+        return (self.engine or get_engine()).connect()
+
+    # --- lists ---
+
+    def _trades_query(self, bot_id=None, status=None, pair=None, since=None, until=None, desc=False):
+        t = Trade.__table__
+        query = select(t)
+        if bot_id is not None:
+            query = query.where(t.c.bot_id == bot_id)
+        if status is not None:
+            query = query.where(t.c.status.in_(status) if isinstance(status, (list, tuple, set)) else t.c.status == status)
+        if pair is not None:
+            query = query.where(t.c.pair == pair)
+        if since is not None:
+            query = query.where(t.c.entry_time >= since)
+        if until is not None:
+            query = query.where(t.c.entry_time < until)
+        if desc:
+            return query.order_by(t.c.entry_time.desc(), t.c.id.desc())
+        return query.order_by(t.c.entry_time, t.c.id)
+
+    def _orders_query(self, symbol=None, since=None, until=None):
+        o = Order.__table__
+        query = select(o)
+        if symbol is not None:
+            query = query.where(o.c.symbol == symbol)
+        if since is not None:
+            query = query.where(o.c.create_time >= since)
+        if until is not None:
+            query = query.where(o.c.create_time < until)
+        return query.order_by(o.c.create_time, o.c.id)
+
+    def _page(self, query, time_col, id_col, limit: int = None, cursor: list = None, desc: bool = False) -> dict:
+        limit = limit or self.page_size
+        if cursor:
+            last_time, last_id = cursor
+            if desc:
+                query = query.where(or_(time_col < last_time, and_(time_col == last_time, id_col < last_id)))
+            else:
+                query = query.where(or_(time_col > last_time, and_(time_col == last_time, id_col > last_id)))
+        with self._connect() as conn:
+            rows = [_row(r) for r in conn.execute(query.limit(limit + 1))]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = [rows[-1][time_col.name], rows[-1][id_col.name]] if more else None
+        return {'items': rows, 'next': next_cursor}
+
+    def _stream(self, query, batch: int) -> Iterator[dict]:
+        with self._connect() as conn:
+            # server-side cursor: rows arrive in batches, the result set is never held in memory
+            result = conn.execution_options(stream_results=True, yield_per=batch).execute(query)
+            for row in result:
+                yield _row(row)
+
+    def trades(self, bot_id: str = None, status=None, pair: str = None, since: int = None, until: int = None,
+               limit: int = None, cursor: list = None, desc: bool = False) -> dict:
+        """
+        One page of trades ordered by entry_time
+        status: one status ('open', 'close', ...) or a list of them
+        cursor: 'next' of the previous page, None for the first page
+        desc: newest first
+        Returns {'items': [row dict, ...], 'next': cursor of the next page or None}
+        """
+        t = Trade.__table__
+        return self._page(self._trades_query(bot_id, status, pair, since, until, desc), t.c.entry_time, t.c.id, limit, cursor, desc)
+
+    def iter_trades(self, bot_id: str = None, status=None, pair: str = None, since: int = None, until: int = None,
+                    batch: int = 1000) -> Iterator[dict]:
+        """
+        Every matching trade ordered by entry_time, streamed
+        """
+        return self._stream(self._trades_query(bot_id, status, pair, since, until), batch)
+
+    def orders(self, symbol: str = None, since: int = None, until: int = None,
+               limit: int = None, cursor: list = None) -> dict:
+        """
+        One page of orders ordered by create_time, same paging as trades()
+        """
+        o = Order.__table__
+        return self._page(self._orders_query(symbol, since, until), o.c.create_time, o.c.id, limit, cursor)
+
+    def iter_orders(self, symbol: str = None, since: int = None, until: int = None, batch: int = 1000) -> Iterator[dict]:
+        return self._stream(self._orders_query(symbol, since, until), batch)
+
+    # --- aggregates ---
+
+    @staticmethod
+    def _group(by: Optional[str], bot_col, pair_col, time_col) -> list:
+        if by is None:
+            return []
+        if by == 'bot':
+            return [bot_col.label('bot_id')]
+        if by == 'pair':
+            return [pair_col.label('pair')]
+        if by == 'bot_pair':
+            return [bot_col.label('bot_id'), pair_col.label('pair')]
+        if by in BUCKETS:
+            # integer arithmetic on epoch seconds, same SQL on every dialect
+            return [(time_col - time_col % BUCKETS[by]).label('time')]
+        raise ValueError(f"Unknown grouping {by}, use None, 'bot', 'pair', 'bot_pair' or one of {list(BUCKETS)}")
+
+    def pnl(self, bot_id: str = None, pair: str = None, since: int = None, until: int = None, by: str = None) -> list:
+        """
+        Realized PnL of closed trades (by exit_time)
+        by: None for one total, 'bot', 'pair', 'bot_pair', 'minute', 'hour', 'day' or 'week'
+        Returns a list of {group keys..., trades, wins, losses, win_rate, profit, gross_profit,
+            gross_loss, avg_profit, invested, return}
+        """
+        t = Trade.__table__
+        keys = self._group(by, t.c.bot_id, t.c.pair, t.c.exit_time)
+        query = select(
+            *keys,
+            func.count().label('trades'),
+            func.sum(case((t.c.profit > 0, 1), else_=0)).label('wins'),
+            func.sum(case((t.c.profit < 0, 1), else_=0)).label('losses'),
+            func.coalesce(func.sum(t.c.profit), 0).label('profit'),
+            func.coalesce(func.sum(case((t.c.profit > 0, t.c.profit), else_=0)), 0).label('gross_profit'),
+            func.coalesce(func.sum(case((t.c.profit < 0, t.c.profit), else_=0)), 0).label('gross_loss'),
+            func.coalesce(func.sum(t.c.invested_amount), 0).label('invested'),
+        ).where(t.c.status == 'close')
+        if bot_id is not None:
+            query = query.where(t.c.bot_id == bot_id)
+        if pair is not None:
+            query = query.where(t.c.pair == pair)
+        if since is not None:
+            query = query.where(t.c.exit_time >= since)
+        if until is not None:
+            query = query.where(t.c.exit_time < until)
+        if keys:
+            query = query.group_by(*keys).order_by(*keys)
+        with self._connect() as conn:
+            rows = [_row(r) for r in conn.execute(query)]
+        for row in rows:
+            # ratios of the aggregates, the rows themselves never leave the database
+            row['wins'] = int(row['wins'] or 0)
+            row['losses'] = int(row['losses'] or 0)
+            row['win_rate'] = row['wins'] / row['trades'] if row['trades'] else None
+            row['avg_profit'] = row['profit'] / row['trades'] if row['trades'] else None
+            row['return'] = row['profit'] / row['invested'] if row['invested'] else None
+        return [r for r in rows if r['trades']]
+
+    def win_rate(self, bot_id: str = None, pair: str = None, since: int = None, until: int = None) -> Optional[float]:
+        """
+        Share of closed trades with a positive profit, None without closed trades
+        """
+        rows = self.pnl(bot_id=bot_id, pair=pair, since=since, until=until)
+        return rows[0]['win_rate'] if rows else None
+
+    def exposure(self, bot_id: str = None, by: str = 'bot_pair') -> list:
+        """
+        Money currently in open trades
+        by: 'bot', 'pair', 'bot_pair' or None for one total
+        Returns a list of {group keys..., trades, invested, position_size}
+        """
+        t = Trade.__table__
+        keys = self._group(by, t.c.bot_id, t.c.pair, t.c.entry_time)
+        query = select(
+            *keys,
+            func.count().label('trades'),
+            func.coalesce(func.sum(t.c.invested_amount), 0).label('invested'),
+            func.coalesce(func.sum(t.c.position_size), 0).label('position_size'),
+        ).where(t.c.status == 'open')
+        if bot_id is not None:
+            query = query.where(t.c.bot_id == bot_id)
+        if keys:
+            query = query.group_by(*keys).order_by(*keys)
+        with self._connect() as conn:
+            return [_row(r) for r in conn.execute(query) if r.trades]
+
+    def fees(self, bot_id: str = None, pair: str = None, since: int = None, until: int = None, by: str = None) -> list:
+        """
+        Network fees paid by orders (by create_time)
+        Without bot_id every order counts, with bot_id (or by 'bot' / 'bot_pair') only the
+        entry / exit orders of the trades of the bots, which leaves out vault swaps
+        Returns a list of {group keys..., orders, fee}
+        """
+        o = Order.__table__
+        if bot_id is None and by not in ('bot', 'bot_pair'):
+            keys = self._group(by, None, o.c.symbol, o.c.create_time)
+            query = select(*keys, func.count().label('orders'), func.coalesce(func.sum(o.c.fee), 0).label('fee'))
+            if pair is not None:
+                query = query.where(o.c.symbol == pair)
+            time_col = o.c.create_time
+        else:
+            # one row per (trade, order), an OR join would not use the primary key on every dialect
+            t = Trade.__table__
+            legs = []
+            for order_col in (t.c.entry_order_id, t.c.exit_order_id):
+                leg = select(t.c.bot_id, t.c.pair, o.c.create_time, o.c.fee).select_from(t.join(o, o.c.id == order_col))
+                legs.append(leg.where(t.c.bot_id == bot_id) if bot_id is not None else leg)
+            legs = union_all(*legs).subquery()
+            keys = self._group(by, legs.c.bot_id, legs.c.pair, legs.c.create_time)
+            query = select(*keys, func.count().label('orders'), func.coalesce(func.sum(legs.c.fee), 0).label('fee'))
+            if pair is not None:
+                query = query.where(legs.c.pair == pair)
+            time_col = legs.c.create_time
+        if since is not None:
+            query = query.where(time_col >= since)
+        if until is not None:
+            query = query.where(time_col < until)
+        if keys:
+            query = query.group_by(*keys).order_by(*keys)
+        with self._connect() as conn:
+            return [_row(r) for r in conn.execute(query) if r.orders]
+
+    # --- rollups ---
+
+    def equity_curve(self, bot_id: str, pair: str = '*', resolution: str = 'hour',
+                     since: int = None, until: int = None) -> list:
+        """
+        Equity and realized PnL buckets of a bot (pair '*') or of one of its pairs, from the rollup table
+        resolution: 'minute', 'hour' or 'day'
+        Returns a list of {time, equity_open, equity_high, equity_low, equity_close, peak, drawdown,
+            max_drawdown, trades, wins, realized, cum_realized}, drawdown is the fall under the peak at the bucket close
+        """
+        r = Rollup.__table__
+        query = select(
+            r.c.time, r.c.equity_open, r.c.equity_high, r.c.equity_low, r.c.equity_close, r.c.peak,
+            r.c.max_drawdown, r.c.trades, r.c.wins, r.c.realized, r.c.cum_realized,
+        ).where(r.c.bot_id == bot_id, r.c.pair == pair, r.c.resolution == resolution)
+        if since is not None:
+            query = query.where(r.c.time >= since)
+        if until is not None:
+            query = query.where(r.c.time < until)
+        with self._connect() as conn:
+            rows = [_row(x) for x in conn.execute(query.order_by(r.c.time))]
+        for row in rows:
+            row['drawdown'] = 1 - row['equity_close'] / row['peak'] if row['equity_close'] is not None and row['peak'] else 0.
+        return rows
+
+    def drawdown(self, bot_id: str, pair: str = '*', resolution: str = 'hour',
+                 since: int = None, until: int = None) -> dict:
+        """
+        Drawdown summary of a bot or pair over a period, aggregated by the database from the rollups
+        Returns {max_drawdown, peak, equity, drawdown}: deepest fall under the running peak in the period,
+            and the peak / equity / fall at the last bucket
+        """
+        r = Rollup.__table__
+        where = [r.c.bot_id == bot_id, r.c.pair == pair, r.c.resolution == resolution]
+        if since is not None:
+            where.append(r.c.time >= since)
+        if until is not None:
+            where.append(r.c.time < until)
+        with self._connect() as conn:
+            worst = conn.execute(select(func.max(r.c.max_drawdown)).where(*where)).scalar()
+            last = conn.execute(select(r.c.peak, r.c.equity_close).where(*where).order_by(r.c.time.desc()).limit(1)).first()
+        last = _row(last) if last is not None else {}
+        peak, equity = last.get('peak'), last.get('equity_close')
+        return {
+            'max_drawdown': float(worst or 0),
+            'peak': peak,
+            'equity': equity,
+            'drawdown': 1 - equity / peak if equity is not None and peak else 0.,
+        }
+
+    def latest_equity(self, bot_id: str, pair: str = '*', resolution: str = 'minute') -> Optional[float]:
+        """
+        Last marked equity of a bot (its NAV) or pair, one indexed row read
+        """
+        r = Rollup.__table__
+        query = select(r.c.equity_close).where(
+            r.c.bot_id == bot_id, r.c.pair == pair, r.c.resolution == resolution, r.c.equity_close.isnot(None),
+        ).order_by(r.c.time.desc()).limit(1)
+        with self._connect() as conn:
+            return conn.execute(query).scalar()
@@ -1,27 +1,96 @@
 import os,dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from sqlalchemy.pool import StaticPool
 
 # load environment variables
 dotenv.load_dotenv()
 DB_URL = os.getenv('DB_URL', 'sqlite:///trade_bot.db')
+# connection pool, sized for the bots / workers sharing the process
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
 
 _engine = None
 _SessionLocal = None
+_ScopedSession = None
+
+def _engine_options(url: str) -> dict:
+    if url.startswith('sqlite'):
+        if ':memory:' in url or url.rstrip('/') == 'sqlite:':
+            # one shared connection, an in-memory database only exists inside it
+            return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+        return {
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            # wait for the file lock instead of failing with "database is locked"
+            'connect_args': {'check_same_thread': False, 'timeout': DB_POOL_TIMEOUT},
+        }
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_pre_ping': True,   # checks connection before using
+        'pool_recycle': 1800,    # below MySQL wait_timeout, avoids stale connections
+    }
 
 def get_engine():
     global _engine
     if _engine is None:
-        _engine = create_engine(
-            DB_URL,
-            pool_pre_ping=True,   # checks connection before using
-            pool_recycle=1800,    # optional: avoids stale timeouts
-            connect_args={"check_same_thread": False} if "sqlite" in DB_URL else {},
-        )
+        _engine = create_engine(DB_URL, **_engine_options(DB_URL))
+        if DB_URL.startswith('sqlite'):
+            @event.listens_for(_engine, 'connect')
+            def _sqlite_pragmas(dbapi_connection, connection_record):
+                # WAL: readers do not block the writer, so parallel bots do not serialize on the file
+                cursor = dbapi_connection.cursor()
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+                cursor.close()
     return _engine
 
 def get_session() -> Session:
+    """
+    New independent session, the caller closes it (prefer session_scope)
+    """
     global _SessionLocal
     if _SessionLocal is None:
         _SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
-    return _SessionLocal()
\ No newline at end of file
+    return _SessionLocal()
+
+def current_session() -> Session:
+    """
+    Session of the current thread, created on first use and kept until remove_session()
+    """
+    global _ScopedSession
+    if _ScopedSession is None:
+        get_session().close()  # make sure the sessionmaker exists
+        _ScopedSession = scoped_session(_SessionLocal)
+    return _ScopedSession()
+
+def remove_session() -> None:
+    """
+    Close the session of the current thread and return its connection to the pool,
+    call at the end of a task (bot cycle, worker job) so the next one starts with a fresh identity map
+    """
+    if _ScopedSession is not None:
+        _ScopedSession.remove()
+
+@contextmanager
+def session_scope(commit: bool = True):
+    """
+    Unit of work: a short-lived session committed on success, rolled back on error, always closed
+    with session_scope() as db:
+        db.add(obj)
+    """
+    session = get_session()
+    try:
+        yield session
+        if commit:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
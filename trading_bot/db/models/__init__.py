@@ -1,2 +1,3 @@
 from .order import Order as OrderModel
-from .trade import Trade as TradeModel
\ No newline at end of file
+from .trade import Trade as TradeModel
+from .rollup import Rollup as RollupModel
@@ -1,13 +1,18 @@
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy import inspect
 from sqlalchemy.ext.declarative import declarative_base
-from db.connection import get_session
+from db.connection import current_session
 
 Base = declarative_base()
 
+class _ThreadSession:
+    # resolves ORMModel.db to the session of the calling thread
+    def __get__(self, obj, owner):
+        return current_session()
+
 class ORMModel:
-    # Shared DB session from singleton
-    db = get_session()
+    # DB session of the current thread (see db.connection.current_session)
+    db = _ThreadSession()
     def __init__(self, **kwargs):
         # Let SQLAlchemy handle known DB fields
         db_columns = {c.key for c in self.__table__.columns}
@@ -1,7 +1,7 @@
 # models/order.py
 
 from typing import List
-from sqlalchemy import Column, String, Integer,Double, ForeignKey
+from sqlalchemy import Column, String, Integer,Double, ForeignKey, Index
 from sqlalchemy.dialects.mysql import DOUBLE, FLOAT
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from sqlalchemy.ext.declarative import declarative_base
@@ -10,6 +10,9 @@ from db.models.base import Base, ORMModel
 class Order(ORMModel, Base):  # Must inherit in order to use ORMModel __init__ and methods
     __tablename__ = "orders"
     # __table_args__ = {'schema': 'trade_bot'}
+    __table_args__ = (
+        Index('ix_orders_symbol_create', 'symbol', 'create_time'),
+    )
 
     id:Mapped[str] = mapped_column(String(50), primary_key=True)
     symbol:Mapped[str] = Column(String(50), nullable=True)
@@ -24,6 +27,7 @@ class Order(ORMModel, Base):  # Must inherit in order to use ORMModel __init__ a
     filled_time:Mapped[int] = Column(Integer, nullable=True)
     tx :Mapped[str] = Column(String(50), nullable=True)
     tx_link:Mapped[str] = Column(String(255), nullable=True)
+    fee:Mapped[float] = Column(DOUBLE(unsigned=True), nullable=True)  # network fee reported by the broker
 
     # Optional reverse relationships:
     entry_trades = relationship("Trade", back_populates="entry_order", foreign_keys="Trade.entry_order_id")
@@ -0,0 +1,33 @@
+# models/rollup.py
+
+from sqlalchemy import Column, String, Integer, Index
+from sqlalchemy.dialects.mysql import DOUBLE
+from sqlalchemy.orm import Mapped, mapped_column
+from db.models.base import Base, ORMModel
+
+class Rollup(ORMModel, Base):  # Must inherit in order to use ORMModel __init__ and methods
+    __tablename__ = "equity_rollups"
+    __table_args__ = (
+        # equity curve of a bot / pair at one resolution in time order
+        Index('ix_rollups_bot_pair_res_time', 'bot_id', 'pair', 'resolution', 'time'),
+    )
+
+    id:Mapped[str] = mapped_column(String(150), primary_key=True)  # bot_id:pair:resolution:time
+    bot_id:Mapped[str] = Column(String(50), nullable=False)
+    pair:Mapped[str] = Column(String(50), nullable=False)  # symbol, '*' for the whole bot
+    resolution:Mapped[str] = Column(String(10), nullable=False)  # 'minute', 'hour', 'day'
+    time:Mapped[int] = Column(Integer, nullable=False)  # bucket start, epoch seconds
+    trades:Mapped[int] = Column(Integer, nullable=True)  # trades closed in the bucket
+    wins:Mapped[int] = Column(Integer, nullable=True)
+    realized:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)  # profit of the trades closed in the bucket
+    cum_realized:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)  # profit of every trade closed until the bucket end
+    equity_open:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)
+    equity_high:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)
+    equity_low:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)
+    equity_close:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)
+    peak:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)  # highest equity ever marked until the bucket end
+    max_drawdown:Mapped[float] = Column(DOUBLE(asdecimal=False), nullable=True)  # deepest fall under the peak inside the bucket, fraction
+    updated:Mapped[int] = Column(Integer, nullable=True)
+
+    def __repr__(self):
+        return f"Rollup(id={self.id}, equity_close={self.equity_close}, realized={self.realized})"
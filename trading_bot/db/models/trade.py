@@ -1,7 +1,7 @@
 # models/trade.py
 
 from typing import List
-from sqlalchemy import Column, String, Integer, Float, Double, ForeignKey
+from sqlalchemy import Column, String, Integer, Float, Double, ForeignKey, Index
 from sqlalchemy.dialects.mysql import DOUBLE, FLOAT
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from sqlalchemy.ext.declarative import declarative_base
@@ -10,6 +10,12 @@ from db.models.base import Base, ORMModel
 class Trade(ORMModel, Base):  # Must inherit in order to use ORMModel __init__ and methods
     __tablename__ = "trades"
     # __table_args__ = {'schema': 'trade_bot'}
+    __table_args__ = (
+        # open / closed trades of a bot in time order, PnL per bot and period
+        Index('ix_trades_bot_status_entry', 'bot_id', 'status', 'entry_time'),
+        # PnL per pair and period of closed trades
+        Index('ix_trades_pair_exit', 'pair', 'exit_time'),
+    )
 
     id:Mapped[str] = mapped_column(String(50), primary_key=True)
     bot_id:Mapped[str] = Column(String(50), nullable=True)
@@ -20,7 +26,7 @@ class Trade(ORMModel, Base):  # Must inherit in order to use ORMModel __init__ a
     invested_amount:Mapped[float] = Column(FLOAT(unsigned=True), nullable=True)
     position_size:Mapped[float] = Column(DOUBLE(unsigned=True), nullable=True)
     net_return:Mapped[float] = Column(FLOAT(unsigned=True), nullable=True)
-    profit:Mapped[float] = Column(FLOAT(unsigned=True), nullable=True)
+    profit:Mapped[float] = Column(FLOAT, nullable=True)  # signed, losing trades are negative
     entry_price:Mapped[float] = Column(FLOAT(unsigned=True), nullable=True)
     exit_price:Mapped[float] = Column(FLOAT(unsigned=True), nullable=True)
     entry_time:Mapped[int] = Column(Integer, nullable=True)
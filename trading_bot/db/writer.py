@@ -0,0 +1,196 @@
+import atexit, threading
+from sqlalchemy import Table
+from sqlalchemy.schema import sort_tables
+from sqlalchemy.exc import OperationalError, InterfaceError
+from sqlalchemy.engine import Engine
+from db.connection import get_engine
+
+
+class WriteBehind():
+    def __init__(self, engine: Engine = None, interval: float = 2, max_pending: int = 5000) -> None:
+        """
+        Write-behind persistence of ORM rows.
+        put() only queues the row: repeated writes of the same id are merged in memory,
+        a background thread writes everything queued in one transaction per flush
+        with a dialect-native bulk upsert (SQLite / PostgreSQL ON CONFLICT, MySQL ON DUPLICATE KEY).
+        interval: seconds between two flushes
+        max_pending: flush early once this many rows are queued
+        """
+        self.engine = engine
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}      # table name -> {id: row}
+        self._tables = {}       # table name -> Table
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flushed = threading.Condition()
+        self._gen = 0           # number of put() calls
+        self._written = 0       # puts known to be in the database
+        self._stop = False
+        self._thread = None
+        self.stats = {'rows': 0, 'flushes': 0, 'coalesced': 0, 'errors': 0}
+
+    def put(self, model, row: dict) -> None:
+        """
+        Queue an upsert of row into the table of model, never blocks on the database
+        row: must hold the primary key, and every NOT NULL column for a row that may not exist yet
+        """
+        table = model.__table__
+        key = row[table.primary_key.columns.keys()[0]]
+        with self._lock:
+            rows = self._pending.setdefault(table.name, {})
+            self._tables.setdefault(table.name, table)
+            self._gen += 1
+            if key in rows:
+                rows[key].update(row)
+                self.stats['coalesced'] += 1
+            else:
+                rows[key] = dict(row)
+            size = sum(len(r) for r in self._pending.values())
+        self._start()
+        if size >= self.max_pending:
+            self._wake.set()
+
+    def flush(self, wait: bool = False, timeout: float = 30) -> None:
+        """
+        Ask for a flush now, wait=True blocks until the rows queued so far are written
+        """
+        with self._lock:
+            target = self._gen
+        self._start()
+        self._wake.set()
+        if wait:
+            with self._flushed:
+                self._flushed.wait_for(lambda: self._written >= target, timeout)
+
+    def _start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._write()
+
+    def _write(self) -> None:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            tables = sort_tables(self._tables.values())  # orders before the trades referencing them
+            gen = self._gen
+        written = True
+        if batch:
+            engine = self.engine or get_engine()
+            try:
+                with engine.begin() as conn:  # one transaction for the whole batch
+                    for table in tables:
+                        rows = list(batch.get(table.name, {}).values())
+                        if rows:
+                            self._upsert(conn, table, rows)
+                self.stats['rows'] += sum(len(r) for r in batch.values())
+                self.stats['flushes'] += 1
+            except (OperationalError, InterfaceError) as e:
+                # database unreachable: keep everything for the next flush
+                written = False
+                self.stats['errors'] += 1
+                print(f"Error writing {sum(len(r) for r in batch.values())} rows to database, retry next flush: {e}")
+                self._requeue(batch)
+            except Exception as e:
+                # a bad row must not block the others: write one by one, drop the rows the database rejects
+                print(f"Error writing batch to database, retrying row by row: {e}")
+                written = self._write_rows(engine, tables, batch)
+        with self._flushed:
+            if written:
+                self._written = max(self._written, gen)
+            self._flushed.notify_all()
+
+    def _requeue(self, batch: dict) -> None:
+        with self._lock:
+            # put the batch back under any newer write of the same ids
+            for name, rows in batch.items():
+                pending = self._pending.setdefault(name, {})
+                for key, row in rows.items():
+                    pending[key] = {**row, **pending.get(key, {})}
+
+    def _write_rows(self, engine, tables: list, batch: dict) -> bool:
+        for table in tables:
+            rows = batch.get(table.name, {})
+            for key in list(rows):
+                try:
+                    with engine.begin() as conn:
+                        self._upsert(conn, table, [rows[key]])
+                    self.stats['rows'] += 1
+                except (OperationalError, InterfaceError) as e:
+                    print(f"Error writing rows to database, retry next flush: {e}")
+                    self._requeue(batch)
+                    return False
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    print(f"Row {table.name}.{key} rejected by the database, dropped: {e}")
+                rows.pop(key)
+        self.stats['flushes'] += 1
+        return True
+
+    def _upsert(self, conn, table: Table, rows: list) -> None:
+        # rows with the same columns share one multi-row statement, missing columns are left untouched
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        keys = set(table.primary_key.columns.keys())
+        dialect = conn.engine.dialect.name
+        for columns, group in groups.items():
+            updates = [c for c in columns if c not in keys]
+            if dialect in ('sqlite', 'postgresql'):
+                if dialect == 'sqlite':
+                    from sqlalchemy.dialects.sqlite import insert
+                else:
+                    from sqlalchemy.dialects.postgresql import insert
+                stmt = insert(table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=list(keys),
+                    set_={c: stmt.excluded[c] for c in updates},
+                ) if updates else stmt.on_conflict_do_nothing(index_elements=list(keys))
+            elif dialect in ('mysql', 'mariadb'):
+                from sqlalchemy.dialects.mysql import insert
+                stmt = insert(table)
+                stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in (updates or list(keys))})
+            else:
+                # no native upsert: update then insert the missing ones
+                for row in group:
+                    where = [table.c[k] == row[k] for k in keys]
+                    if updates and conn.execute(table.update().where(*where).values(**{c: row[c] for c in updates})).rowcount:
+                        continue
+                    if not updates and conn.execute(table.select().where(*where)).first() is not None:
+                        continue
+                    conn.execute(table.insert().values(**row))
+                continue
+            conn.execute(stmt, group)
+
+    def close(self) -> None:
+        """
+        Write what is still queued and stop the thread
+        """
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=30)
+        self._write()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> WriteBehind:
+    """
+    Process-wide write-behind queue shared by every bot, flushed at exit
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteBehind()
+            atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,150 @@
+import time, threading
+from collections import OrderedDict
+from web3 import Web3
+
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+
+
+def address_topic(address: str) -> str:
+    """
+    32 bytes log topic of an address
+    """
+    return '0x' + '0' * 24 + address.lower().replace('0x', '')
+
+
+class BalanceLedger():
+    def __init__(self, gateway: Web3, address: str, tokens: dict, reconcile_interval: float = 900,
+                 sync_interval: float = 10, max_log_range: int = 1000) -> None:
+        """
+        Local ERC-20 balances of one address (the vault), kept up to date from Transfer logs.
+        gateway: web3 gateway
+        address: address to track
+        tokens: {symbol: [address, abi]} to track
+        reconcile_interval: seconds between full balanceOf rescans, catching any drift
+        sync_interval: minimum seconds between two log syncs
+        max_log_range: reseed instead of asking the node for more blocks of logs than this
+        """
+        self.gateway = gateway
+        self.address = Web3.to_checksum_address(address)
+        self.tokens = {}        # symbol -> checksum token address
+        self.contracts = {}     # symbol -> token contract
+        self.balances = {}      # symbol -> qty in wei
+        self.last_block = None  # last block applied to balances
+        self.last_sync = 0.
+        self.last_reconcile = 0.
+        self.reconcile_interval = reconcile_interval
+        self.sync_interval = sync_interval
+        self.max_log_range = max_log_range
+        self._topic = address_topic(self.address)
+        self._seen_tx = OrderedDict()   # recent tx hashes already applied (logs or receipts), never applied twice
+        self._lock = threading.RLock()
+        for symbol, (t_add, t_abi) in tokens.items():
+            self.add_token(symbol, t_add, t_abi)
+
+    def add_token(self, symbol: str, t_add: str, t_abi) -> None:
+        with self._lock:
+            if symbol in self.tokens:
+                return
+            self.tokens[symbol] = Web3.to_checksum_address(t_add)
+            self.contracts[symbol] = self.gateway.eth.contract(address=self.tokens[symbol], abi=t_abi)
+            if self.last_block is not None:
+                self.balances[symbol] = self.contracts[symbol].functions.balanceOf(self.address).call(block_identifier=self.last_block)
+
+    def seed(self) -> dict:
+        """
+        Full rescan: read every balance at one block, logs after that block are applied by sync
+        """
+        with self._lock:
+            block = self.gateway.eth.block_number
+            balances = {
+                symbol: contract.functions.balanceOf(self.address).call(block_identifier=block)
+                for symbol, contract in self.contracts.items()
+            }
+            drift = {s: q - self.balances.get(s, 0) for s, q in balances.items() if q != self.balances.get(s, 0)}
+            if self.last_block is not None and drift:
+                print(f"Ledger {self.address} reconciled, drift (wei): {drift}")
+            self.balances = balances
+            self.last_block = block
+            self.last_sync = self.last_reconcile = time.time()
+            return self.balances
+
+    def reconcile(self) -> dict:
+        return self.seed()
+
+    def needs_reconcile(self) -> bool:
+        return self.last_block is None or time.time() - self.last_reconcile >= self.reconcile_interval
+
+    def sync(self, force: bool = False) -> dict:
+        """
+        Apply Transfer logs touching the address since the last synced block.
+        Cost is one block number and two getLogs calls, whatever the number of tokens.
+        """
+        with self._lock:
+            if self.needs_reconcile():
+                return self.seed()
+            if not force and time.time() - self.last_sync < self.sync_interval:
+                return self.balances
+            latest = self.gateway.eth.block_number
+            if latest <= self.last_block:
+                self.last_sync = time.time()
+                return self.balances
+            if latest - self.last_block > self.max_log_range:
+                return self.seed()
+            query = {
+                'fromBlock': self.last_block + 1,
+                'toBlock': latest,
+                'address': list(self.tokens.values()),
+            }
+            logs = self.gateway.eth.get_logs({**query, 'topics': [TRANSFER_TOPIC, None, self._topic]})  # incoming
+            logs += self.gateway.eth.get_logs({**query, 'topics': [TRANSFER_TOPIC, self._topic]})  # outgoing
+            self._apply_logs(logs)
+            self.last_block = latest
+            self.last_sync = time.time()
+            return self.balances
+
+    def apply_receipt(self, receipt) -> bool:
+        """
+        Apply the Transfer logs of a known fill right away, without waiting for the next sync
+        Returns True if the receipt touched the address
+        """
+        logs = [log for log in receipt['logs'] if self._touches(log)]
+        if not logs:
+            return False
+        with self._lock:
+            # mined at or before the last seed / sync: its transfers are in the balances already
+            if self.last_block is not None and receipt['blockNumber'] <= self.last_block:
+                return False
+            self._apply_logs(logs)
+        return True
+
+    def _touches(self, log) -> bool:
+        topics = [Web3.to_hex(t) for t in log['topics']]
+        return (len(topics) == 3 and topics[0] == TRANSFER_TOPIC
+                and self._topic in topics[1:]
+                and Web3.to_checksum_address(log['address']) in self.tokens.values())
+
+    def _apply_logs(self, logs: list) -> None:
+        symbols = {t_add: symbol for symbol, t_add in self.tokens.items()}
+        # group by tx: a tx is applied once, either from its receipt or from the log sync
+        by_tx = {}
+        for log in logs:
+            by_tx.setdefault(Web3.to_hex(log['transactionHash']), {})[(log['logIndex'], Web3.to_hex(log['topics'][1]))] = log
+        for tx_hash, tx_logs in by_tx.items():
+            if tx_hash in self._seen_tx:
+                continue
+            for log in tx_logs.values():
+                symbol = symbols.get(Web3.to_checksum_address(log['address']))
+                if symbol is None:
+                    continue
+                topics = [Web3.to_hex(t) for t in log['topics']]
+                amount = int.from_bytes(bytes(log['data']), 'big')
+                if topics[2] == self._topic:
+                    self.balances[symbol] = self.balances.get(symbol, 0) + amount
+                if topics[1] == self._topic:
+                    self.balances[symbol] = self.balances.get(symbol, 0) - amount
+            self._seen_tx[tx_hash] = True
+            while len(self._seen_tx) > 1000:
+                self._seen_tx.popitem(last=False)
+
+    def get(self, symbol: str) -> int:
+        return self.balances.get(symbol, 0)
@@ -0,0 +1,274 @@
+import heapq, itertools, math, threading, time
+import ulid
+
+# minimal Uniswap V2 pair ABI, the chain config only ships router / factory ABIs
+PAIR_ABI = [
+    {"inputs": [], "name": "getReserves", "outputs": [
+        {"internalType": "uint112", "name": "_reserve0", "type": "uint112"},
+        {"internalType": "uint112", "name": "_reserve1", "type": "uint112"},
+        {"internalType": "uint32", "name": "_blockTimestampLast", "type": "uint32"}],
+     "stateMutability": "view", "type": "function"},
+    {"inputs": [], "name": "token0", "outputs": [
+        {"internalType": "address", "name": "", "type": "address"}],
+     "stateMutability": "view", "type": "function"},
+]
+
+
+def amount_out(amount_in: float, reserves: list, fee: float = 0.003) -> float:
+    """
+    Output of amount_in along a path of (reserve_in, reserve_out) hops, constant product pools
+    """
+    for reserve_in, reserve_out in reserves:
+        amount_in = amount_in * (1 - fee) * reserve_out / (reserve_in + amount_in * (1 - fee))
+    return amount_in
+
+
+def amount_in(amount_out: float, reserves: list, fee: float = 0.003) -> float:
+    """
+    Input needed for amount_out along a path of (reserve_in, reserve_out) hops
+    """
+    for reserve_in, reserve_out in reversed(reserves):
+        if amount_out >= reserve_out:
+            return math.inf
+        amount_out = reserve_in * amount_out / ((reserve_out - amount_out) * (1 - fee))
+    return amount_out
+
+
+def mid_price(reserves: list) -> float:
+    """
+    Output per unit of input for an infinitely small trade, fee excluded
+    """
+    price = 1.
+    for reserve_in, reserve_out in reserves:
+        price *= reserve_out / reserve_in
+    return price
+
+
+def price_impact(qty: float, reserves: list, exact_out: bool = False) -> float:
+    """
+    Relative price move caused by a trade of qty (input, or output when exact_out), fee excluded
+    """
+    if qty <= 0:
+        return 0.
+    if exact_out:
+        return 1 - qty / mid_price(reserves) / amount_in(qty, reserves, fee=0)
+    return 1 - amount_out(qty, reserves, fee=0) / qty / mid_price(reserves)
+
+
+def max_slice(reserves: list, max_impact: float, exact_out: bool = False) -> float:
+    """
+    Largest qty (input, or output when exact_out) whose price impact stays under max_impact
+    """
+    if len(reserves) == 1:
+        # closed forms of the single pool
+        reserve_in, reserve_out = reserves[0]
+        return reserve_out * max_impact if exact_out else reserve_in * max_impact / (1 - max_impact)
+    low = 0.
+    high = min(r_out for _, r_out in reserves) if exact_out else reserves[0][0]
+    for _ in range(60):
+        mid = (low + high) / 2
+        if price_impact(mid, reserves, exact_out) <= max_impact:
+            low = mid
+        else:
+            high = mid
+    return low
+
+
+class ExecutionScheduler():
+    def __init__(self, broker, max_slices: int = 50, retries: int = 3, poll: float = 2) -> None:
+        """
+        Split large parent orders into child swaps run by a background timer.
+        'twap': slices spread evenly over a horizon, each capped by max_impact when given
+        'iceberg': slices as large as max_impact allows on the current reserves,
+            the next one is sent once the previous is mined and slice_interval has passed
+        Slices are sized and bounded (amount_out_min / amount_in_max) with local reserve math,
+        so each one costs a getReserves call per hop instead of router estimates.
+        max_slices: the last slice takes the whole remainder
+        retries: failed sends of a slice, or reverted slices, before the parent is cancelled
+        poll: seconds between checks of a pending slice
+        """
+        self.broker = broker
+        self.max_slices = max_slices
+        self.retries = retries
+        self.poll = poll
+        self._active = {}   # parent id -> (parent, bot)
+        self._timers = []   # heap of (due time, seq, parent id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, order_plan, bot, mode: str = None):
+        """
+        Start executing order_plan in slices, returns the parent ScheduledOrder right away
+        order_plan: qty in base token, optional execution ('twap' or 'iceberg'), horizon (seconds),
+            slices, max_impact (fraction), slippage (fraction, per slice), slice_interval (seconds)
+        """
+        from lib.trading import ScheduledOrder  # lib.trading is imported by the broker
+
+        mode = mode or getattr(order_plan, 'execution', None) or 'iceberg'
+        if mode not in ('twap', 'iceberg'):
+            raise ValueError(f"Unknown execution {mode}, use 'twap' or 'iceberg'")
+        max_impact = getattr(order_plan, 'max_impact', None) or getattr(self.broker, 'max_impact', None)
+        slices = getattr(order_plan, 'slices', None)
+        if mode == 'iceberg' and not max_impact:
+            max_impact = 0.005
+        if mode == 'twap' and not slices and not max_impact:
+            slices = 5
+        parent = ScheduledOrder(
+            id=str(ulid.new()),
+            category=bot.category,
+            pair=order_plan.pair,
+            side=order_plan.side,
+            broker=self.broker,
+            target_qty=float(order_plan.qty),
+            estimated_amount=getattr(order_plan, 'estimated_amount', None),
+            schedule={
+                'mode': mode,
+                'start': time.time(),
+                'horizon': float(getattr(order_plan, 'horizon', 300)),
+                'slices': slices,
+                'max_impact': max_impact,
+                'slippage': float(getattr(order_plan, 'slippage', 0.01)),
+                'slice_interval': float(getattr(order_plan, 'slice_interval', 5)),
+                'placed_qty': 0.,
+                'sent': 0,
+                'failures': 0,
+            },
+        )
+        print(f"Scheduled {mode} {order_plan.side} of {order_plan.qty} {order_plan.pair[1]}: {parent.schedule}")
+        self.resume(parent, bot)
+        return parent
+
+    def resume(self, parent, bot) -> None:
+        """
+        (Re)start the timer of a parent, used after a restart with the restored order
+        """
+        with self._cond:
+            known = parent.id in self._active
+            self._active[parent.id] = (parent, bot)
+            if known:
+                return
+            heapq.heappush(self._timers, (time.time(), next(self._seq), parent.id))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='execution', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel(self, parent) -> None:
+        """
+        Stop sending slices, slices already sent still fill
+        """
+        with self._cond:
+            self._active.pop(parent.id, None)
+        parent.finish(cancelled=True)
+
+    def active(self, bot=None, pair: list = None) -> list:
+        """
+        Parents still executing, optionally only those of a bot and pair
+        """
+        with self._cond:
+            running = list(self._active.values())
+        return [p for p, b in running
+                if (bot is None or b is bot) and (pair is None or list(p.pair) == list(pair))]
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._timers or self._timers[0][0] > time.time():
+                    timeout = self._timers[0][0] - time.time() if self._timers else None
+                    self._cond.wait(timeout)
+                _, _, parent_id = heapq.heappop(self._timers)
+                parent, bot = self._active.get(parent_id, (None, None))
+            if parent is None:
+                continue
+            try:
+                next_at = self._step(parent, bot)
+            except Exception as e:
+                print(f"Execution of {parent.id} failed: {e}")
+                parent.schedule['failures'] += 1
+                next_at = None if parent.schedule['failures'] > self.retries else time.time() + self.poll
+                if next_at is None:
+                    try:
+                        self.cancel(parent)
+                    except Exception as e:
+                        print(f"Cancel of {parent.id} failed: {e}")
+            with self._cond:
+                if next_at is None:
+                    self._active.pop(parent_id, None)
+                elif parent_id in self._active:
+                    heapq.heappush(self._timers, (next_at, next(self._seq), parent_id))
+
+    def _step(self, parent, bot) -> float | None:
+        """
+        Send the next slice of parent if due, returns when to look at it again (None = done)
+        """
+        schedule = parent.schedule
+        now = time.time()
+        last = parent.children[-1] if parent.children else None
+        if last is not None and not last.is_filled():
+            return now + self.poll
+        if last is not None and last.status == 'Rejected' and not getattr(last, 'requeued', False):
+            # reverted slice: its qty goes back to the remainder, sent again up to retries times in all
+            last.requeued = True
+            schedule['placed_qty'] -= getattr(last, 'slice_qty', 0)
+            schedule['reverted'] = schedule.get('reverted', 0) + 1
+            print(f"Slice of {parent.id} reverted ({schedule['reverted']}/{self.retries})")
+            if schedule['reverted'] > self.retries:
+                parent.finish(cancelled=True)
+                return None
+        remaining = parent.target_qty - schedule['placed_qty']
+        if remaining <= parent.target_qty * 1e-9:
+            parent.finish()
+            return None
+
+        # one getReserves per hop, everything else is local math
+        pair = parent.pair
+        path = pair if parent.side == 'buy' else pair[::-1]
+        reserves = self.broker.get_reserves(path)
+        exact_out = parent.side == 'buy'  # buys are exact base out, sells exact base in
+        base = pair[1]
+        cap = math.inf
+        if schedule['max_impact']:
+            cap = self.broker.from_wei(base, int(max_slice(reserves, schedule['max_impact'], exact_out)))
+
+        if schedule['mode'] == 'twap':
+            slices = schedule['slices'] or math.ceil(parent.target_qty / cap)
+            slices_left = max(1, slices - schedule['sent'])
+            qty = min(remaining / slices_left, cap)
+            interval = schedule['horizon'] / max(1, slices)
+            next_at = schedule['start'] + interval * (schedule['sent'] + 1)
+        else:
+            qty = min(remaining, cap)
+            next_at = now + schedule['slice_interval']
+        if schedule['sent'] + 1 >= self.max_slices or remaining - qty < remaining * 1e-6:
+            qty = remaining
+        if qty <= 0:
+            return now + schedule['slice_interval']
+
+        # slice bounds from the local quote instead of a flat 10%
+        wei = self.broker.to_wei(base, qty)
+        slippage = schedule['slippage']
+        if exact_out:
+            limit = {'amount_in_max': int(amount_in(wei, reserves, self.broker.pool_fee) * (1 + slippage))}
+        else:
+            limit = {'amount_out_min': int(amount_out(wei, reserves, self.broker.pool_fee) * (1 - slippage))}
+
+        from lib.trading import OrderPlan
+
+        slice_plan = OrderPlan(action='slice', side=parent.side, pair=list(pair), order_type='market', qty=qty, **limit)
+        child = self.broker.place_swap(slice_plan, bot)
+        if child is None or getattr(child, 'tx', None) is None:
+            schedule['failures'] += 1
+            print(f"Slice of {parent.id} not sent ({schedule['failures']}/{self.retries})")
+            if schedule['failures'] > self.retries:
+                parent.finish(cancelled=True)
+                return None
+            return now + self.poll
+        parent.add_child(child, qty)
+        # progress goes to the bot journal, a restart resumes after the last sent slice
+        if hasattr(bot, 'journal_order'):
+            with bot.lock:
+                bot.journal_order(parent)
+        print(f"Slice {schedule['sent']} of {parent.id}: {parent.side} {qty} {base}, "
+              f"impact {price_impact(wei, reserves, exact_out):.4%}, {parent.filled_qty}/{parent.target_qty} filled")
+        return max(next_at, now + self.poll)
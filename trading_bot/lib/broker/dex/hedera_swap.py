@@ -7,46 +7,171 @@ from web3.middleware import ExtraDataToPOAMiddleware
 from web3.exceptions import TransactionNotFound, ContractLogicError
 from web3.types import HexStr
 
-import time, json, requests
+import time, json, requests, threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import sys, os, logging
-import numpy as np
 from datetime import datetime 
-from lib.trading_v1 import Order, Trade, TradingBot, Strategy, BaseBroker, OrderPlan
+from lib.trading import Order, Trade, TradingBot, Strategy, BaseBroker, OrderPlan
+from lib.broker.dex.balance_ledger import BalanceLedger
+from lib.broker.dex.vault_state import VaultStateCache
+from lib.broker.dex.execution import ExecutionScheduler, PAIR_ABI, price_impact
+from lib.broker.dex.rpc_provider import InstrumentedHTTPProvider
+from lib.metrics import METRICS
+from lib.cassette import CASSETTE
+from lib.events import EVENTS
+from lib.tracing import TRACER, traced
 import ulid
 
-def get_web3_gateway(urls: Optional[list[str]] = None) -> Web3:
+def get_web3_gateway(urls: Optional[list[str]] = None, pool_size:int = 10) -> Web3:
     urls = urls.copy() if urls else ["https://testnet.hashio.io/api",]
     random.shuffle(urls)  # Randomize the order
     for url in urls:
         try:
-            gateway = Web3(Web3.HTTPProvider(url))
+            # keep-alive connections sized for the number of bots sharing this gateway
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            CASSETTE.mount(session, pool_connections=pool_size, pool_maxsize=pool_size)  # record / replay when loaded
+            gateway = Web3(InstrumentedHTTPProvider(url, session=session))  # every request lands in METRICS
             if gateway.is_connected():
                 return gateway
         except Exception:
             continue
     raise Exception("No working endpoint found.")
 
+class NonceManager():
+    def __init__(self, gateway: Web3) -> None:
+        """
+        Local nonce allocation per sender address.
+        The chain nonce is read once, later transactions take the next local value,
+        so concurrent orders from the same wallet never reuse a nonce.
+        """
+        self.gateway = gateway
+        self._nonces = {}   # address -> next nonce
+        self._locks = {}    # address -> lock held from nonce allocation until the tx is sent
+        self._lock = threading.Lock()
+
+    def lock(self, address: str) -> threading.RLock:
+        with self._lock:
+            return self._locks.setdefault(address, threading.RLock())
+
+    def next(self, address: str) -> int:
+        """
+        Allocate the next nonce of address, call while holding lock(address)
+        """
+        if address not in self._nonces:
+            self._nonces[address] = self.gateway.eth.get_transaction_count(address, 'pending')
+        nonce = self._nonces[address]
+        self._nonces[address] = nonce + 1
+        return nonce
+
+    def reset(self, address: str) -> None:
+        """
+        Forget the local nonce, the next allocation re-reads it from chain (after a failed send)
+        """
+        self._nonces.pop(address, None)
+
+
 class SwapBroker(BaseBroker):
-    def __init__(self, rpcs, ecosystem_token='WHBAR', contract_info:dict=None, abi_url:str='', router_address=None, factory_address=None):
+    def __init__(self, rpcs, ecosystem_token='WHBAR', contract_info:dict=None, abi_url:str='', router_address=None, factory_address=None, pool_size:int=10, order_workers:int=4, value_ttl:float=300, max_impact:float=None, pool_fee:float=0.003, lazy:bool=False):
+        """
+        lazy: do not connect in the constructor, the gateway, router / factory contracts and nonce manager
+            are created on first use (or by warm_up) so the process can start scheduling right away
+        """
         self.abi_url = abi_url
 
         self.rpc_urls = rpcs
-        self.gateway = get_web3_gateway(self.rpc_urls)
-        self.gateway.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+        self.pool_size = pool_size
+        self.contract_info = contract_info
+        self._gateway = None
+        self._gateway_lock = threading.Lock()
         self.ecosystem_token = ecosystem_token or 'WHBAR'
         # as estimate token info of 1000 ~ 1MB, this is aceptable
         self.tokens = contract_info['tokens']
 
         self.gas_limit = 1000_000
-        self.router_contract = self.gateway.eth.contract(
-            address=Web3.to_checksum_address(contract_info.get('router')[0]),
-            abi=contract_info.get('router')[1]
-        )
-        self.factory_contract = self.gateway.eth.contract(
-            address=Web3.to_checksum_address(contract_info.get('factory')[0]),
-            abi=contract_info.get('factory')[1]
-        )
-        
+        self._gas_price = (0, 0)  # (fetched_at, gas price in wei)
+        # bounded pool used to submit all order plans of a cycle at once
+        self.executor = ThreadPoolExecutor(max_workers=order_workers, thread_name_prefix='order')
+        self.ledgers = {}  # tracked address -> BalanceLedger
+        self.vault_states = {}  # vault address -> VaultStateCache
+        self._prices = {}  # symbol -> (fetched_at, price), one quote per pair shared by all waiting orders and bots
+        self._price_lock = threading.Lock()
+        self._allowances = {}  # (owner, token) -> {reservation: (amount, deadline)} of swaps not mined yet
+        self._allowance_txs = {}  # tx -> reservation
+        self._approve_locks = {}  # (owner, token) -> lock of the allowance check and approve
+        self._allowance_lock = threading.Lock()
+        self.value_ttl = value_ttl  # seconds a token valuation is reused while its balance is unchanged
+        self.max_impact = max_impact  # market orders moving the pool more than this are sliced (None = never)
+        self.pool_fee = pool_fee  # LP fee of the router pools, for local reserve math
+        self.scheduler = ExecutionScheduler(self)  # twap / iceberg slices of large orders
+        # name the eth_call functions in the rpc metrics
+        for name in ('router', 'factory', 'vault'):
+            if contract_info.get(name):
+                METRICS.register_abi(contract_info[name][1], name)
+        for _, t_abi in self.tokens.values():
+            METRICS.register_abi(t_abi, 'token')
+        METRICS.register_abi(PAIR_ABI, 'pair')
+        if not lazy:
+            self.connect()
+
+    def connect(self) -> Web3:
+        """
+        Connect to the first working rpc and build the contracts bound to it, once
+        """
+        if self._gateway is None:
+            with self._gateway_lock:
+                if self._gateway is None:
+                    gateway = get_web3_gateway(self.rpc_urls, pool_size=self.pool_size)
+                    gateway.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+                    self._nonces = NonceManager(gateway)
+                    self._router_contract = gateway.eth.contract(
+                        address=Web3.to_checksum_address(self.contract_info.get('router')[0]),
+                        abi=self.contract_info.get('router')[1]
+                    )
+                    self._factory_contract = gateway.eth.contract(
+                        address=Web3.to_checksum_address(self.contract_info.get('factory')[0]),
+                        abi=self.contract_info.get('factory')[1]
+                    )
+                    self._gateway = gateway
+        return self._gateway
+
+    @property
+    def gateway(self) -> Web3:
+        return self._gateway if self._gateway is not None else self.connect()
+
+    @property
+    def nonces(self) -> NonceManager:
+        self.gateway
+        return self._nonces
+
+    @property
+    def router_contract(self):
+        self.gateway
+        return self._router_contract
+
+    @property
+    def factory_contract(self):
+        self.gateway
+        return self._factory_contract
+
+    def warm_up(self, pairs: list = ()) -> None:
+        """
+        Fill the caches the first cycle needs: connection, gas price, token decimals,
+        routable paths and pool contracts of pairs (['quote', 'base'] lists)
+        """
+        self.connect()
+        self.get_gas_price()
+        for pair in pairs:
+            for t in pair:
+                self.get_decimal(t)
+            for path in (tuple(pair), tuple(pair[::-1])):
+                valid_path = self.get_valid_path(path)
+                for token_in, token_out in zip(valid_path[:-1], valid_path[1:]):
+                    self.get_pair_contract(token_in, token_out)
+
 
     @lru_cache()
     def get_ABI(self, address:str):
@@ -84,7 +209,37 @@ class SwapBroker(BaseBroker):
         """
         Clear cache for all methods
         """
-        self.get_pair_info.cache_clear()
+        self.get_valid_path.cache_clear()
+        self.get_pair_contract.cache_clear()
+
+    def get_gas_price(self, ttl:float=15) -> int:
+        """
+        Gas price in wei, shared by all transactions sent within ttl seconds
+        """
+        fetched_at, gas_price = self._gas_price
+        if time.time() - fetched_at > ttl:
+            gas_price = self.gateway.eth.gas_price
+            self._gas_price = (time.time(), gas_price)
+        return gas_price
+
+    def send_transaction(self, bot: 'TradingBot', txn: dict) -> str:
+        """
+        Sign and send txn from the bot wallet with a locally allocated nonce.
+        Allocation and send happen under the wallet lock so transactions reach the node in nonce order.
+        """
+        address = bot.wallet['address']
+        with self.nonces.lock(address):
+            with TRACER.span('broker.sign', bot=bot.id):
+                txn['nonce'] = self.nonces.next(address)
+                signed_txn = self.gateway.eth.account.sign_transaction(txn, private_key=bot.wallet['private'])
+            with TRACER.span('broker.send', bot=bot.id, nonce=txn['nonce']) as span:
+                try:
+                    tx_hash = self.gateway.eth.send_raw_transaction(signed_txn.raw_transaction)
+                except Exception:
+                    self.nonces.reset(address)
+                    raise
+                span.set(tx=Web3.to_hex(tx_hash))
+        return Web3.to_hex(tx_hash)
 
     def get_pair_info(self, pair:list[str]) -> dict:
         t1 = pair[0]
@@ -100,53 +255,85 @@ class SwapBroker(BaseBroker):
         }
         return res
 
-    def check_balance(self, bot: 'TradingBot', re_check=True) -> Tuple[float, float]:
+    def get_ledger(self, bot: 'TradingBot') -> BalanceLedger:
+        """
+        Balance ledger of the bot vault, created and seeded on first use
+        """
+        address = bot.vault.address
+        if address not in self.ledgers:
+            self.ledgers[address] = BalanceLedger(
+                self.gateway,
+                address,
+                {t: self.tokens[t] for t in [bot.currency] + bot.tokens},
+            )
+        else:
+            for t in [bot.currency] + bot.tokens:
+                self.ledgers[address].add_token(t, *self.tokens[t])
+        return self.ledgers[address]
+
+    def get_vault_state(self, bot: 'TradingBot') -> VaultStateCache:
+        """
+        State cache of the bot vault, read on first use and re-read only after a vault event
+        """
+        address = bot.vault.address
+        if address not in self.vault_states:
+            self.vault_states[address] = VaultStateCache(self.gateway, bot.vault)
+        return self.vault_states[address]
+
+    def check_balance(self, bot: 'TradingBot', re_check=False) -> Tuple[float, float]:
         """
         Check the balance of the bot, based on the bot. tokens and currency in the bot.
+        Token quantities come from the vault balance ledger (Transfer logs + known fills),
+        re_check forces a full balanceOf rescan of every token.
         update bot:
          - _token_balance
          - balance
          - pending_amount
         """
-        # todo: fix -> balance update on trade -> not have to update token balance every time 
-        # give 2 option calculate balance with / Without update token balance
-        # all_tokens = bot.tokens + [bot.currency]
         pending_amount = 0.0 # total amount equal to value of non-currency tokens in open orders
         
-        # Use vault address if available, otherwise use wallet address
-        
+        ledger = self.get_ledger(bot)
+        if re_check:
+            ledger.reconcile()
+        else:
+            ledger.sync()
+
         for t in [bot.currency] + bot.tokens:
-            t_add, t_abi = self.tokens[t]
-            token_contract = self.gateway.eth.contract(address=t_add, abi=t_abi)
             if t not in bot._token_balance.keys():
                 bot._token_balance[t] = {'qty': 0, 'value': 0.0}
-            bot._token_balance[t]['qty']=token_contract.functions.balanceOf(bot.vault.address).call()
+            entry = bot._token_balance[t]
+            qty = ledger.get(t)
+            changed = qty != entry['qty']
+            entry['qty'] = qty
 
-            if t !=bot.currency and bot._token_balance[t]['qty'] > 0:
+            if t == bot.currency:
+                continue
+            if qty <= 0:
+                entry['value'] = 0.0
+            elif changed or re_check or time.time() - entry.get('valued_at', 0) > self.value_ttl:
+                # only revalue when the quantity moved or the valuation is stale
                 try:
-                    path, amounts_outs = self.estimate([t, bot.currency], bot._token_balance[t]['qty'], function='getAmountsOut')
+                    path, amounts_outs = self.estimate([t, bot.currency], qty, function='getAmountsOut')
                     v = amounts_outs[-1]
-                    value = self.from_wei(t, v) if v > 0 else 0.0
-                    bot._token_balance[t]['value'] = value
-                    pending_amount += value
+                    entry['value'] = self.from_wei(bot.currency, v) if v > 0 else 0.0
+                    entry['valued_at'] = time.time()
                 except Exception as e:
                     print(f"Could not estimate value for {t} -> {bot.currency}: {e}")
-                    bot._token_balance[t]['value'] = 0.0
+                    entry['value'] = 0.0
+            pending_amount += entry['value']
 
         value = self.from_wei(bot.currency, bot._token_balance[bot.currency]['qty'])
         bot._token_balance[bot.currency]['value'] = value
 
         balance = bot._token_balance[bot.currency]['value']
-        # pending_money = self.from_wei(bot.currency, pending_amount) if pending_amount > 0 else 0.0
         return balance, pending_amount 
 
-    def estimate(self, t_path, amount_in_wei:int, function ='getAmountsIn'):
-        # or cash_to_qty estimate token in and out
-        if amount_in_wei < 1:
-            raise ValueError(f"Invalid amount_in_wei: {amount_in_wei}, should be greater or equal to 1")
-            return [], [0]
-        else:
-            amount_in_wei = int(amount_in_wei)
+    @lru_cache()
+    def get_valid_path(self, t_path:tuple) -> tuple:
+        """
+        Resolve token symbols to a routable address path (direct pair or through the ecosystem token).
+        Pairs are immutable once created, so the result is cached and shared by every bot using this broker.
+        """
         nt_add = self.tokens[self.ecosystem_token][0]
         valid_path = [self.tokens.get(t_path[0])[0]]
 
@@ -172,6 +359,38 @@ class SwapBroker(BaseBroker):
                     valid_path.append(token2)
                 else:
                     raise Exception(f"valid path not found")
+        return tuple(valid_path)
+
+    @lru_cache()
+    def get_pair_contract(self, token_a: str, token_b: str):
+        """
+        Pool contract of two token addresses and its token0, both immutable
+        """
+        pair_address = self.factory_contract.functions.getPair(token_a, token_b).call()
+        contract = self.gateway.eth.contract(address=Web3.to_checksum_address(pair_address), abi=PAIR_ABI)
+        return contract, contract.functions.token0().call()
+
+    def get_reserves(self, t_path: list) -> list:
+        """
+        (reserve_in, reserve_out) in wei of every hop of the token symbol path, one getReserves call per hop
+        """
+        valid_path = self.get_valid_path(tuple(t_path))
+        reserves = []
+        for token_in, token_out in zip(valid_path[:-1], valid_path[1:]):
+            contract, token0 = self.get_pair_contract(token_in, token_out)
+            reserve0, reserve1, _ = contract.functions.getReserves().call()
+            reserves.append((reserve0, reserve1) if token0.lower() == token_in.lower() else (reserve1, reserve0))
+        return reserves
+
+    @traced('broker.estimate')
+    def estimate(self, t_path, amount_in_wei:int, function ='getAmountsIn'):
+        # or cash_to_qty estimate token in and out
+        if amount_in_wei < 1:
+            raise ValueError(f"Invalid amount_in_wei: {amount_in_wei}, should be greater or equal to 1")
+            return [], [0]
+        else:
+            amount_in_wei = int(amount_in_wei)
+        valid_path = list(self.get_valid_path(tuple(t_path)))
         # print("amount_in_wei: ", amount_in_wei, valid_path, function)
         try:
             if function == 'getAmountsIn':
@@ -186,6 +405,24 @@ class SwapBroker(BaseBroker):
             raise e
         return valid_path, amounts
 
+    def get_price(self, pair: list, ttl: float = 2) -> float:
+        """
+        Price of pair ['quote', 'base'] in quote per one base token, from the router with a one-unit probe
+        Quotes are shared for ttl seconds
+        """
+        quote, base = pair
+        symbol = base + quote
+        with self._price_lock:
+            fetched_at, price = self._prices.get(symbol, (0, None))
+        if price is not None and time.time() - fetched_at <= ttl:
+            return price
+        path, amounts_outs = self.estimate([base, quote], self.to_wei(base, 1), function='getAmountsOut')
+        price = self.from_wei(quote, amounts_outs[-1])
+        with self._price_lock:
+            self._prices[symbol] = (time.time(), price)
+        return price
+
+    @traced('broker.allowance')
     def get_allowance(self, address, symbol: str):
         # print("get_allowance: ", bot, symbol)
         if self.gateway is None:
@@ -203,6 +440,54 @@ class SwapBroker(BaseBroker):
         ).call()
         return allowance  # Web3.to_wei(allowance, "ether")
 
+    def _reserve_allowance(self, bot: 'TradingBot', symbol: str, amount: int, deadline: int) -> tuple:
+        """
+        Make sure the router may spend amount of symbol for bot on top of the swaps of it sent and not mined yet.
+        Check and approve run one at a time per (owner, token), concurrent swaps approve the sum they need.
+        Returns the reservation to hand to _allowance_sent once the swap is sent
+        """
+        owner = bot.vault.address if getattr(bot, 'vault', None) else bot.wallet['address']
+        key = (owner, symbol)
+        with self._allowance_lock:
+            lock = self._approve_locks.setdefault(key, threading.Lock())
+        with lock:
+            with self._allowance_lock:
+                pending = self._allowances.setdefault(key, {})
+                for ref, (_, expires) in list(pending.items()):
+                    if expires < time.time():
+                        del pending[ref]  # past its deadline, the swap can not spend anymore
+                needed = amount + sum(a for a, _ in pending.values())
+                ref = object()
+                pending[ref] = (amount, deadline)
+            allowance = self.get_allowance(owner, symbol)
+            EVENTS.emit('allowance', 'debug', token=symbol, allowance=allowance, amount_in=amount, needed=needed)
+            if allowance < needed:
+                try:
+                    self.approve_token(bot, symbol, amount=int(needed * 1.5))
+                except Exception:
+                    self._allowance_sent((key, ref), None)
+                    raise
+        return key, ref
+
+    def _allowance_sent(self, reservation: tuple, tx: str | None) -> None:
+        """
+        Keep the reservation until the receipt of tx is read, drop it when the swap was not sent
+        """
+        key, ref = reservation
+        with self._allowance_lock:
+            if tx is None:
+                self._allowances.get(key, {}).pop(ref, None)
+            else:
+                self._allowance_txs[tx] = reservation
+
+    def _release_allowance(self, tx: str) -> None:
+        # mined (or reverted): the allowance on chain is up to date for this swap
+        with self._allowance_lock:
+            key, ref = self._allowance_txs.pop(tx, (None, None))
+            if key is not None:
+                self._allowances.get(key, {}).pop(ref, None)
+
+    @traced('broker.approve')
     def approve_token(self, bot: 'TradingBot', symbol: str, amount: int = 10e12):
         # todo: if token balance is 0, can't approve
         amount = int(amount)
@@ -214,7 +499,7 @@ class SwapBroker(BaseBroker):
         
         if hasattr(bot, 'vault') and bot.vault:
             # Approve through vault contract
-            print("Approve through vault contract")
+            EVENTS.emit('approve', 'debug', token=symbol, amount=amount, through='vault')
             approve_data = token_contract.encode_abi(
                 abi_element_identifier="approve",
                 args=[self.router_contract.address, amount]
@@ -226,30 +511,28 @@ class SwapBroker(BaseBroker):
                 approve_data
             ).build_transaction({
                 'from': bot.wallet['address'],
-                'nonce': self.gateway.eth.get_transaction_count(bot.wallet['address']),
+                'nonce': 0,  # allocated in send_transaction
                 'gas': self.gas_limit,
-                'gasPrice': self.gateway.eth.gas_price
+                'gasPrice': self.get_gas_price()
             })
             
             # Sign and send with wallet key
-            signed_txn = self.gateway.eth.account.sign_transaction(txn, private_key=bot.wallet['private'])
-            tx = self.gateway.eth.send_raw_transaction(signed_txn.raw_transaction)
+            tx = self.send_transaction(bot, txn)
         else:
             # Direct approval
-            print("Direct approval")
+            EVENTS.emit('approve', 'debug', token=symbol, amount=amount, through='wallet')
             approve_txn = token_contract.functions.approve(
                 self.router_contract.address,  # Router contract address
                 amount  # Amount to approve
             ).build_transaction({
                 "from": bot.wallet['address'],
-                "nonce": self.gateway.eth.get_transaction_count(bot.wallet['address']),
+                "nonce": 0,  # allocated in send_transaction
                 'gas': self.gas_limit, # requre for testnet - Optional: Add gas limit in BNB <= 0.01$ (need convert USDC -> bnb to get gas limit)
-                "gasPrice": self.gateway.eth.gas_price,
+                "gasPrice": self.get_gas_price(),
             })
-            signed_approve_txn = self.gateway.eth.account.sign_transaction(approve_txn, private_key=bot.wallet['private'])
-            tx = self.gateway.eth.send_raw_transaction(signed_approve_txn.raw_transaction)
+            tx = self.send_transaction(bot, approve_txn)
         
-        return Web3.to_hex(tx)
+        return tx
 
     def _wait_for_receipt(self, txn_hash):
         receipt = None
@@ -263,6 +546,21 @@ class SwapBroker(BaseBroker):
             if receipt:
                 return receipt
 
+    def get_receipt(self, txn_hash):
+        """
+        Receipt of txn_hash, None while it is not mined (no wait)
+        The Transfer logs it carries are applied to the tracked vault balances right away
+        """
+        try:
+            receipt = self.gateway.eth.get_transaction_receipt(txn_hash)
+        except TransactionNotFound:
+            return None
+        if receipt:
+            self._release_allowance(txn_hash)
+            for ledger in list(self.ledgers.values()):
+                ledger.apply_receipt(receipt)
+        return receipt
+
     def _execute_vault_transaction(self, bot: 'TradingBot', target_address: str, encoded_data: str):
         """Execute transaction through vault contract"""
         if not hasattr(bot, 'vault') or not bot.vault:
@@ -274,15 +572,13 @@ class SwapBroker(BaseBroker):
             encoded_data
         ).build_transaction({
             'from': bot.wallet['address'],
-            'nonce': self.gateway.eth.get_transaction_count(bot.wallet['address']),
+            'nonce': 0,  # allocated in send_transaction
             'gas': self.gas_limit,
-            'gasPrice': self.gateway.eth.gas_price
+            'gasPrice': self.get_gas_price()
         })
         
         # Sign and send with wallet key
-        signed_txn = self.gateway.eth.account.sign_transaction(txn, private_key=bot.wallet['private'])
-        tx_hash = self.gateway.eth.send_raw_transaction(signed_txn.raw_transaction)
-        return Web3.to_hex(tx_hash)
+        return self.send_transaction(bot, txn)
 
     def swap_exact_out(self, bot: 'TradingBot', path:list=['WHBAR','USDC'], amount_out:int=1000000000000000000, amount_in_max:int=None):
         # remember estimate is not combined with gas fee, so it not accurate for price calculation
@@ -299,14 +595,16 @@ class SwapBroker(BaseBroker):
             amount_in_max = int(est_amounts_outs[0] * 1.1)
             
         # Check and approve sell token if necessary
-        allowance = self.get_allowance(bot.vault.address, sell_token)
-        # print("allowance - amount_in", Web3.from_wei(allowance,'ether'), Web3.from_wei(amount_in,'ether'))
-        if allowance < amount_in_max:
-            self.approve_token(bot, sell_token, amount=int(amount_in_max*1.5))
-
-        # Create swap transaction
         deadline = int(datetime.now().timestamp()) + 60 * 20  # 20 minutes from now
-        
+        reservation = self._reserve_allowance(bot, sell_token, amount_in_max, deadline)
+        tx = None
+        try:
+            tx = self._send_swap_exact_out(bot, add_path, amount_out, amount_in_max, deadline)
+        finally:
+            self._allowance_sent(reservation, tx)
+        return tx
+
+    def _send_swap_exact_out(self, bot: 'TradingBot', add_path: list, amount_out: int, amount_in_max: int, deadline: int):
         if hasattr(bot, 'vault') and bot.vault:
             # Execute through vault
             encoded_tx = self.router_contract.encode_abi(
@@ -323,11 +621,11 @@ class SwapBroker(BaseBroker):
         else:
             # Direct execution
             # Get current gas price
-            gas_price = self.gateway.eth.gas_price  # Returns gas price in wei
+            gas_price = self.get_gas_price()  # Returns gas price in wei
             # Init transaction parameters
             tx_params = {
                 'from': bot.wallet['address'],
-                'nonce': self.gateway.eth.get_transaction_count(bot.wallet['address']),
+                'nonce': 0,  # allocated in send_transaction
                 'gas': 500_000, # requre for testnet - Optional: Add gas limit in BNB <= 0.01$ (need convert USDC -> bnb to get gas limit)
                 # Optional: Add gas price if needed
                 'gasPrice': gas_price
@@ -342,7 +640,7 @@ class SwapBroker(BaseBroker):
 
             build_txn = txn.build_transaction(tx_params)
             # Estimate gas
-            gas_estimate = self.gateway.eth.estimate_gas(build_txn)
+            gas_estimate = self.gateway.eth.estimate_gas({k: v for k, v in build_txn.items() if k != 'nonce'})
 
             # Calculate total transaction cost
             total_gas_cost_est = gas_estimate * gas_price  # Gas estimate × gas price (in wei)
@@ -350,20 +648,14 @@ class SwapBroker(BaseBroker):
             #                 swap=[self.router_contract.address, self.router_contract.abi])
 
 
-            # Send transaction
-            sent_txn = None
+            # Send transaction, a failed send re-syncs the nonce from chain before retrying
+            txn_hash = None
             for i in range(10):
                 try:
-                    # Signing transaction
-                    signed_txn = self.gateway.eth.account.sign_transaction(build_txn, private_key=bot.wallet['private'])
-                    sent_txn = self.gateway.eth.send_raw_transaction(signed_txn.raw_transaction)
+                    txn_hash = self.send_transaction(bot, build_txn)
                     break
                 except Exception as e:
                     time.sleep(0.5)
-                    tx_params.update({"nonce": self.gateway.eth.get_transaction_count(bot.wallet['address'])})
-                    build_txn = txn.build_transaction(tx_params)
-                    pass
-            txn_hash = Web3.to_hex(sent_txn)
 
             return txn_hash
 
@@ -377,16 +669,17 @@ class SwapBroker(BaseBroker):
         add_path, est_amounts_outs = self.estimate(path, amount_in, function='getAmountsOut')
         if amount_out_min is None or amount_out_min <= 0:
             amount_out_min = int(est_amounts_outs[-1] * 0.9)  # Set minimum output to 90% of estimated output
-        # todo: fix 
         # Check and approve sell token if necessary
-        allowance = self.get_allowance(bot.vault.address, sell_token)
-        print("allowance - amount_in", allowance, amount_in)
-        if allowance < amount_in:
-            self.approve_token(bot, sell_token, amount=int(amount_in*1.5))
-        
-        # Create swap transaction
         deadline = int(datetime.now().timestamp()) + 60 * 20  # 20 minutes from now
-        
+        reservation = self._reserve_allowance(bot, sell_token, amount_in, deadline)
+        tx = None
+        try:
+            tx = self._send_swap_exact_in(bot, add_path, amount_in, amount_out_min, deadline)
+        finally:
+            self._allowance_sent(reservation, tx)
+        return tx
+
+    def _send_swap_exact_in(self, bot: 'TradingBot', add_path: list, amount_in: int, amount_out_min: int, deadline: int):
         if hasattr(bot, 'vault') and bot.vault:
             # Execute through vault
             encoded_tx = self.router_contract.encode_abi(
@@ -403,11 +696,11 @@ class SwapBroker(BaseBroker):
         else:
             # Direct execution
             # Get current gas price
-            gas_price = self.gateway.eth.gas_price  # Returns gas price in wei
+            gas_price = self.get_gas_price()  # Returns gas price in wei
             # Init transaction parameters
             tx_params = {
                 'from': bot.wallet['address'],
-                'nonce': self.gateway.eth.get_transaction_count(bot.wallet['address']),
+                'nonce': 0,  # allocated in send_transaction
                 'gas': 500_000, # requre for testnet - Optional: Add gas limit in BNB <= 0.01$ (need convert USDC -> bnb to get gas limit)
                 # Optional: Add gas price if needed
                 'gasPrice': gas_price
@@ -422,30 +715,26 @@ class SwapBroker(BaseBroker):
 
             build_txn = txn.build_transaction(tx_params)
             # Estimate gas
-            gas_estimate = self.gateway.eth.estimate_gas(build_txn)
+            gas_estimate = self.gateway.eth.estimate_gas({k: v for k, v in build_txn.items() if k != 'nonce'})
 
             # Calculate total transaction cost
             total_gas_cost_est = gas_estimate * gas_price  # Gas estimate × gas price (in wei)
-            # Send transaction
-            sent_txn = None
+            # Send transaction, a failed send re-syncs the nonce from chain before retrying
+            txn_hash = None
             for i in range(10):
                 try:
-                    # Signing transaction
-                    signed_txn = self.gateway.eth.account.sign_transaction(build_txn, private_key=bot.wallet['private'])
-                    sent_txn = self.gateway.eth.send_raw_transaction(signed_txn.raw_transaction)
+                    txn_hash = self.send_transaction(bot, build_txn)
                     break
                 except Exception as e:
                     time.sleep(0.5)
-                    tx_params.update({"nonce": self.gateway.eth.get_transaction_count(bot.wallet['address'])})
-                    build_txn = txn.build_transaction(tx_params)
-                    pass
-            txn_hash = Web3.to_hex(sent_txn)
             return txn_hash
     
+    @traced('broker.update_order')
     def update_order(self, order:Order, wait_update:bool=False):
         """
         Get order info by orderId
         """
+        TRACER.annotate(tx=order.tx)
         # Confirm transaction completion
 
         if wait_update:
@@ -455,20 +744,30 @@ class SwapBroker(BaseBroker):
                 receipt = self.gateway.eth.get_transaction_receipt(order.tx)
             except TransactionNotFound:
                 # receipt not completed yet, no update
-                print("receipt not completed yet")
+                EVENTS.emit('receipt_pending', 'debug', tx=order.tx)
                 return None
 
+        if not receipt:
+            return None
+        self._release_allowance(order.tx)
         amount_in = None
         amount_out = None
-        gas_used = 0
+        gas_used = int(receipt['gasUsed'])
+        gas_price = int(receipt["effectiveGasPrice"])
+        if receipt['status'] == 0:
+            # reverted: nothing moved but the gas, the order is final
+            EVENTS.emit('order_update', 'debug', order=order.id, tx=order.tx, status='reverted', gas_used=gas_used)
+            order.status = 'Rejected'
+            order.fee = gas_used * gas_price
+            order.filled_time = int(time.time())
+            return None
         if receipt:
+            # known fill: move the tracked vault balances now instead of waiting for the log sync
+            for ledger in list(self.ledgers.values()):
+                ledger.apply_receipt(receipt)
             # Swap event signature todo update if change or extend tx function
             # transfer_in_event_signature = Web3.keccak(text="Transfer(address,address,uint256)").hex()           
             # swap_out_event_signature = Web3.keccak(text="Swap(address,uint256,uint256,uint256,uint256,address)").hex()
-            gas_used = int(receipt['gasUsed'])
-            gas_price = int(receipt["effectiveGasPrice"])
-            
-            data = Web3.to_bytes(hexstr=HexStr(receipt['logs'][0]['data'].hex()))
             # if log["topics"][0].hex() == transfer_in_event_signature
 
             for log in receipt.logs:
@@ -477,11 +776,18 @@ class SwapBroker(BaseBroker):
                         amount_in = int.from_bytes(Web3.to_bytes(hexstr=HexStr(log['data'].hex())), "big")
                     else:
                         amount_out = int.from_bytes(Web3.to_bytes(hexstr=HexStr(log['data'].hex())), "big")
-        print("amount_in: ", amount_in)
-        print("amount_out: ", amount_out)
-        price = amount_in / amount_out if order.side == 'buy' else amount_out / amount_in
+            if amount_in is None:
+                # routers without their own log: the first Transfer of the sold token is the amount paid
+                t_in = self.tokens[order.token_in][0].upper()
+                for log in receipt.logs:
+                    if len(log['data']) == 32 and log['address'].upper() == t_in:
+                        amount_in = int.from_bytes(Web3.to_bytes(hexstr=HexStr(log['data'].hex())), "big")
+                        break
+        EVENTS.emit('order_update', 'debug', order=order.id, tx=order.tx, amount_in=amount_in, amount_out=amount_out, gas_used=gas_used)
         amount_in = self.from_wei(order.token_in, amount_in)
         amount_out = self.from_wei(order.token_out, amount_out)
+        # quote per base in token units, comparable with strategy prices and tp / sl levels
+        price = amount_in / amount_out if order.side == 'buy' else amount_out / amount_in
         fee = gas_used * gas_price
 
         if order.side == 'buy':
@@ -504,6 +810,7 @@ class SwapBroker(BaseBroker):
         order.status = 'Filled'
         order.fee = fee
 
+    @traced('broker.place_order')
     def place_order(self, order_plan: OrderPlan, bot: TradingBot) -> Order:
         """
         todo: use swapETHForExactTokens and swapExactTokensForETH for bester perform
@@ -515,6 +822,8 @@ class SwapBroker(BaseBroker):
         - price: current price of token/USDC for estimating qty
         - type: market or limit
         - limit: limit price for limit order should check current price not overcome limit yet
+        - execution: 'twap' or 'iceberg' to run the order in slices (see ExecutionScheduler),
+          with horizon, slices, max_impact, slippage, slice_interval
         - stop_price, sl_price, tp_price, parent_trade, tag: not used yet
         - parent_trade: trade to open/close position
         return:
@@ -528,6 +837,27 @@ class SwapBroker(BaseBroker):
         - cumExecQty: total qty of the order 
         - cumExecFee: total fee of the order
         """ 
+        TRACER.annotate(bot=bot.id, pair='/'.join(order_plan.pair), side=order_plan.side, qty=order_plan.qty)
+        execution = getattr(order_plan, 'execution', None)
+        if execution is None and self.max_impact:
+            try:
+                path = order_plan.pair if order_plan.side == 'buy' else order_plan.pair[::-1]
+                impact = price_impact(self.to_wei(order_plan.pair[-1], order_plan.qty), self.get_reserves(path), order_plan.side == 'buy')
+                if impact > self.max_impact:
+                    print(f"Price impact {impact:.2%} over {self.max_impact:.2%}, slicing {order_plan}")
+                    execution = 'iceberg'
+            except Exception as e:
+                print(f"Could not estimate price impact of {order_plan}: {e}")
+        if execution is not None:
+            TRACER.annotate(execution=execution)
+            return self.scheduler.submit(order_plan, bot, mode=execution)
+        return self.place_swap(order_plan, bot)
+
+    def place_swap(self, order_plan: OrderPlan, bot: TradingBot) -> Order:
+        """
+        Send order_plan as one swap
+        amount_in_max (buy) / amount_out_min (sell) in wei bound the swap, default 10% around the router estimate
+        """
         # todo:fee = amountin + chain fee
         amount = self.to_wei(order_plan.pair[-1], order_plan.qty)
         try:
@@ -538,7 +868,7 @@ class SwapBroker(BaseBroker):
                     bot=bot,
                     path=path,
                     amount_out=amount,
-                    amount_in_max=None  # order_plan.estimated_amount
+                    amount_in_max=getattr(order_plan, 'amount_in_max', None)
                 )
             elif order_plan.side == 'sell':
                 path = order_plan.pair[::-1]
@@ -546,7 +876,7 @@ class SwapBroker(BaseBroker):
                     bot=bot,
                     path=path,
                     amount_in=amount,
-                    amount_out_min=None  # order_plan.estimated_amount
+                    amount_out_min=getattr(order_plan, 'amount_out_min', None)
                 )
             order = Order(
                 id=str(ulid.new()), 
@@ -557,12 +887,25 @@ class SwapBroker(BaseBroker):
                 tx=tx,
                 estimated_amount=getattr(order_plan,'estimated_amount', None)
             )
+            TRACER.annotate(tx=tx)
             return order
 
         except Exception as e:
             print("Order failed: ", e)
             # raise ValueError("Order failed")
 
+    def place_orders(self, order_plans: list[OrderPlan], bot: TradingBot) -> list[Order]:
+        """
+        Place several order plans concurrently on the order pool.
+        Estimates, allowance checks and tx building overlap, sends stay ordered by the nonce manager.
+        Returns orders in the same order as order_plans, None for the failed ones.
+        """
+        if len(order_plans) <= 1:
+            return [self.place_order(op, bot) for op in order_plans]
+        # the order threads open their spans under the caller's one
+        futures = [self.executor.submit(TRACER.bind(self.place_order), op, bot) for op in order_plans]
+        return [f.result() for f in futures]
+
     def check_limit(order: Order) -> bool:
         """
         todo:
@@ -0,0 +1,55 @@
+import time, threading
+from urllib.parse import urlparse
+from web3 import HTTPProvider
+from lib.metrics import METRICS, RpcMetrics
+
+
+class InstrumentedHTTPProvider(HTTPProvider):
+    def __init__(self, endpoint_uri: str, metrics: RpcMetrics = None, **kwargs) -> None:
+        """
+        HTTPProvider recording every JSON-RPC request in metrics (default the process METRICS):
+        method, contract function, endpoint host, latency, payload bytes and errors.
+        A batch counts one request per call it carries, sharing the round trip time.
+        """
+        super().__init__(endpoint_uri, **kwargs)
+        self.metrics = metrics or METRICS
+        self.endpoint = urlparse(str(endpoint_uri)).netloc or str(endpoint_uri)
+        self._local = threading.local()  # payload sizes of the request running on this thread
+
+    def _make_request(self, method, request_data: bytes) -> bytes:
+        self._local.bytes_out = len(request_data)
+        raw = super()._make_request(method, request_data)
+        self._local.bytes_in = len(raw or b'')
+        return raw
+
+    def make_request(self, method, params):
+        t = time.perf_counter()
+        self._local.bytes_out = self._local.bytes_in = 0
+        error = True
+        try:
+            response = super().make_request(method, params)
+            error = isinstance(response, dict) and 'error' in response
+            return response
+        finally:
+            self.metrics.observe(
+                method,
+                self.metrics.function_of(method, params),
+                self.endpoint,
+                time.perf_counter() - t,
+                bytes_out=self._local.bytes_out,
+                bytes_in=self._local.bytes_in,
+                error=error,
+            )
+
+    def make_batch_request(self, batch_requests):
+        t = time.perf_counter()
+        responses = None
+        try:
+            responses = super().make_batch_request(batch_requests)
+            return responses
+        finally:
+            seconds = (time.perf_counter() - t) / max(1, len(batch_requests))
+            failed = not isinstance(responses, list)
+            for i, (method, params) in enumerate(batch_requests):
+                error = failed or i >= len(responses) or 'error' in responses[i]
+                self.metrics.observe(method, self.metrics.function_of(method, params), self.endpoint, seconds, error=error)
@@ -0,0 +1,277 @@
+import time, threading
+from typing import Callable
+from web3 import Web3
+from lib.broker.dex.vault_state import VAULT_EVENTS, read_vault_states
+
+
+class ReceiptTracker():
+    def __init__(self, gateway: Web3, timeout: float = 180) -> None:
+        """
+        Follow many sent transactions with one JSON-RPC batch of eth_getTransactionReceipt per poll,
+        instead of one wait per transaction.
+        timeout: seconds after which a transaction without receipt is reported as lost (callback gets None)
+        """
+        self.gateway = gateway
+        self.timeout = timeout
+        self._pending = {}  # tx hash -> (sent at, callback)
+        self._lock = threading.Lock()
+
+    def track(self, tx_hash: str, callback: Callable) -> None:
+        """
+        callback(receipt) once tx_hash is mined, receipt is a dict with int 'status', 'blockNumber', 'gasUsed'
+        """
+        with self._lock:
+            self._pending[tx_hash] = (time.time(), callback)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _fetch(self, hashes: list) -> list:
+        try:
+            responses = self.gateway.provider.make_batch_request([('eth_getTransactionReceipt', [h]) for h in hashes])
+            results = [r.get('result') for r in responses]
+        except Exception:
+            results = []
+            for h in hashes:
+                try:
+                    results.append(self.gateway.eth.get_transaction_receipt(h))
+                except Exception:
+                    results.append(None)
+        receipts = []
+        for r in results:
+            if r is None:
+                receipts.append(None)
+                continue
+            receipt = dict(r)
+            for key in ('status', 'blockNumber', 'gasUsed'):
+                if isinstance(receipt.get(key), str):
+                    receipt[key] = int(receipt[key], 16)
+            receipts.append(receipt)
+        return receipts
+
+    def poll(self) -> int:
+        """
+        Look up every pending transaction at once, run the callbacks of the mined (or lost) ones
+        Returns the number of transactions resolved
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return 0
+        hashes = list(pending)
+        resolved = 0
+        for tx_hash, receipt in zip(hashes, self._fetch(hashes)):
+            sent_at, callback = pending[tx_hash]
+            if receipt is None and time.time() - sent_at < self.timeout:
+                continue
+            with self._lock:
+                self._pending.pop(tx_hash, None)
+            resolved += 1
+            try:
+                callback(receipt)
+            except Exception as e:
+                print(f"Receipt callback of {tx_hash} failed: {e}")
+        return resolved
+
+
+class VaultFleet():
+    def __init__(self, broker, renew: dict = None, on_stop: Callable = None, sync_interval: float = 5,
+                 max_log_range: int = 1000, renew_retries: int = 3, renew_backoff: float = 60) -> None:
+        """
+        Lifecycle of many vaults run by the manager wallet:
+        - states of every vault read in one batch and refreshed from one getLogs over all vault addresses
+        - a timeline: on_stop(bot) when a vault reaches its stop time (starts its settlement right away),
+          updateVault renewals once its settlement is done
+        - renewals due together are signed with locally allocated nonces and sent back to back,
+          all followed by one ReceiptTracker
+        broker: SwapBroker shared by the bots, its vault state caches are the ones updated here
+        renew: default renewal {'deposit_time': seconds, 'live_time': seconds, 'max_shareholders': n}, None = never
+        on_stop: called with the bot of a vault whose stop time has come
+        sync_interval: minimum seconds between two event checks
+        renew_retries: reverted or lost renewals of a vault before it is no longer renewed
+        renew_backoff: seconds before the first retry of a renewal, doubled at every failure
+        """
+        self.broker = broker
+        self.renew_settings = renew
+        self.on_stop = on_stop
+        self.sync_interval = sync_interval
+        self.max_log_range = max_log_range
+        self.renew_retries = renew_retries
+        self.renew_backoff = renew_backoff
+        self.vaults = {}  # vault address -> {'bot', 'cache', 'renew', 'stopped', 'renewing', 'renew_failures', 'renew_at'}
+        self.receipts = ReceiptTracker(broker.gateway)
+        self.last_block = None
+        self.last_sync = 0.
+        self._lock = threading.RLock()
+
+    def add(self, bot, renew: dict = None) -> None:
+        """
+        Track the vault of bot, renew: renewal settings of this vault (default the fleet ones)
+        """
+        with self._lock:
+            self.vaults[bot.vault.address] = {
+                'bot': bot,
+                'cache': self.broker.get_vault_state(bot),
+                'renew': renew if renew is not None else self.renew_settings,
+                'stopped': None,    # stop timestamp on_stop was called for
+                'renewing': None,   # tx hash of the renewal in flight
+                'renew_failures': 0,
+                'renew_at': 0.,     # no renewal before this time (backoff after a failure)
+            }
+
+    def sync(self, force: bool = False) -> None:
+        """
+        One block number and one getLogs for every vault, the vaults that emitted an event
+        (or were never read) are re-read together in one batch
+        """
+        with self._lock:
+            if not force and time.time() - self.last_sync < self.sync_interval:
+                return
+            latest = self.broker.gateway.eth.block_number
+            stale = [a for a, v in self.vaults.items() if v['cache'].state is None]
+            known = [a for a in self.vaults if a not in stale]
+            if known and self.last_block is not None and latest > self.last_block:
+                if latest - self.last_block > self.max_log_range:
+                    stale += known
+                else:
+                    logs = self.broker.gateway.eth.get_logs({
+                        'fromBlock': self.last_block + 1,
+                        'toBlock': latest,
+                        'address': known,
+                        'topics': [list(VAULT_EVENTS)],
+                    })
+                    stale += list({Web3.to_checksum_address(log['address']) for log in logs} & set(known))
+            elif known and self.last_block is None:
+                stale += known
+            if stale:
+                states = read_vault_states(self.broker.gateway, [self.vaults[a]['cache'].contract for a in stale], latest)
+                for address, state in zip(stale, states):
+                    self.vaults[address]['cache'].seed(state, latest)
+                print(f"Vault fleet: {len(stale)} of {len(self.vaults)} vault states re-read in one batch")
+            for address in self.vaults:
+                cache = self.vaults[address]['cache']
+                cache.last_block = latest
+                cache.last_sync = time.time()
+            self.last_block = latest
+            self.last_sync = time.time()
+
+    def timeline(self, now: float = None) -> list:
+        """
+        Upcoming actions (time, action, vault address) in time order, action 'stop' or 'renew'
+        """
+        now = now or time.time()
+        events = []
+        for address, v in self.vaults.items():
+            state = v['cache'].state
+            if state is None or v['renewing']:
+                continue
+            if not state['vault_closed'] and state['stop_timestamp'] != v['stopped']:
+                events.append((state['stop_timestamp'], 'stop', address))
+            if v['renew'] and v['renew_failures'] < self.renew_retries and self._settled(v, now):
+                events.append((max(now, v['renew_at']), 'renew', address))
+        return sorted(events)
+
+    def _settled(self, v: dict, now: float) -> bool:
+        state = v['cache'].state
+        if state['vault_closed']:
+            return True
+        settlement = getattr(v['bot'], 'settlement', None) or {}
+        return now >= state['stop_timestamp'] and settlement.get('stage') == 'done'
+
+    def tick(self, now: float = None) -> None:
+        """
+        Refresh the states, follow the sent transactions, run the actions that are due
+        """
+        now = now or time.time()
+        try:
+            self.sync()
+            self.receipts.poll()
+        except Exception as e:
+            print(f"Vault fleet sync failed: {e}")
+            return
+        renewals = []
+        for due, action, address in self.timeline(now):
+            if due > now:
+                break
+            v = self.vaults[address]
+            if action == 'stop':
+                v['stopped'] = v['cache'].state['stop_timestamp']
+                print(f"Vault {address} reached its stop time, settling bot {v['bot'].id}")
+                if self.on_stop is not None:
+                    self.on_stop(v['bot'])
+            else:
+                renewals.append(address)
+        if renewals:
+            self.renew(renewals)
+
+    def renew(self, addresses: list) -> dict:
+        """
+        updateVault of every vault in addresses: one gas price, one block read, nonces allocated locally,
+        transactions sent back to back under the wallet lock without waiting for each other
+        Returns {address: tx hash} of the transactions sent
+        """
+        gateway = self.broker.gateway
+        block = gateway.eth.get_block('latest')
+        gas_price = self.broker.get_gas_price()
+        chain_id = gateway.eth.chain_id
+        started = time.time()
+        by_wallet = {}
+        for address in addresses:
+            bot = self.vaults[address]['bot']
+            by_wallet.setdefault(bot.wallet['address'], []).append(address)
+        sent = {}
+        for wallet, vault_addresses in by_wallet.items():
+            nonces = self.broker.nonces
+            with nonces.lock(wallet):
+                for address in vault_addresses:
+                    v = self.vaults[address]
+                    bot, renew = v['bot'], v['renew']
+                    try:
+                        txn = bot.vault.functions.updateVault(
+                            Web3.to_checksum_address(self.broker.tokens[bot.currency][0]),
+                            Web3.to_checksum_address(self.broker.tokens[bot.tokens[0]][0]),
+                            block['timestamp'] + int(renew.get('deposit_time', 3600)),  # runTimestamp
+                            block['timestamp'] + int(renew.get('live_time', 7200)),     # stopTimestamp
+                            int(renew.get('max_shareholders', 50)),
+                        ).build_transaction({
+                            'from': wallet,
+                            'nonce': nonces.next(wallet),
+                            'gas': 100_000,
+                            'gasPrice': gas_price,
+                            'chainId': chain_id,
+                        })
+                        signed = gateway.eth.account.sign_transaction(txn, private_key=bot.wallet['private'])
+                        tx_hash = Web3.to_hex(gateway.eth.send_raw_transaction(signed.raw_transaction))
+                    except Exception as e:
+                        # the nonce may be burnt or not, re-read it and leave the rest for the next tick
+                        nonces.reset(wallet)
+                        print(f"Renewal of vault {address} not sent: {e}")
+                        break
+                    v['renewing'] = tx_hash
+                    sent[address] = tx_hash
+                    self.receipts.track(tx_hash, lambda receipt, address=address: self._renewed(address, receipt))
+        print(f"Vault fleet: {len(sent)}/{len(addresses)} renewals sent in {time.time() - started:.2f}s")
+        return sent
+
+    def _renewed(self, address: str, receipt: dict) -> None:
+        v = self.vaults[address]
+        tx_hash, v['renewing'] = v['renewing'], None
+        if receipt is None or receipt.get('status') != 1:
+            if receipt is None:
+                self.broker.nonces.reset(v['bot'].wallet['address'])
+            v['renew_failures'] += 1
+            outcome = 'lost' if receipt is None else 'reverted'
+            if v['renew_failures'] >= self.renew_retries:
+                print(f"Renewal {tx_hash} of vault {address} {outcome} ({v['renew_failures']}/{self.renew_retries}), "
+                      f"not renewed any more")
+                return
+            wait = self.renew_backoff * 2 ** (v['renew_failures'] - 1)
+            v['renew_at'] = time.time() + wait
+            print(f"Renewal {tx_hash} of vault {address} {outcome} ({v['renew_failures']}/{self.renew_retries}), retried in {wait:g}s")
+            return
+        print(f"Vault {address} renewed in block {receipt.get('blockNumber')}")
+        v['renew_failures'], v['renew_at'] = 0, 0.
+        # re-read with the next batch, the bot starts a new round
+        v['cache'].invalidate()
+        if getattr(v['bot'], 'settlement', None):
+            v['bot'].settlement.clear()
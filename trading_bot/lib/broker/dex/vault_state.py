@@ -0,0 +1,148 @@
+import time, threading
+from web3 import Web3
+
+# events after which the vault state read from chain is stale
+VAULT_EVENTS = {
+    Web3.to_hex(Web3.keccak(text=signature)): signature.split('(')[0]
+    for signature in (
+        "VaultUpdated(address,address,uint256,uint256,uint256)",
+        "Deposited(address,uint256,uint256)",
+        "Withdrawn(address,uint256,uint256)",
+        "DepositsClosed()",
+        "VaultClosed()",
+    )
+}
+# getVaultState outputs, in order
+VAULT_STATE_OUTPUTS = ('total_shares', 'total_balance', 'shareholder_count', 'deposits_closed', 'vault_closed')
+# cached fields: the vault token balance moves with every swap and no vault event says so,
+# it comes from the BalanceLedger of the vault instead
+VAULT_FIELDS = tuple(f for f in VAULT_STATE_OUTPUTS if f != 'total_balance')
+
+
+def read_vault_states(gateway: Web3, contracts: list, block: int = None) -> list[dict]:
+    """
+    getVaultState, runTimestamp and stopTimestamp of every vault contract in one JSON-RPC batch,
+    falls back to one call per value (at block) when the node does not accept batches
+    """
+    calls = []
+    for contract in contracts:
+        calls += [contract.functions.getVaultState(), contract.functions.runTimestamp(), contract.functions.stopTimestamp()]
+    try:
+        with gateway.batch_requests() as batch:
+            for call in calls:
+                batch.add(call)
+            results = batch.execute()
+    except Exception as e:
+        print(f"Batch read of {len(contracts)} vaults failed, reading one by one: {e}")
+        results = [call.call(block_identifier=block or 'latest') for call in calls]
+    states = []
+    for i in range(len(contracts)):
+        vault_state, run_timestamp, stop_timestamp = results[3 * i: 3 * i + 3]
+        state = {k: v for k, v in zip(VAULT_STATE_OUTPUTS, vault_state) if k in VAULT_FIELDS}
+        state['run_timestamp'] = run_timestamp
+        state['stop_timestamp'] = stop_timestamp
+        states.append(state)
+    return states
+
+
+class VaultStateCache():
+    def __init__(self, gateway: Web3, contract, sync_interval: float = 30, max_log_range: int = 1000) -> None:
+        """
+        State of one vault contract (VAULT_FIELDS of getVaultState + run / stop timestamps), read once and
+        re-read only when the vault emitted one of VAULT_EVENTS since. Reading the state costs no RPC,
+        the phase (before run, running, stopped, closed) moves with the clock.
+        gateway: web3 gateway
+        contract: vault contract
+        sync_interval: minimum seconds between two event checks (one block number + one getLogs)
+        max_log_range: re-read instead of asking the node for more blocks of logs than this
+        """
+        self.gateway = gateway
+        self.contract = contract
+        self.address = Web3.to_checksum_address(contract.address)
+        self.state = None       # last state read from chain
+        self.last_block = None  # block the state is known to be current at
+        self.last_sync = 0.
+        self.sync_interval = sync_interval
+        self.max_log_range = max_log_range
+        self.reads = 0          # chain reads of the state, for the logs
+        self._lock = threading.RLock()
+
+    def seed(self, state: dict = None, block: int = None) -> dict:
+        """
+        Read the state from chain (or take state read elsewhere, e.g. in a fleet batch), events after block are checked by sync
+        """
+        with self._lock:
+            if block is None:
+                block = self.gateway.eth.block_number
+            if state is None:
+                state = read_vault_states(self.gateway, [self.contract], block)[0]
+            self.state = state
+            self.last_block = block
+            self.last_sync = time.time()
+            self.reads += 1
+            return self.state
+
+    def sync(self, force: bool = False) -> dict:
+        """
+        Re-read the state if the vault emitted an event since the last synced block
+        """
+        with self._lock:
+            if self.state is None:
+                return self.seed()
+            if not force and time.time() - self.last_sync < self.sync_interval:
+                return self.state
+            latest = self.gateway.eth.block_number
+            if latest <= self.last_block:
+                self.last_sync = time.time()
+                return self.state
+            if latest - self.last_block > self.max_log_range:
+                return self.seed(block=latest)
+            logs = self.gateway.eth.get_logs({
+                'fromBlock': self.last_block + 1,
+                'toBlock': latest,
+                'address': self.address,
+                'topics': [list(VAULT_EVENTS)],
+            })
+            self.apply_logs(logs, latest)
+            return self.state
+
+    def apply_logs(self, logs: list, block: int) -> bool:
+        """
+        Account for the vault logs of the blocks up to block, re-read the state if one of them is a VAULT_EVENTS
+        Returns True if the state was re-read
+        """
+        with self._lock:
+            events = [VAULT_EVENTS.get(Web3.to_hex(log['topics'][0])) for log in logs
+                      if log['topics'] and Web3.to_checksum_address(log['address']) == self.address]
+            events = [e for e in events if e is not None]
+            if events:
+                print(f"Vault {self.address} events {events}, state re-read")
+                self.seed(block=block)
+                return True
+            self.last_block = max(self.last_block or 0, block)
+            self.last_sync = time.time()
+            return False
+
+    def invalidate(self) -> None:
+        """
+        Force a re-read on the next get (after a transaction of ours changed the vault)
+        """
+        with self._lock:
+            self.state = None
+
+    def get(self, now: float = None) -> dict:
+        """
+        Vault state with its phase at now: 'pending' (before run), 'running', 'stopped' (after stop) or 'closed'
+        """
+        now = now or time.time()
+        with self._lock:
+            state = dict(self.sync())
+        if state['vault_closed']:
+            state['phase'] = 'closed'
+        elif now < state['run_timestamp']:
+            state['phase'] = 'pending'
+        elif now < state['stop_timestamp']:
+            state['phase'] = 'running'
+        else:
+            state['phase'] = 'stopped'
+        return state
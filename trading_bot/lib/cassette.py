@@ -0,0 +1,246 @@
+import atexit, gzip, json, os, threading, time
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+# query parameters that change on every request and are left out of the match, e.g. the candle end time
+VOLATILE_PARAMS = ('before_timestamp',)
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class Cassette():
+    def __init__(self) -> None:
+        """
+        HTTP traffic of the process (JSON-RPC of the broker gateway, market data of the strategies)
+        written to or served from a gzip json-lines file. Off until configure_cassette() loads one.
+        mode 'record': every request / response goes to the file with its latency
+        mode 'replay': responses come from the file, no network; realtime=True waits the recorded latency
+        """
+        self.mode = None
+        self.path = None
+        self.realtime = False
+        self.recorded = 0
+        self.served = 0
+        self.misses = 0
+        self._started = 0.
+        self._file = None
+        self._entries = []
+        self._used = []
+        self._by_key = {}    # exact request -> deque of entry indexes, recorded order
+        self._by_group = {}  # same calls with other arguments (new nonce, deadline, signature) -> deque
+        self._last = {}      # key / group -> last entry served, repeated when replay polls more than recorded
+        self._lock = threading.Lock()
+
+    def load(self, path: str, mode: str = 'replay', realtime: bool = False) -> 'Cassette':
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', got {mode}")
+        self.close()
+        self.path, self.mode, self.realtime = path, mode, realtime
+        self._started = time.time()
+        if mode == 'record':
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._file = gzip.open(path, 'at', encoding='utf-8')
+            self._file.write(json.dumps({'cassette': 1, 'started': self._started}) + '\n')
+            return self
+        self._entries, self._by_key, self._by_group, self._last = [], {}, {}, {}
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                entry = json.loads(line)
+                if 'cassette' in entry:
+                    continue  # header of a recording session
+                key, group = self.match_keys(entry['method'], entry['url'], entry.get('body'))
+                self._by_key.setdefault(key, deque()).append(len(self._entries))
+                self._by_group.setdefault(group, deque()).append(len(self._entries))
+                self._entries.append(entry)
+        self._used = [False] * len(self._entries)
+        return self
+
+    @staticmethod
+    def match_keys(method: str, url: str, body: str = None) -> tuple:
+        """
+        (exact key, group key) of a request. JSON-RPC requests match on their calls without the request ids
+        (any relay), other requests on method and url without the volatile query parameters.
+        """
+        rpc = None
+        if body:
+            try:
+                rpc = json.loads(body)
+            except (ValueError, TypeError):
+                rpc = None
+        calls = rpc if isinstance(rpc, list) else [rpc]
+        if rpc is not None and all(isinstance(c, dict) and 'method' in c for c in calls):
+            key = json.dumps([[c['method'], c.get('params')] for c in calls], sort_keys=True)
+            return 'rpc ' + key, 'rpc ' + ','.join(_call_group(c) for c in calls)
+        parts = urlsplit(url)
+        query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k not in VOLATILE_PARAMS])
+        return f"{method} {urlunsplit(parts._replace(query=query))} {body or ''}", f"{method} {parts.netloc}{parts.path}"
+
+    def record(self, method: str, url: str, body: str, status: int, headers: dict, content: str, seconds: float) -> None:
+        entry = {
+            't': round(time.time() - self._started, 4), 'ms': round(seconds * 1000, 2),
+            'method': method, 'url': url, 'body': body,
+            'status': status, 'headers': headers, 'response': content,
+        }
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self.recorded += 1
+            if self.recorded % 200 == 0:
+                self._file.flush()
+
+    def play(self, method: str, url: str, body: str = None) -> dict:
+        """
+        Recorded entry for a request: first unused one with the same calls, else the last one served
+        for the same calls (polls), else the first unused one of the same group (same methods, contracts
+        and functions), else the last one of the group. Raises CassetteMiss when the cassette never saw it.
+        """
+        key, group = self.match_keys(method, url, body)
+        with self._lock:
+            i = self._next_unused(self._by_key, key)
+            if i is None:
+                i = self._last.get(key)
+            if i is None:
+                i = self._next_unused(self._by_group, group)
+            if i is None:
+                i = self._last.get(group)
+            if i is not None:
+                self._last[key] = self._last[group] = i
+            if i is None:
+                self.misses += 1
+                raise CassetteMiss(f"No recorded response for {method} {url} {(body or '')[:200]}")
+            self.served += 1
+        return self._entries[i]
+
+    def _next_unused(self, index: dict, key: str) -> int | None:
+        queue = index.get(key)
+        while queue:
+            i = queue.popleft()
+            if not self._used[i]:
+                self._used[i] = True
+                return i
+        return None
+
+    def mount(self, session, **adapter_kwargs):
+        """
+        Route the requests of session through the cassette when one is loaded, returns session
+        adapter_kwargs: connection pool size, as for HTTPAdapter
+        """
+        if self.mode is not None:
+            adapter = CassetteAdapter(self, **adapter_kwargs)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                print(f"Cassette {self.path}: {self.recorded} requests recorded")
+            elif self.mode == 'replay':
+                print(f"Cassette {self.path}: {self.served} responses served, {self.misses} misses")
+
+
+CASSETTE = Cassette()  # one per process, sessions created while it is loaded go through it
+
+
+class CassetteAdapter(HTTPAdapter):
+    def __init__(self, cassette: Cassette, **kwargs) -> None:
+        """
+        Transport adapter of a requests session: records through the real connection pool, or replays
+        """
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+        if self.cassette.mode == 'replay':
+            return self._replay(request, body)
+        t = time.perf_counter()
+        response = super().send(request, **kwargs)
+        seconds = time.perf_counter() - t
+        try:
+            content = response.content.decode(response.encoding or 'utf-8')
+            headers = {'Content-Type': response.headers.get('Content-Type', '')}
+            self.cassette.record(request.method, request.url, body, response.status_code, headers, content, seconds)
+        except Exception as e:
+            print(f"Cassette could not record {request.url}: {e}")
+        return response
+
+    def _replay(self, request, body: str) -> Response:
+        entry = self.cassette.play(request.method, request.url, body)
+        if self.cassette.realtime:
+            time.sleep(entry['ms'] / 1000)
+        content = _with_request_ids(entry['response'], entry.get('body'), body)
+        response = Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry.get('headers') or {})
+        response._content = content.encode('utf-8')
+        response._content_consumed = True  # no raw stream to close
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.reason = 'OK' if entry['status'] < 400 else 'Error'
+        response.connection = self
+        return response
+
+
+def _call_group(call: dict) -> str:
+    """
+    Method of a JSON-RPC call with the contract and 4-byte selector it calls (eth_call, eth_estimateGas),
+    so a replayed balanceOf never gets the response of a getReserves
+    """
+    params = call.get('params')
+    tx = params[0] if isinstance(params, list) and params and isinstance(params[0], dict) else None
+    if tx is None:
+        return call['method']
+    data = tx.get('data') or tx.get('input') or ''
+    return f"{call['method']}:{str(tx.get('to', '')).lower()}:{data[:10]}"
+
+
+def _with_request_ids(content: str, recorded_body: str, body: str) -> str:
+    """
+    Recorded JSON-RPC response with the ids of the current request, web3 matches responses on them
+    """
+    try:
+        old, new, payload = json.loads(recorded_body), json.loads(body), json.loads(content)
+    except (ValueError, TypeError):
+        return content
+    if isinstance(payload, dict) and isinstance(new, dict):
+        payload['id'] = new.get('id')
+    elif isinstance(payload, list) and isinstance(old, list) and isinstance(new, list):
+        ids = {o.get('id'): n.get('id') for o, n in zip(old, new)}
+        for item in payload:
+            item['id'] = ids.get(item.get('id'), item.get('id'))
+    else:
+        return content
+    return json.dumps(payload)
+
+
+def configure_cassette(path: str = None, mode: str = None, speed: str = None) -> Cassette:
+    """
+    Record the HTTP traffic to path, or replay it from there ('recorded' speed or 'fast'),
+    defaults from the CASSETTE_FILE, CASSETTE_MODE and CASSETTE_SPEED environment variables.
+    Call it before the broker and the candle cache are built, their sessions mount it when created.
+    """
+    path = path or os.getenv('CASSETTE_FILE')
+    if not path:
+        return CASSETTE
+    mode = mode or os.getenv('CASSETTE_MODE', 'record')
+    speed = speed or os.getenv('CASSETTE_SPEED', 'fast')
+    CASSETTE.load(path, mode=mode, realtime=speed == 'recorded')
+    if mode == 'record':
+        print(f"Recording HTTP / JSON-RPC traffic to {path}")
+    else:
+        print(f"Replaying HTTP / JSON-RPC traffic from {path}, {len(CASSETTE._entries)} responses at {speed} speed")
+    atexit.register(CASSETTE.close)
+    return CASSETTE
@@ -0,0 +1,158 @@
+import json, os, queue, threading, time
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+
+class RotatingFile():
+    def __init__(self, path: str, max_bytes: int = 50 * 2 ** 20, backups: int = 5) -> None:
+        """
+        Append-only text file rolled over to path.1 ... path.backups once it grows over max_bytes
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, 'a')
+
+    def write(self, text: str) -> None:
+        self._file.write(text)
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self) -> None:
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a')
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class EventLog():
+    def __init__(self, level: str = 'info', console: str = 'info', max_queue: int = 10_000) -> None:
+        """
+        Structured events of the trading loop (signal, order_submitted, fill, balance_update, ...).
+        emit() checks the level and appends the raw fields to a bounded queue (events are dropped, and counted,
+        when it is full); a background thread formats them and writes json lines to the file set by
+        configure_events() and one-line summaries to stdout for the events at or above the console level.
+        """
+        self.file = None
+        self.level = LEVELS[level]
+        self.console = LEVELS[console] if console else None
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enabled(self, level: str) -> bool:
+        """
+        True when an event of level goes somewhere, check it before building expensive fields
+        """
+        value = LEVELS[level]
+        return (self.file is not None and value >= self.level) or (self.console is not None and value >= self.console)
+
+    def emit(self, event: str, level: str = 'info', **fields) -> None:
+        if not self.enabled(level):
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((time.time(), event, level, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    # === typed events, their fields are read here and formatted by the writer thread ===
+    def signal(self, bot_id: str, symbol: str, plan) -> None:
+        if self.enabled('info'):
+            self.emit('signal', 'info', bot=bot_id, symbol=symbol, action=plan.action, side=plan.side,
+                      qty=getattr(plan, 'qty', None), price=getattr(plan, 'price', None))
+
+    def order_submitted(self, bot_id: str, trade_id: str, action: str, order) -> None:
+        if self.enabled('info'):
+            self.emit('order_submitted', 'info', bot=bot_id, trade=trade_id, action=action, order=getattr(order, 'id', None),
+                      symbol=getattr(order, 'symbol', None), side=getattr(order, 'side', None), tx=getattr(order, 'tx', None))
+
+    def fill(self, bot_id: str, trade_id: str, action: str, order, level: str = 'info') -> None:
+        if self.enabled(level):
+            self.emit('fill', level, bot=bot_id, trade=trade_id, action=action, order=order.id, symbol=order.symbol,
+                      side=order.side, price=order.price, amount_in=order.amount_in, amount_out=order.amount_out,
+                      fee=getattr(order, 'fee', None), tx=getattr(order, 'tx', None))
+
+    def balance_update(self, bot_id: str, balances: dict, fund: dict) -> None:
+        if self.enabled('debug'):
+            # copies: the writer formats them later, the bot keeps changing the originals
+            self.emit('balance_update', 'debug', bot=bot_id,
+                      balances={t: dict(v) if isinstance(v, dict) else v for t, v in balances.items()},
+                      fund={t: dict(v) for t, v in fund.items()})
+
+    # === writer ===
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Event log write of {len(batch)} events failed: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch: list) -> None:
+        lines = []
+        for ts, event, level, fields in batch:
+            value = LEVELS[level]
+            if self.file is not None and value >= self.level:
+                lines.append(json.dumps({'ts': round(ts, 3), 'event': event, 'level': level, **fields}, default=str) + '\n')
+            if self.console is not None and value >= self.console:
+                print(f"[{event}] " + ' '.join(f"{k}={v}" for k, v in fields.items() if v is not None))
+        if lines:
+            self.file.write(''.join(lines))
+            self.file.flush()
+
+    def flush(self, timeout: float = 5) -> None:
+        """
+        Wait until the queued events are written
+        """
+        deadline = time.time() + timeout
+        while self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.02)
+
+
+EVENTS = EventLog()  # one per process, stdout only until configure_events adds a file
+
+
+def configure_events(path: str = None, level: str = None, console: str = None, max_bytes: int = 50 * 2 ** 20, backups: int = 5) -> EventLog:
+    """
+    Write the events to a rotating json-lines file at path, at or above level; console: level echoed to stdout
+    ('' or 'off' to silence it). Defaults from the EVENT_LOG, EVENT_LEVEL and EVENT_CONSOLE environment variables.
+    """
+    path = path or os.getenv('EVENT_LOG')
+    level = level or os.getenv('EVENT_LEVEL', 'info')
+    console = console if console is not None else os.getenv('EVENT_CONSOLE', 'info')
+    EVENTS.level = LEVELS[level]
+    EVENTS.console = LEVELS[console] if console and console != 'off' else None
+    if path:
+        EVENTS.file = RotatingFile(path, max_bytes=int(max_bytes), backups=int(backups))
+        print(f"Events logged to {path} (level {level})")
+    return EVENTS
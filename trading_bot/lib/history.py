@@ -0,0 +1,80 @@
+from collections import deque
+from typing import Iterator
+from db.analytics import TradeAnalytics
+from db.writer import get_writer
+
+
+class TradeHistory():
+    def __init__(self, bot_id: str, maxlen: int = 200, page_size: int = 500) -> None:
+        """
+        Closed trades of a bot: the last maxlen kept in memory as slim rows (the trades table columns,
+        no Order objects or broker references), everything older paged from the database on demand.
+        Memory stays flat however long the bot runs.
+        maxlen: closed trades kept in memory
+        page_size: rows per database page of iter_all()
+        """
+        self.bot_id = bot_id
+        self.maxlen = maxlen
+        self.page_size = page_size
+        self._recent = deque(maxlen=maxlen)
+        self.closed = 0  # trades closed since the process started
+        self.profit = 0.  # their realized profit
+
+    def append(self, row: dict) -> None:
+        """
+        Add a closed trade row (see TradingBot.trade_row), the oldest one leaves the window when full
+        """
+        self._recent.append(row)
+        self.closed += 1
+        self.profit += row.get('profit') or 0
+
+    def load(self, rows: list) -> None:
+        """
+        Fill the window with rows restored from a snapshot, oldest first, without counting them as closed now
+        """
+        self._recent.extend(rows)
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def __iter__(self) -> Iterator[dict]:
+        # oldest first, like the list it replaces
+        return iter(self._recent)
+
+    def __getitem__(self, index: int) -> dict:
+        return self._recent[index]
+
+    def recent(self, n: int = None) -> list:
+        """
+        Last n closed trades in memory, newest first
+        """
+        rows = list(reversed(self._recent))
+        return rows if n is None else rows[:n]
+
+    def iter_all(self, pair: str = None) -> Iterator[dict]:
+        """
+        Every closed trade of the bot, newest first: the in-memory window, then older trades
+        fetched lazily from the database one page at a time as the caller iterates
+        """
+        seen = set()
+        for row in reversed(self._recent):
+            if pair is None or row.get('pair') == pair:
+                seen.add(row['id'])
+                yield row
+        # trades that just left the window may still be queued in the writer
+        get_writer().flush(wait=True, timeout=5)
+        analytics = TradeAnalytics(page_size=self.page_size)
+        cursor = None
+        while True:
+            page = analytics.trades(bot_id=self.bot_id, status='close', pair=pair, cursor=cursor, desc=True)
+            for row in page['items']:
+                if row['id'] not in seen:
+                    yield row
+            cursor = page['next']
+            if cursor is None:
+                return
+
+    def __repr__(self) -> str:
+        last = self._recent[-1] if self._recent else None
+        last = f", last {last['id']} {last.get('pair')} profit {last.get('profit')}" if last else ''
+        return f"TradeHistory({self.closed} closed this run, profit {self.profit:.6g}, {len(self._recent)}/{self.maxlen} in memory{last})"
@@ -0,0 +1,226 @@
+import bisect, hmac, json, os, threading, time
+from collections import deque
+from contextlib import contextmanager
+
+# seconds, upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+
+class Histogram():
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS, keep: int = 512) -> None:
+        """
+        Cumulative bucket counts for Prometheus plus the last keep values for exact percentiles
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.
+        self.count = 0
+        self.recent = deque(maxlen=keep)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> float | None:
+        if not self.recent:
+            return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class RpcMetrics():
+    def __init__(self) -> None:
+        """
+        JSON-RPC calls of the process by (method, contract function, endpoint):
+        count, errors, request / response bytes and latency histogram.
+        Contract functions are named from the 4 bytes selector of eth_call / eth_estimateGas data,
+        for the ABIs registered with register_abi.
+        tally() counts the calls made by the current thread inside a block, e.g. one bot cycle.
+        """
+        self._series = {}       # (method, function, endpoint) -> series
+        self._selectors = {}    # '0x12345678' -> 'Label.function'
+        self._collectors = []   # functions returning extra exposition lines
+        self._abis = set()      # (label, abi json) already registered
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def register_abi(self, abi: list, label: str = None) -> None:
+        """
+        Name the contract functions of abi (list or json string) in the metrics, label: contract name prefix, e.g. 'router'
+        """
+        from eth_utils import function_abi_to_4byte_selector  # comes with web3
+        if not abi:
+            return
+        key = (label, abi if isinstance(abi, str) else json.dumps(abi, sort_keys=True))
+        if key in self._abis:
+            return  # every token shares the same ERC20 abi
+        self._abis.add(key)
+        if isinstance(abi, str):
+            abi = json.loads(abi)
+        for item in abi:
+            if item.get('type') != 'function':
+                continue
+            selector = '0x' + function_abi_to_4byte_selector(item).hex()
+            self._selectors.setdefault(selector, f"{label}.{item['name']}" if label else item['name'])
+
+    def function_of(self, method: str, params) -> str:
+        """
+        Contract function called by a request, '' for plain node calls
+        """
+        data = None
+        if method in ('eth_call', 'eth_estimateGas') and params and isinstance(params[0], dict):
+            data = params[0].get('data') or params[0].get('input')
+        if not data:
+            return ''
+        if isinstance(data, bytes):
+            data = '0x' + data.hex()
+        selector = data[:10]
+        return self._selectors.get(selector, selector)
+
+    def observe(self, method: str, function: str, endpoint: str, seconds: float, bytes_out: int = 0,
+                bytes_in: int = 0, error: bool = False) -> None:
+        key = (method, function, endpoint)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'count': 0, 'errors': 0, 'bytes_out': 0, 'bytes_in': 0, 'latency': Histogram()}
+            series['count'] += 1
+            series['errors'] += 1 if error else 0
+            series['bytes_out'] += bytes_out
+            series['bytes_in'] += bytes_in
+            series['latency'].observe(seconds)
+        for tally in getattr(self._local, 'tallies', ()):
+            name = f"{method}:{function}" if function else method
+            tally[name] = tally.get(name, 0) + 1
+
+    @contextmanager
+    def tally(self):
+        """
+        Count the calls made by this thread inside the block: {method[:function]: calls}
+        """
+        tallies = self._local.__dict__.setdefault('tallies', [])
+        tally = {}
+        tallies.append(tally)
+        try:
+            yield tally
+        finally:
+            tallies.remove(tally)
+
+    def add_collector(self, collector) -> None:
+        """
+        collector() returns more exposition lines for render(), e.g. bot cycle gauges
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> list[dict]:
+        """
+        One row per series with count, errors, bytes and p50 / p90 / p99 latency (seconds), busiest first
+        """
+        with self._lock:
+            items = list(self._series.items())
+        rows = []
+        for (method, function, endpoint), s in items:
+            h = s['latency']
+            rows.append({
+                'method': method, 'function': function, 'endpoint': endpoint,
+                'count': s['count'], 'errors': s['errors'], 'bytes_out': s['bytes_out'], 'bytes_in': s['bytes_in'],
+                'seconds': h.sum, 'p50': h.percentile(0.5), 'p90': h.percentile(0.9), 'p99': h.percentile(0.99),
+            })
+        return sorted(rows, key=lambda r: r['seconds'], reverse=True)
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition of every series
+        """
+        def labels(method, function, endpoint, **extra):
+            pairs = {'method': method, 'function': function, 'endpoint': endpoint, **extra}
+            return '{' + ','.join(f'{k}="{str(v)}"' for k, v in pairs.items()) + '}'
+
+        with self._lock:
+            items = list(self._series.items())
+            lines = [
+                '# HELP rpc_requests_total JSON-RPC requests by method, contract function and endpoint',
+                '# TYPE rpc_requests_total counter',
+            ]
+            lines += [f"rpc_requests_total{labels(*k)} {s['count']}" for k, s in items]
+            lines += ['# HELP rpc_errors_total JSON-RPC requests that failed or returned an error', '# TYPE rpc_errors_total counter']
+            lines += [f"rpc_errors_total{labels(*k)} {s['errors']}" for k, s in items]
+            lines += ['# HELP rpc_request_bytes_total Request payload bytes', '# TYPE rpc_request_bytes_total counter']
+            lines += [f"rpc_request_bytes_total{labels(*k)} {s['bytes_out']}" for k, s in items]
+            lines += ['# HELP rpc_response_bytes_total Response payload bytes', '# TYPE rpc_response_bytes_total counter']
+            lines += [f"rpc_response_bytes_total{labels(*k)} {s['bytes_in']}" for k, s in items]
+            lines += ['# HELP rpc_latency_seconds JSON-RPC round trip latency', '# TYPE rpc_latency_seconds histogram']
+            for k, s in items:
+                h = s['latency']
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f"rpc_latency_seconds_bucket{labels(*k, le=bound)} {cumulative}")
+                lines.append(f"rpc_latency_seconds_sum{labels(*k)} {h.sum}")
+                lines.append(f"rpc_latency_seconds_count{labels(*k)} {h.count}")
+        for collector in self._collectors:
+            try:
+                lines += collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return '\n'.join(lines) + '\n'
+
+    def report(self, n: int = 10) -> None:
+        """
+        Print the n series that took the most time
+        """
+        for r in self.snapshot()[:n]:
+            name = f"{r['method']} {r['function']}".strip()
+            print(f"  {name:<45} {r['count']:7d} calls {r['seconds']:8.2f}s p50 {(r['p50'] or 0) * 1000:7.1f}ms "
+                  f"p99 {(r['p99'] or 0) * 1000:7.1f}ms {r['errors']} errors {r['bytes_in'] / 1024:.0f} KiB in  [{r['endpoint']}]")
+
+
+METRICS = RpcMetrics()  # one registry per process, filled by the instrumented providers
+
+
+def serve_metrics(port: int, host: str = '0.0.0.0', profile_token: str = None) -> threading.Thread:
+    """
+    Expose METRICS at http://host:port/metrics (Prometheus format) from a background thread.
+    profile_token (default the PROFILE_TOKEN environment variable): adds /profile to arm the cycle profiler
+    (see lib/profiler.py), only for requests with the header 'Authorization: Bearer <token>'.
+    Without a token the endpoint does not exist, the port can be scraped from anywhere.
+    """
+    from fastapi import FastAPI, Header, HTTPException
+    from fastapi.responses import PlainTextResponse
+    import uvicorn
+
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    profile_token = profile_token or os.getenv('PROFILE_TOKEN')
+
+    @app.get('/metrics', response_class=PlainTextResponse)
+    def metrics():
+        return PlainTextResponse(METRICS.render(), media_type='text/plain; version=0.0.4')
+
+    if profile_token:
+        def check(authorization: str | None) -> None:
+            if not hmac.compare_digest((authorization or '').encode(), f"Bearer {profile_token}".encode()):
+                raise HTTPException(status_code=401, detail='Invalid profile token')
+
+        # profile the next cycles of a live process:
+        # curl -X POST -H "Authorization: Bearer $PROFILE_TOKEN" 'http://host:port/profile?cycles=3&bot=bot_1'
+        @app.post('/profile')
+        def profile(cycles: int = 3, bot: str = None, interval: float = None, authorization: str = Header(None)):
+            check(authorization)
+            from lib.profiler import PROFILER
+            PROFILER.arm(cycles, bots=[bot] if bot else None, interval=interval)
+            return PROFILER.status()
+
+        @app.get('/profile')
+        def profile_status(authorization: str = Header(None)):
+            check(authorization)
+            from lib.profiler import PROFILER
+            return PROFILER.status()
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=int(port), log_level='warning'))
+    thread = threading.Thread(target=server.run, name='metrics', daemon=True)
+    thread.start()
+    print(f"Metrics served on http://{host}:{port}/metrics")
+    return thread
@@ -0,0 +1,104 @@
+import time
+
+
+class OrderNetter():
+    def __init__(self, window: float = 0, min_qty: float = 1e-12) -> None:
+        """
+        Net the market order plans of a bot per pair before they reach the broker.
+        Buys and sells of the same pair (strategy, take profit / stop loss, ...) cancel each other out
+        and the remainder goes out as one swap, its fill is then allocated back to every originating trade.
+        window: seconds a plan may wait in the queue for other plans of its pair (0 = net within one submission)
+        min_qty: net quantity under this is treated as fully crossed, no swap is sent
+        """
+        self.window = window
+        self.min_qty = min_qty
+
+    @staticmethod
+    def symbol(pair: list) -> str:
+        return ''.join(pair[::-1])
+
+    @staticmethod
+    def nettable(order_plan) -> bool:
+        # sliced executions (twap / iceberg) keep their own schedule
+        return (getattr(order_plan, 'order_type', 'market') == 'market'
+                and getattr(order_plan, 'execution', None) is None
+                and (getattr(order_plan, 'qty', None) or 0) > 0)
+
+    def split(self, jobs: list, now: float = None, flush: bool = False) -> tuple[list, list]:
+        """
+        Group queued (trade, order_plan) jobs per pair
+        Returns
+        groups: list of dict(pair, jobs, side, qty, plan), plan is the net OrderPlan (None when fully crossed).
+            A group of one job keeps its own plan and is placed as before.
+        held: jobs still inside their netting window, to queue again
+        """
+        now = time.time() if now is None else now
+        by_symbol = {}
+        groups = []
+        for trade, order_plan in jobs:
+            if not self.nettable(order_plan):
+                groups.append(self.single(trade, order_plan))
+                continue
+            if getattr(order_plan, 'queued_at', None) is None:
+                order_plan.queued_at = now
+            by_symbol.setdefault(self.symbol(order_plan.pair), []).append((trade, order_plan))
+
+        held = []
+        for symbol_jobs in by_symbol.values():
+            oldest = min(op.queued_at for _, op in symbol_jobs)
+            # protective exits (tp / sl / trailing) never wait, they take the held plans of their pair along
+            urgent = any(getattr(op, 'trigger', None) for _, op in symbol_jobs)
+            if not flush and not urgent and self.window > 0 and now - oldest < self.window:
+                held += symbol_jobs
+            elif len(symbol_jobs) == 1:
+                groups.append(self.single(*symbol_jobs[0]))
+            else:
+                groups.append(self.net(symbol_jobs))
+        return groups, held
+
+    def single(self, trade, order_plan) -> dict:
+        return {
+            'pair': order_plan.pair,
+            'jobs': [(trade, order_plan)],
+            'side': order_plan.side,
+            'qty': getattr(order_plan, 'qty', None),
+            'plan': order_plan,
+            'netted': False,
+        }
+
+    def net(self, jobs: list) -> dict:
+        """
+        One net plan for the jobs of a pair, qty is in base token for both sides
+        """
+        from lib.trading import OrderPlan  # lib.trading imports this module
+
+        pair = jobs[0][1].pair
+        bought = sum(op.qty for _, op in jobs if op.side == 'buy')
+        sold = sum(op.qty for _, op in jobs if op.side == 'sell')
+        side = 'buy' if bought >= sold else 'sell'
+        qty = abs(bought - sold)
+        plan = None
+        if qty >= self.min_qty:
+            # price hint of the remainder: qty weighted price of the plans on the net side
+            priced = [op for _, op in jobs if op.side == side and getattr(op, 'price', None)]
+            weight = sum(op.qty for op in priced)
+            price = sum(op.price * op.qty for op in priced) / weight if weight else None
+            plan = OrderPlan(
+                action='net',
+                side=side,
+                pair=list(pair),
+                order_type='market',
+                qty=qty,
+                price=price,
+                estimated_amount=qty * price if price else None,
+            )
+        print(f"Netted {len(jobs)} plans of {self.symbol(pair)}: buy {bought}, sell {sold} -> {side} {qty}")
+        return {
+            'pair': pair,
+            'jobs': jobs,
+            'side': side,
+            'qty': qty,
+            'crossed': min(bought, sold),
+            'plan': plan,
+            'netted': True,
+        }
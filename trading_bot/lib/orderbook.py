@@ -0,0 +1,121 @@
+import heapq, itertools
+
+
+class LimitOrderBook():
+    def __init__(self) -> None:
+        """
+        Waiting limit orders indexed by trigger price and expiry.
+        Each entry is a Trade holding an order_plan with side, pair, limit and exp_time.
+        Per pair, buys sit in a max-heap (trigger when price <= limit) and sells in a min-heap
+        (trigger when price >= limit), so a price update pops only the crossed orders in O(log n) each.
+        It also behaves like the list it replaces in process_trades['waiting'] (append, remove, len, iteration).
+        """
+        self._buys = {}     # symbol -> heap of (-limit, seq, trade id)
+        self._sells = {}    # symbol -> heap of (limit, seq, trade id)
+        self._expiry = []   # heap of (exp_time, seq, trade id)
+        self._pairs = {}    # symbol -> pair to quote
+        self._live = {}     # trade id -> (seq, trade), removed or replaced entries stay in heaps until popped
+        self._seq = itertools.count()
+
+    @staticmethod
+    def symbol(pair: list) -> str:
+        return ''.join(pair[::-1])
+
+    def append(self, trade) -> None:
+        order_plan = trade.order_plan
+        limit = getattr(order_plan, 'limit', None)
+        if limit is None:
+            raise ValueError(f"Limit order needs a limit price: {order_plan}")
+        symbol = self.symbol(order_plan.pair)
+        seq = next(self._seq)
+        self._pairs[symbol] = list(order_plan.pair)
+        if order_plan.side == 'buy':
+            heapq.heappush(self._buys.setdefault(symbol, []), (-float(limit), seq, trade.id))
+        else:
+            heapq.heappush(self._sells.setdefault(symbol, []), (float(limit), seq, trade.id))
+        exp_time = getattr(order_plan, 'exp_time', None)
+        if exp_time is not None:
+            heapq.heappush(self._expiry, (float(exp_time), seq, trade.id))
+        self._live[trade.id] = (seq, trade)
+        self._compact()
+
+    def remove(self, trade) -> None:
+        if self._live.pop(trade.id, None) is None:
+            raise ValueError(f"Trade {trade.id} is not waiting")
+
+    def _valid(self, entry) -> bool:
+        live = self._live.get(entry[2])
+        return live is not None and live[0] == entry[1]
+
+    def _pop(self, heap) -> list:
+        entry = heapq.heappop(heap)
+        if self._valid(entry):
+            return [self._live.pop(entry[2])[1]]
+        return []
+
+    def pairs(self) -> list:
+        """
+        Pairs with at least one live order, quote each once per price update
+        """
+        return [self._pairs[s] for s in set(self._buys) | set(self._sells) if self._has_live(s)]
+
+    def crossed(self, pair: list, price: float) -> list:
+        """
+        Pop and return the orders of pair triggered by price
+        """
+        symbol = self.symbol(pair)
+        triggered = []
+        buys = self._buys.get(symbol, [])
+        while buys and (-buys[0][0] >= price or not self._valid(buys[0])):
+            triggered += self._pop(buys)
+        sells = self._sells.get(symbol, [])
+        while sells and (sells[0][0] <= price or not self._valid(sells[0])):
+            triggered += self._pop(sells)
+        return triggered
+
+    def expired(self, now: float) -> list:
+        """
+        Pop and return the orders whose exp_time has passed
+        """
+        expired = []
+        while self._expiry and (self._expiry[0][0] <= now or not self._valid(self._expiry[0])):
+            expired += self._pop(self._expiry)
+        return expired
+
+    def _has_live(self, symbol: str) -> bool:
+        for heap in (self._buys.get(symbol, []), self._sells.get(symbol, [])):
+            while heap and not self._valid(heap[0]):
+                heapq.heappop(heap)
+            if heap:
+                return True
+        self._buys.pop(symbol, None)
+        self._sells.pop(symbol, None)
+        self._pairs.pop(symbol, None)
+        return False
+
+    def _compact(self) -> None:
+        # rebuild heaps once removed entries outnumber live ones
+        size = len(self._expiry) + sum(len(h) for h in self._buys.values()) + sum(len(h) for h in self._sells.values())
+        if size <= 64 or size <= 3 * len(self._live):
+            return
+        for heaps in (self._buys, self._sells):
+            for symbol, heap in heaps.items():
+                heaps[symbol] = [e for e in heap if self._valid(e)]
+                heapq.heapify(heaps[symbol])
+        self._expiry = [e for e in self._expiry if self._valid(e)]
+        heapq.heapify(self._expiry)
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def __iter__(self):
+        return iter([trade for _, trade in self._live.values()])
+
+    def __getitem__(self, index):
+        return [trade for _, trade in self._live.values()][index]
+
+    def __contains__(self, trade) -> bool:
+        return getattr(trade, 'id', None) in self._live
+
+    def __repr__(self):
+        return f"LimitOrderBook({self[:]})"
@@ -0,0 +1,206 @@
+import json, os, sys, threading, time
+from collections import Counter
+from contextlib import nullcontext
+
+# frames of these files mean the thread is blocked on a JSON-RPC / HTTP round trip
+RPC_FILES = ('rpc_provider.py', os.sep + 'requests' + os.sep, os.sep + 'urllib3' + os.sep, 'http' + os.sep + 'client.py', 'socket.py', 'ssl.py')
+# innermost functions of a thread waiting on another one (order pool future, lock, timer)
+WAIT_FUNCTIONS = ('wait', 'acquire', 'result', 'sleep', 'join', 'get')
+NO_PROFILE = nullcontext()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0].replace(' ', '_')  # '<frozen importlib._bootstrap>'
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _classify(frame) -> str:
+    leaf = frame
+    while frame is not None:
+        if any(part in frame.f_code.co_filename for part in RPC_FILES):
+            return 'rpc'
+        frame = frame.f_back
+    return 'wait' if leaf.f_code.co_name in WAIT_FUNCTIONS else 'compute'
+
+
+def _is_idle_worker(frame) -> bool:
+    # pool worker blocked on its work queue, the C call leaves _worker as the innermost frame
+    return frame.f_code.co_name == '_worker' and 'concurrent' in frame.f_code.co_filename
+
+
+class CycleProfiler():
+    def __init__(self, interval: float = 0.01, out_dir: str = 'profiles', max_samples: int = 200_000) -> None:
+        """
+        Statistical profiler of bot cycles, armed for the next N cycles by arm() (signal, env flag or /profile endpoint)
+        and off again once they are done. While a profiled cycle runs, a sampler thread reads the stacks of its
+        worker thread (and of the busy order pool threads) every interval seconds, splits the samples into
+        rpc / compute / wait, and each cycle ends in a folded stacks file (flamegraph.pl, speedscope)
+        plus a json summary in out_dir. Nothing runs while it is not armed.
+        """
+        self.interval = interval
+        self.out_dir = out_dir
+        self.max_samples = max_samples
+        self.remaining = 0  # cycles still to profile
+        self.bots = None    # bot ids to profile, None for any
+        self.written = []   # files of the finished profiles
+        self._threads = {}  # thread id -> session of the cycle step it runs
+        self._sessions = []
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def arm(self, cycles: int = 3, bots: list = None, interval: float = None) -> str:
+        with self._lock:
+            self.remaining = max(0, int(cycles))
+            self.bots = set(bots) if bots else None
+            if interval:
+                self.interval = float(interval)
+        message = f"Profiling the next {self.remaining} cycles{' of ' + ', '.join(sorted(self.bots)) if self.bots else ''} every {self.interval * 1000:g}ms to {self.out_dir}"
+        print(message)
+        return message
+
+    def status(self) -> dict:
+        return {'remaining': self.remaining, 'running': len(self._sessions), 'interval': self.interval, 'written': self.written[-10:]}
+
+    # === cycle hooks, called by BotRuntime ===
+    def begin(self, bot_id: str) -> dict | None:
+        """
+        Session of a starting cycle when the profiler is armed for it, else None
+        """
+        if self.remaining <= 0:
+            return None
+        with self._lock:
+            if self.remaining <= 0 or (self.bots is not None and bot_id not in self.bots):
+                return None
+            self.remaining -= 1
+            session = {'bot': bot_id, 'start': time.time(), 'cpu': 0., 'steps': 0, 'samples': 0,
+                       'stacks': Counter(), 'split': Counter(), 'leaves': Counter()}
+            self._sessions.append(session)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._sampler.start()
+        return session
+
+    def step(self, session: dict | None):
+        """
+        Context of one step of a profiled cycle on the current thread, a no-op for None
+        """
+        if session is None:
+            return NO_PROFILE
+        return _Step(self, session)
+
+    def end(self, session: dict | None, busy: float = None, rpc: dict = None) -> str | None:
+        """
+        Close a profiled cycle: write its folded stacks and summary, print the breakdown, returns the file path
+        """
+        if session is None:
+            return None
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+        wall = time.time() - session['start']
+        samples = max(1, session['samples'])
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{session['bot']}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(session['start']))}-{len(self.written) + 1}")
+        with open(path + '.folded', 'w') as file:
+            file.write(''.join(f"{stack} {count}\n" for stack, count in session['stacks'].most_common()))
+        summary = {
+            'bot': session['bot'], 'start': session['start'], 'wall': wall, 'busy': busy, 'cpu': session['cpu'],
+            'steps': session['steps'], 'samples': session['samples'], 'interval': self.interval,
+            'split': {k: v / samples for k, v in session['split'].items()},
+            'rpc_calls': sum((rpc or {}).values()),
+            'top_compute': [{'frame': k, 'share': v / samples} for k, v in session['leaves'].most_common(15)],
+        }
+        with open(path + '.json', 'w') as file:
+            json.dump(summary, file, indent=2)
+        self.written.append(path + '.folded')
+        split = ', '.join(f"{k} {v:.0%}" for k, v in sorted(summary['split'].items(), key=lambda kv: -kv[1]))
+        print(f"Profile of bot {session['bot']} cycle: wall {wall:.2f}s, busy {busy or 0:.2f}s, cpu {session['cpu']:.2f}s, "
+              f"{session['samples']} samples: {split}, {summary['rpc_calls']} rpc -> {path}.folded")
+        if self.remaining <= 0 and not self._sessions:
+            print("Profiling done, profiler off")
+        return path + '.folded'
+
+    # === sampler ===
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._sessions and self.remaining <= 0:
+                    self._sampler = None
+                    return
+                threads = dict(self._threads)
+                sessions = list(self._sessions)
+            if sessions:
+                self._sample(threads, sessions)
+            time.sleep(self.interval)
+
+    def _sample(self, threads: dict, sessions: list) -> None:
+        frames = sys._current_frames()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in frames.items():
+            session = threads.get(ident)
+            if session is not None:
+                self._add(session, frame, session['bot'])
+            elif names.get(ident, '').startswith('order') and not _is_idle_worker(frame):
+                # the order pool is shared, its busy samples go to every profiled cycle
+                for s in sessions:
+                    self._add(s, frame, s['bot'] + ';order-pool')
+
+    def _add(self, session: dict, frame, root: str) -> None:
+        if session['samples'] >= self.max_samples:
+            return
+        kind = _classify(frame)
+        stack = []
+        leaf = frame
+        while frame is not None:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        session['stacks'][root + ';' + ';'.join(reversed(stack)) + ';[' + kind + ']'] += 1
+        session['split'][kind] += 1
+        if kind == 'compute':
+            session['leaves'][_frame_name(leaf)] += 1
+        session['samples'] += 1
+
+
+class _Step():
+    def __init__(self, profiler: CycleProfiler, session: dict) -> None:
+        self.profiler = profiler
+        self.session = session
+
+    def __enter__(self):
+        self.ident = threading.get_ident()
+        self.cpu = time.thread_time()
+        with self.profiler._lock:
+            self.profiler._threads[self.ident] = self.session
+        return self.session
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        with self.profiler._lock:
+            self.profiler._threads.pop(self.ident, None)
+        self.session['cpu'] += time.thread_time() - self.cpu
+        self.session['steps'] += 1
+        return False
+
+
+PROFILER = CycleProfiler()  # one per process, idle until armed
+
+
+def configure_profiler(out_dir: str = None, interval: float = None, cycles: int = None, signal_name: str = 'SIGUSR2') -> CycleProfiler:
+    """
+    Set the output folder and sampling interval, arm the profiler on signal_name (kill -USR2 <pid>)
+    for cycles cycles, and right away when the PROFILE_CYCLES environment variable is set.
+    Call it from the main thread (signal handlers can only be installed there).
+    """
+    import signal
+    PROFILER.out_dir = out_dir or os.getenv('PROFILE_DIR', PROFILER.out_dir)
+    PROFILER.interval = float(interval or os.getenv('PROFILE_INTERVAL', PROFILER.interval))
+    cycles = int(cycles or os.getenv('PROFILE_SIGNAL_CYCLES', 3))
+    if signal_name and hasattr(signal, signal_name):
+        try:
+            # armed from a thread, a handler printing while the main thread prints would fail
+            signal.signal(getattr(signal, signal_name), lambda signum, frame: threading.Thread(target=PROFILER.arm, args=(cycles,)).start())
+        except ValueError as e:  # not the main thread
+            print(f"Profiler signal not installed: {e}")
+    if os.getenv('PROFILE_CYCLES'):
+        PROFILER.arm(int(os.getenv('PROFILE_CYCLES')))
+    return PROFILER
@@ -0,0 +1,154 @@
+import heapq, itertools
+
+
+class ProtectionEngine():
+    def __init__(self) -> None:
+        """
+        Take-profit, stop-loss and trailing-stop levels of open trades, indexed by price.
+        Per pair, levels that trigger on a rise sit in a min-heap and levels that trigger on a fall in a max-heap,
+        so a price update pops only the breached levels.
+        Trailing stops (long only) also sit in a min-heap of their peak: a new high ratchets
+        only the stops whose peak it exceeds.
+        """
+        self._upper = {}    # symbol -> heap of (level, seq, trade id, kind), trigger when price >= level
+        self._lower = {}    # symbol -> heap of (-level, seq, trade id, kind), trigger when price <= level
+        self._peaks = {}    # symbol -> heap of (peak, seq, trade id) of trailing stops
+        self._pending = {}  # symbol -> trade ids of trailing stops waiting for their first price
+        self._pairs = {}    # symbol -> pair to quote
+        self._live = {}     # trade id -> protection state
+        self._seq = itertools.count()
+
+    @staticmethod
+    def symbol(pair: list) -> str:
+        return ''.join(pair[::-1])
+
+    def attach(self, trade, tp_price: float = None, sl_price: float = None, trail_pct: float = None, price: float = None) -> bool:
+        """
+        Protect an open trade, returns False when no level is given
+        trail_pct: trailing distance as a fraction, e.g. 0.05 = stop 5% under the highest price since attach
+        price: current price, start of the trailing peak (default: first price update)
+        """
+        if tp_price is None and sl_price is None and trail_pct is None:
+            return False
+        long = getattr(trade, 'direction', 'long') == 'long'
+        if trail_pct is not None and not long:
+            raise ValueError("Trailing stop is only supported for long trades")
+        pair = trade.open_order.pair
+        symbol = self.symbol(pair)
+        self.detach(trade)
+        state = {
+            'trade': trade,
+            'symbol': symbol,
+            'long': long,
+            'trail_pct': trail_pct,
+            'peak': getattr(trade, 'trail_peak', None) or price,
+            'version': next(self._seq),
+        }
+        self._live[trade.id] = state
+        self._pairs[symbol] = list(pair)
+        v = state['version']
+        # long: tp on rise, sl on fall - short: the other way around
+        if tp_price is not None:
+            self._push(symbol, tp_price, v, trade.id, 'tp', rise=long)
+        if sl_price is not None:
+            self._push(symbol, sl_price, v, trade.id, 'sl', rise=not long)
+        if trail_pct is not None and state['peak'] is not None:
+            self._push_trailing(state)
+        elif trail_pct is not None:
+            self._pending.setdefault(symbol, []).append(trade.id)
+        return True
+
+    def detach(self, trade) -> None:
+        self._live.pop(trade.id, None)
+
+    def _push(self, symbol: str, level: float, version: int, trade_id: str, kind: str, rise: bool) -> None:
+        if rise:
+            heapq.heappush(self._upper.setdefault(symbol, []), (float(level), version, trade_id, kind))
+        else:
+            heapq.heappush(self._lower.setdefault(symbol, []), (-float(level), version, trade_id, kind))
+
+    def _push_trailing(self, state: dict) -> None:
+        trade = state['trade']
+        state['trail_version'] = next(self._seq)
+        trade.trail_peak = state['peak']
+        trade.trail_stop = state['peak'] * (1 - state['trail_pct'])
+        self._push(state['symbol'], trade.trail_stop, state['trail_version'], trade.id, 'trailing', rise=False)
+        heapq.heappush(self._peaks.setdefault(state['symbol'], []), (state['peak'], state['trail_version'], trade.id))
+
+    def _valid(self, entry, trailing: bool = False) -> bool:
+        state = self._live.get(entry[2])
+        if state is None:
+            return False
+        if trailing or (len(entry) == 4 and entry[3] == 'trailing'):
+            return state.get('trail_version') == entry[1]
+        return state['version'] == entry[1]
+
+    def pairs(self) -> list:
+        """
+        Pairs with at least one protected trade, quote each once per price update
+        """
+        live = {state['symbol'] for state in self._live.values()}
+        for symbol in [s for s in self._pairs if s not in live]:
+            self._pairs.pop(symbol)
+            self._upper.pop(symbol, None)
+            self._lower.pop(symbol, None)
+            self._peaks.pop(symbol, None)
+            self._pending.pop(symbol, None)
+        return list(self._pairs.values())
+
+    def update(self, pair: list, price: float) -> list:
+        """
+        Apply a new price of pair, returns [(trade, close OrderPlan)] of the breached levels.
+        Triggered trades are detached.
+        """
+        symbol = self.symbol(pair)
+        self._ratchet(symbol, price)
+        triggered = {}
+        upper = self._upper.get(symbol, [])
+        while upper and (upper[0][0] <= price or not self._valid(upper[0])):
+            entry = heapq.heappop(upper)
+            if self._valid(entry):
+                triggered.setdefault(entry[2], entry[3])
+        lower = self._lower.get(symbol, [])
+        while lower and (-lower[0][0] >= price or not self._valid(lower[0])):
+            entry = heapq.heappop(lower)
+            if self._valid(entry):
+                triggered.setdefault(entry[2], entry[3])
+
+        from lib.trading import OrderPlan  # lib.trading imports this module
+
+        result = []
+        for trade_id, kind in triggered.items():
+            state = self._live.pop(trade_id)
+            trade = state['trade']
+            order_plan = OrderPlan(
+                action='close',
+                side='sell' if state['long'] else 'buy',
+                pair=list(pair),
+                order_type='market',
+                trade_id=trade_id,
+                trigger=kind,
+                trigger_price=price,
+            )
+            result.append((trade, order_plan))
+        return result
+
+    def _ratchet(self, symbol: str, price: float) -> None:
+        # start pending trailing stops, then raise the stops whose peak is below the new price
+        for trade_id in self._pending.pop(symbol, []):
+            state = self._live.get(trade_id)
+            if state is not None and state['peak'] is None:
+                state['peak'] = price
+                self._push_trailing(state)
+        peaks = self._peaks.get(symbol, [])
+        raised = []
+        while peaks and (peaks[0][0] < price or not self._valid(peaks[0], trailing=True)):
+            entry = heapq.heappop(peaks)
+            if self._valid(entry, trailing=True):
+                raised.append(self._live[entry[2]])
+        for state in raised:
+            state['peak'] = price
+            self._push_trailing(state)
+
+    def __len__(self) -> int:
+        return len(self._live)
@@ -0,0 +1,126 @@
+import threading, time
+from sqlalchemy import select
+from db.connection import get_engine
+from db.models.rollup import Rollup
+from db.writer import get_writer
+
+RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+ALL = '*'  # pair of the rows aggregating the whole bot
+
+
+class EquityTracker():
+    def __init__(self, bot_id: str, resolutions: tuple = ('minute', 'hour', 'day')) -> None:
+        """
+        Incremental PnL and equity rollups of one bot, per pair and for the whole bot (pair '*').
+        Only the current bucket of each (pair, resolution) is kept in memory: a closed trade or an
+        equity mark updates it in place and queues it in the write-behind writer, a new bucket starts
+        from the close / peak of the previous one. Nothing is ever recomputed from the trade history.
+        resolutions: subset of RESOLUTIONS
+        """
+        self.bot_id = bot_id
+        self.resolutions = {r: RESOLUTIONS[r] for r in resolutions}
+        self._rows = {}  # (pair, resolution) -> current bucket row
+        self._lock = threading.Lock()
+
+    def _load_last(self, pair: str, resolution: str) -> dict | None:
+        # latest bucket written by a previous run, carries the cumulative PnL and the peak over a restart
+        r = Rollup.__table__
+        try:
+            with get_engine().connect() as conn:
+                row = conn.execute(
+                    select(r).where(r.c.bot_id == self.bot_id, r.c.pair == pair, r.c.resolution == resolution)
+                    .order_by(r.c.time.desc()).limit(1)
+                ).first()
+            return dict(row._mapping) if row is not None else None
+        except Exception as e:
+            print(f"Could not load rollup {self.bot_id} {pair} {resolution}: {e}")
+            return None
+
+    def _bucket(self, pair: str, resolution: str, now: float) -> dict:
+        start = int(now) - int(now) % self.resolutions[resolution]
+        key = (pair, resolution)
+        row = self._rows.get(key)
+        if row is None:
+            row = self._load_last(pair, resolution)
+            if row is not None:
+                for k in ('trades', 'wins', 'realized', 'cum_realized'):
+                    row[k] = row[k] or 0
+        if row is None or row['time'] < start:
+            last = row or {}
+            close = last.get('equity_close')
+            peak = last.get('peak')
+            row = {
+                'id': f"{self.bot_id}:{pair}:{resolution}:{start}",
+                'bot_id': self.bot_id,
+                'pair': pair,
+                'resolution': resolution,
+                'time': start,
+                'trades': 0,
+                'wins': 0,
+                'realized': 0.,
+                'cum_realized': last.get('cum_realized') or 0.,
+                'equity_open': close,
+                'equity_high': close,
+                'equity_low': close,
+                'equity_close': close,
+                'peak': peak,
+                'max_drawdown': 1 - close / peak if close is not None and peak else 0.,
+            }
+        self._rows[key] = row
+        return row
+
+    def _put(self, row: dict, now: float) -> None:
+        row['updated'] = int(now)
+        get_writer().put(Rollup, dict(row))
+
+    def record_trade(self, pair: str, profit: float, now: float = None) -> None:
+        """
+        Add the realized profit of a closed trade to the buckets of its pair and of the bot
+        """
+        now = now or time.time()
+        profit = float(profit or 0)
+        with self._lock:
+            for p in (pair, ALL):
+                for resolution in self.resolutions:
+                    row = self._bucket(p, resolution, now)
+                    row['trades'] += 1
+                    row['wins'] += 1 if profit > 0 else 0
+                    row['realized'] += profit
+                    row['cum_realized'] += profit
+                    self._put(row, now)
+
+    def mark(self, pair: str, equity: float, now: float = None) -> None:
+        """
+        Mark the equity of a pair (or of the bot with pair '*') to market
+        """
+        if equity is None:
+            return
+        now = now or time.time()
+        equity = float(equity)
+        with self._lock:
+            for resolution in self.resolutions:
+                row = self._bucket(pair, resolution, now)
+                if row['equity_open'] is None:
+                    row['equity_open'] = row['equity_high'] = row['equity_low'] = equity
+                row['equity_high'] = max(row['equity_high'], equity)
+                row['equity_low'] = min(row['equity_low'], equity)
+                row['equity_close'] = equity
+                row['peak'] = equity if row['peak'] is None else max(row['peak'], equity)
+                if row['peak'] > 0:
+                    row['max_drawdown'] = max(row['max_drawdown'] or 0., 1 - equity / row['peak'])
+                self._put(row, now)
+
+    def cum_realized(self, pair: str = ALL) -> float:
+        """
+        Profit of every trade of pair closed so far
+        """
+        with self._lock:
+            resolution = next(iter(self.resolutions))
+            return self._bucket(pair, resolution, time.time())['cum_realized']
+
+    def current(self, pair: str = ALL, resolution: str = 'minute') -> dict:
+        """
+        Current bucket, including what the writer has not flushed yet
+        """
+        with self._lock:
+            return dict(self._bucket(pair, resolution, time.time()))
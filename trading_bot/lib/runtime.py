@@ -0,0 +1,370 @@
+import inspect, time, threading, traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable
+from db.connection import remove_session
+from lib.metrics import METRICS
+from lib.tracing import TRACER
+from lib.profiler import PROFILER
+
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def interval_seconds(interval) -> int | None:
+    """
+    Length of a candle interval like '30s', '5m', '1h', '1d' in seconds, None when unknown
+    """
+    if interval is None:
+        return None
+    if isinstance(interval, (int, float)):
+        return int(interval)
+    interval = str(interval).strip().lower()
+    try:
+        return int(interval[:-1] or 1) * INTERVAL_UNITS[interval[-1]]
+    except (KeyError, ValueError):
+        return None
+
+
+def load_bot_definitions(path: str) -> dict:
+    """
+    Load the fleet config (list of bot/vault definitions), see configs/bots.yaml.example
+    """
+    import yaml
+    with open(path, 'r') as file:
+        config = yaml.safe_load(file) or {}
+    bots = config.get('bots') or []
+    ids = [b.get('id') for b in bots]
+    if None in ids or len(ids) != len(set(ids)):
+        raise ValueError(f"Every bot definition needs a unique id, got {ids}")
+    return config
+
+
+class CandleCache():
+    def __init__(self, ttl: float = 30, session=None) -> None:
+        """
+        Shared cache for market data requests.
+        Bots trading the same pool in the same cycle get one HTTP request instead of one each.
+        """
+        import requests  # only needed once candles are fetched, kept off the startup path
+        from lib.cassette import CASSETTE
+        self.ttl = ttl
+        self.session = CASSETTE.mount(session or requests.Session())  # record / replay when loaded
+        self._data = {}     # key -> (fetched_at, payload)
+        self._locks = {}    # key -> lock, so concurrent misses on the same key fetch only once
+        self._lock = threading.Lock()
+
+    def get(self, url: str, key=None) -> dict:
+        """
+        Get the json payload of url, served from cache while younger than ttl
+        key: cache key, default url (use it when url carries a changing timestamp)
+        """
+        key = key or url
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            cached = self._data.get(key)
+            if cached and time.time() - cached[0] < self.ttl:
+                return cached[1]
+            response = self.session.get(url, timeout=15)
+            if response.status_code != 200:
+                raise Exception(f"Error {response.status_code}: {response.text}")
+            payload = response.json()
+            self._data[key] = (time.time(), payload)
+        self.evict()
+        return payload
+
+    def evict(self):
+        """
+        Drop expired entries to keep memory flat
+        """
+        now = time.time()
+        with self._lock:
+            for key in [k for k, v in self._data.items() if now - v[0] >= self.ttl]:
+                self._data.pop(key, None)
+
+
+class CycleStats():
+    def __init__(self, keep: int = 100) -> None:
+        """
+        Timing of the cycles of one bot: start drift (tick to first step), duration (first step to the end,
+        waits included), busy time (worker time actually used), waits and JSON-RPC requests per cycle,
+        the last keep cycles in memory plus totals since the start of the process
+        """
+        self.recent = deque(maxlen=keep)
+        self.cycles = 0
+        self.total_duration = 0.
+        self.total_busy = 0.
+        self.total_rpc = 0
+        self.max_drift = 0.
+        self.max_duration = 0.
+
+    def record(self, scheduled: float, started: float, ended: float, busy: float, waits: int, rpc: int = 0) -> dict:
+        cycle = {
+            'scheduled': scheduled,
+            'drift': started - scheduled,
+            'duration': ended - started,
+            'busy': busy,
+            'waits': waits,
+            'rpc': rpc,
+        }
+        self.recent.append(cycle)
+        self.cycles += 1
+        self.total_duration += cycle['duration']
+        self.total_busy += busy
+        self.total_rpc += rpc
+        self.max_drift = max(self.max_drift, cycle['drift'])
+        self.max_duration = max(self.max_duration, cycle['duration'])
+        return cycle
+
+    def summary(self) -> dict:
+        last = self.recent[-1] if self.recent else {}
+        return {
+            'cycles': self.cycles,
+            'last_drift': last.get('drift'),
+            'last_duration': last.get('duration'),
+            'avg_duration': self.total_duration / self.cycles if self.cycles else None,
+            'avg_busy': self.total_busy / self.cycles if self.cycles else None,
+            'avg_rpc': self.total_rpc / self.cycles if self.cycles else None,
+            'max_drift': self.max_drift,
+            'max_duration': self.max_duration,
+        }
+
+
+class BotRuntime():
+    def __init__(self, cycle: Callable, max_workers: int = 4, max_errors: int = 5) -> None:
+        """
+        Run many TradingBots in one process on a bounded worker pool.
+        cycle: function run for every bot each tick, called as cycle(bot, **kwargs). It may be a generator:
+            every yielded number is a wait in seconds, the cycle is resumed after it on a worker
+            (a continuation) instead of sleeping on one, and the bot stays in flight until the generator ends
+        max_workers: number of bot cycles running at the same time
+        max_errors: pause a bot after this many consecutive failed cycles (0 = never pause)
+        """
+        self.cycle = cycle
+        self.max_workers = max_workers
+        self.max_errors = max_errors
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bot')
+        self.bots = {}  # bot id -> slot
+        self._lock = threading.Lock()
+
+    def add_bot(self, bot, **kwargs) -> None:
+        if bot.id in self.bots:
+            raise ValueError(f"Bot {bot.id} already registered")
+        self.bots[bot.id] = {
+            'bot': bot,
+            'kwargs': kwargs,
+            'future': None,     # Future of the running step
+            'running': None,    # current cycle: scheduled / started time, busy seconds, waits, generator, timer
+            'pending': None,    # tick time of the follow-up cycle queued while one was in flight
+            'errors': 0,        # consecutive failed cycles
+            'skipped': 0,       # ticks that found the previous cycle still in flight
+            'merged': 0,        # of those, ticks folded into an already queued follow-up (never ran on their own)
+            'paused': False,
+            'stats': CycleStats(),
+        }
+
+    def remove_bot(self, bot_id: str) -> None:
+        self.bots.pop(bot_id, None)
+
+    def run_cycle(self, now: float = None) -> list[Future]:
+        """
+        Start one cycle for every active bot, a bot never has two cycles in flight:
+        a tick arriving during a cycle queues one follow-up started as soon as it ends, later ticks merge into it
+        """
+        now = now or time.time()
+        futures = []
+        for bot_id, slot in list(self.bots.items()):
+            if slot['paused']:
+                continue
+            # bar-aware bots: no cycle (no vault, RPC or candle call) until their next candle can be final
+            bar_due = getattr(slot['bot'], 'bar_due', None)
+            if bar_due is not None and not bar_due():
+                continue
+            future = self._tick(bot_id, slot, now)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def run_now(self, bot_id: str, now: float = None) -> Future | None:
+        """
+        Start a cycle of bot_id right away, outside of its bar schedule (e.g. when its vault reaches its stop time)
+        """
+        slot = self.bots.get(bot_id)
+        if slot is None or slot['paused']:
+            return None
+        return self._tick(bot_id, slot, now or time.time())
+
+    def _tick(self, bot_id: str, slot: dict, now: float) -> Future | None:
+        with self._lock:
+            if slot['running'] is not None:
+                slot['skipped'] += 1
+                if slot['pending'] is None:
+                    slot['pending'] = now
+                    print(f"Bot {bot_id} is still running its previous cycle, next one queued ({slot['skipped']} late ticks)")
+                else:
+                    slot['merged'] += 1
+                    print(f"Bot {bot_id} is still running its previous cycle, tick merged ({slot['merged']} merged)")
+                return None
+            return self._start(bot_id, slot, now)
+
+    def _start(self, bot_id: str, slot: dict, scheduled: float) -> Future:
+        # called with self._lock held
+        slot['running'] = {'scheduled': scheduled, 'started': None, 'busy': 0., 'waits': 0, 'rpc': {}, 'steps': None, 'timer': None,
+                           'span': TRACER.span('bot.cycle', bot=bot_id),  # root of the step spans, ended by _finish
+                           'profile': PROFILER.begin(bot_id)}  # None unless the profiler is armed
+        slot['future'] = self.executor.submit(self._run_bot, bot_id)
+        return slot['future']
+
+    def _run_bot(self, bot_id: str) -> bool:
+        slot = self.bots.get(bot_id)
+        if slot is None or slot['running'] is None:
+            return False
+        running = slot['running']
+        t = time.time()
+        if running['started'] is None:
+            running['started'] = t
+        try:
+            # rpc requests made by this step (order threads not included)
+            with METRICS.tally() as rpc, TRACER.span('bot.cycle.step', parent=running['span'], bot=bot_id, step=running['waits']), \
+                    PROFILER.step(running['profile']):
+                try:
+                    if running['steps'] is None:
+                        result = self.cycle(slot['bot'], **slot['kwargs'])
+                        running['steps'] = result if inspect.isgenerator(result) else iter(())
+                    wait = next(running['steps'], None)
+                finally:
+                    for name, calls in rpc.items():
+                        running['rpc'][name] = running['rpc'].get(name, 0) + calls
+            running['busy'] += time.time() - t
+            if wait is not None:
+                # continuation: the worker is free during the wait, the bot stays in flight
+                running['waits'] += 1
+                running['timer'] = threading.Timer(float(wait), self._resume, args=(bot_id,))
+                running['timer'].daemon = True
+                running['timer'].start()
+                return True
+            slot['errors'] = 0
+            self._finish(bot_id, slot)
+            return True
+        except BaseException as e:  # cycle functions may sys.exit() on error, keep the other bots alive
+            running['busy'] += time.time() - t
+            slot['errors'] += 1
+            print(f"Bot {bot_id} cycle failed ({slot['errors']} in a row): {e!r}")
+            traceback.print_exc()
+            if self.max_errors and slot['errors'] >= self.max_errors:
+                slot['paused'] = True
+                print(f"Bot {bot_id} paused after {slot['errors']} consecutive errors")
+            self._finish(bot_id, slot)
+            return False
+        finally:
+            # each step starts with a fresh session, the worker thread keeps no stale identity map or connection
+            remove_session()
+
+    def _resume(self, bot_id: str) -> None:
+        slot = self.bots.get(bot_id)
+        # under the lock: shutdown either drops the cycle before the step is submitted or sees it submitted
+        with self._lock:
+            if slot is None or slot['running'] is None:
+                return
+            try:
+                slot['future'] = self.executor.submit(self._run_bot, bot_id)
+                return
+            except RuntimeError:  # executor shut down during the wait
+                pass
+        self._finish(bot_id, slot)
+
+    def _finish(self, bot_id: str, slot: dict) -> None:
+        running = slot['running']
+        cycle = slot['stats'].record(running['scheduled'], running['started'] or time.time(), time.time(), running['busy'],
+                                     running['waits'], sum(running['rpc'].values()))
+        running['span'].set(rpc=cycle['rpc'], waits=cycle['waits'], busy=cycle['busy'], drift=cycle['drift']).end()
+        try:
+            PROFILER.end(running['profile'], busy=cycle['busy'], rpc=running['rpc'])
+        except Exception as e:
+            print(f"Could not write the profile of bot {bot_id}: {e}")
+        top = sorted(running['rpc'].items(), key=lambda kv: kv[1], reverse=True)[:3]
+        print(f"Bot {bot_id} cycle took {cycle['duration']:.2f}s (busy {cycle['busy']:.2f}s, {cycle['waits']} waits, "
+              f"{cycle['rpc']} rpc{': ' + ', '.join(f'{n} x{c}' for n, c in top) if top else ''}), "
+              f"started {cycle['drift']:.2f}s after its tick")
+        critical_path = getattr(slot['bot'], 'critical_path', None)
+        summary = critical_path.summary() if critical_path is not None else None
+        if summary:
+            print(f"Bot {bot_id} critical path: {summary}")
+        with self._lock:
+            slot['running'] = None
+            pending, slot['pending'] = slot['pending'], None
+            if pending is not None and not slot['paused'] and bot_id in self.bots:
+                try:
+                    self._start(bot_id, slot, pending)
+                except RuntimeError:  # executor shut down
+                    slot['running'] = None
+
+    def resume(self, bot_id: str) -> None:
+        slot = self.bots[bot_id]
+        slot['paused'] = False
+        slot['errors'] = 0
+
+    def status(self) -> dict:
+        return {
+            bot_id: {
+                'running': slot['running'] is not None,
+                'waiting': slot['running'] is not None and slot['running']['timer'] is not None and slot['running']['timer'].is_alive(),
+                'errors': slot['errors'],
+                'skipped': slot['skipped'],
+                'merged': slot['merged'],
+                'paused': slot['paused'],
+                **slot['stats'].summary(),
+            }
+            for bot_id, slot in self.bots.items()
+        }
+
+    def report(self) -> None:
+        """
+        Print the cycle timing of every bot
+        """
+        for bot_id, s in self.status().items():
+            if not s['cycles']:
+                print(f"Bot {bot_id}: no cycle yet, {s['skipped']} late ticks")
+                continue
+            print(f"Bot {bot_id}: {s['cycles']} cycles, avg {s['avg_duration']:.2f}s (busy {s['avg_busy']:.2f}s, {s['avg_rpc']:.1f} rpc), "
+                  f"max {s['max_duration']:.2f}s, max drift {s['max_drift']:.2f}s, {s['skipped']} late ticks, {s['merged']} merged")
+
+    def collect(self) -> list[str]:
+        """
+        Cycle gauges of every bot in Prometheus text format, for METRICS.add_collector
+        """
+        lines = []
+        gauges = (('cycles', 'bot_cycles_total', 'counter'), ('last_duration', 'bot_cycle_duration_seconds', 'gauge'),
+                  ('last_drift', 'bot_cycle_drift_seconds', 'gauge'), ('avg_rpc', 'bot_cycle_rpc_requests', 'gauge'),
+                  ('skipped', 'bot_late_ticks_total', 'counter'), ('errors', 'bot_cycle_errors', 'gauge'))
+        status = self.status()
+        for key, name, kind in gauges:
+            lines.append(f"# TYPE {name} {kind}")
+            lines += [f'{name}{{bot="{bot_id}"}} {s[key]}' for bot_id, s in status.items() if s[key] is not None]
+        return lines
+
+    def shutdown(self, wait: bool = True) -> None:
+        # cycles waiting on a continuation are dropped: generators closed, their span and profile ended
+        dropped = []
+        with self._lock:
+            for bot_id, slot in list(self.bots.items()):
+                running = slot['running']
+                if running is None or running['timer'] is None or not running['timer'].is_alive():
+                    continue
+                running['timer'].cancel()
+                try:
+                    if running['steps'] is not None:
+                        running['steps'].close()
+                except ValueError:  # generator already executing: resumed on a worker, it ends with the executor
+                    continue
+                slot['running'] = slot['pending'] = None
+                dropped.append((bot_id, running))
+        for bot_id, running in dropped:
+            running['span'].set(dropped=True, waits=running['waits'], busy=running['busy']).end()
+            try:
+                PROFILER.end(running['profile'], busy=running['busy'], rpc=running['rpc'])
+            except Exception as e:
+                print(f"Could not write the profile of bot {bot_id}: {e}")
+            print(f"Bot {bot_id} cycle dropped at shutdown after {running['waits']} waits")
+        self.executor.shutdown(wait=wait, cancel_futures=True)
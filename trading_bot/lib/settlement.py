@@ -0,0 +1,212 @@
+import time
+from lib.trading import OrderPlan
+
+STAGES = ('new', 'close', 'swap', 'withdraw', 'done')
+
+
+class VaultSettlement():
+    def __init__(self, bot, trade_token: str, currency: str, block_time: float = 2., max_impact: float = 0.01,
+                 retries: int = 3, retry_after: float = 300) -> None:
+        """
+        End of vault settlement of a bot: close its open trades, swap the remaining trade token back
+        to the currency, withdraw the vault. Each step starts once the previous one is confirmed on chain
+        (order receipts, a balance rescan, the withdraw receipt), never after a fixed delay, and the vault
+        is never withdrawn while a swap of the bot is still pending.
+        Progress is kept in bot.settlement and saved with the bot snapshot at every stage, so a restarted
+        process resumes where it stopped: a running swap is resumed, a sent withdraw is followed, not sent again.
+        block_time: seconds between two looks at the chain while waiting
+        max_impact: price impact cap of the residual swap slices
+        retries: failed swaps / withdraws in one run before giving up until the next cycle
+        retry_after: seconds before a given up settlement is tried again outside the bar schedule,
+            doubled at every run given up in a row (up to an hour), kept in bot.settlement['retry_at']
+        """
+        self.bot = bot
+        self.broker = bot._broker
+        self.trade_token = trade_token
+        self.currency = currency
+        self.pair = [currency, trade_token]
+        self.symbol = trade_token + currency
+        self.block_time = block_time
+        self.max_impact = max_impact
+        self.retries = retries
+        self.retry_after = retry_after
+        self.failures = 0
+        if not bot.settlement:
+            bot.settlement.update({'stage': 'new', 'started': time.time()})
+        self.state = bot.settlement
+
+    def run(self):
+        """
+        Drive the settlement to its end, a generator yielding the seconds to wait (see BotRuntime)
+        Returns True once the vault is withdrawn
+        """
+        started = time.time()
+        print(f"=== Vault settlement of {self.bot.id}, stage {self.state['stage']} ===")
+        while True:
+            try:
+                with self.bot.lock:
+                    wait = self.step()
+            except Exception as e:
+                # a failed chain read or order update costs one retry, it does not end the runtime job
+                self.failures += 1
+                print(f"Vault settlement step of {self.bot.id} failed ({self.failures}/{self.retries}): {e}")
+                wait = None if self.failures >= self.retries else self.block_time
+            if wait is None:
+                print(f"Vault settlement of {self.bot.id}: {self.state['stage']} after {time.time() - started:.1f}s")
+                if self.state['stage'] != 'done':
+                    self._give_up()
+                return self.state['stage'] == 'done'
+            yield wait
+
+    def step(self) -> float | None:
+        """
+        Look at the chain once and move the settlement as far as it can go
+        Returns the seconds to wait before the next step, None when over (done, or given up until the next cycle)
+        """
+        state = self.state
+        if state['stage'] == 'done':
+            return None
+        if state.get('withdraw_tx'):
+            return self._follow_withdraw()
+
+        vault = self.broker.get_vault_state(self.bot).get()
+        if vault['vault_closed']:
+            print("Vault is closed, nothing to withdraw")
+            self._set('done')
+            return None
+
+        # 1. close the open trades and wait for every order of the pair
+        if self.bot.open_trades.get(self.symbol):
+            print(f"Closing {len(self.bot.open_trades[self.symbol])} open {self.symbol} trades")
+            self.bot.sell(pair=self.pair, price=0)  # market close of every open trade
+            self._set('close')
+            return self.block_time
+        if self._orders_pending():
+            self.bot.checking_orders()
+            if self._orders_pending():
+                return self.block_time
+
+        # 2. swap the remaining trade token back to the currency, once the closes are mined
+        swap = state.get('swap')
+        if swap is not None and not swap.schedule.get('done') and any(c.status == 'Rejected' for c in swap.children):
+            # a slice reverted (balance or pool moved): stop this swap, it is retried on a fresh rescan
+            print(f"Slice of the {self.trade_token} swap reverted, cancelling it")
+            self.broker.scheduler.cancel(swap)
+        if swap is not None and not swap.is_filled():
+            print(f"Swap of the remaining {self.trade_token} executing: {getattr(swap, 'filled_qty', 0)}/{getattr(swap, 'target_qty', '?')}")
+            return self.block_time
+        if swap is not None and swap.status != 'Filled':
+            self.failures += 1
+            print(f"Swap of the remaining {self.trade_token} ended {swap.status} ({self.failures}/{self.retries})")
+            state['swap'] = None
+            self._set('close')  # swap again
+            if self.failures >= self.retries:
+                return None
+            return self.block_time
+        if state['stage'] in ('new', 'close'):
+            order = self._swap_remaining()
+            if order is False:
+                self.failures += 1
+                return None if self.failures >= self.retries else self.block_time
+            state['swap'] = order
+            self._set('swap')
+            return self.block_time if order is not None else 0
+        if self.broker.scheduler.active(self.bot):
+            return self.block_time
+
+        # 3. withdraw, nothing of the bot is pending any more
+        return self._withdraw()
+
+    def _orders_pending(self) -> bool:
+        # swaps sent or about to be (netting queue), resting limit orders are not on chain
+        process = self.bot.process_trades
+        trades = list(process['opening']) + list(process['closing'])
+        trades += [t for t, _ in self.bot._submit_queue]
+        return any(t.open_order is not None and t.open_order.symbol == self.symbol for t in trades)
+
+    def _swap_remaining(self):
+        """
+        Swap the trade token left in the vault (confirmed by a balance rescan) to the currency in slices
+        Returns the sliced order, None if there is nothing to swap, False on error
+        """
+        try:
+            # the gas price of the slices and the withdraw is fetched while the balances are rescanned
+            gas_price = self.broker.executor.submit(self.broker.get_gas_price)
+            self.broker.check_balance(self.bot, re_check=True)
+            gas_price.result()
+            qty = self.bot._token_balance.get(self.trade_token, {}).get('qty', 0)
+            qty = self.broker.from_wei(self.trade_token, qty) if qty > 0 else 0
+            print(f"Vault {self.trade_token} balance: {qty}")
+            if qty <= 0:
+                return None
+            order = self.broker.scheduler.submit(
+                OrderPlan(
+                    action='close',
+                    side='sell',
+                    pair=self.pair,
+                    qty=qty * 0.99,  # leave a small amount for gas
+                    max_impact=self.max_impact,
+                    slippage=0.02,
+                ),
+                self.bot,
+                mode='iceberg',
+            )
+            print(f"Swap order: {order}")
+            return order
+        except Exception as e:
+            print(f"Error swapping remaining tokens: {e}")
+            return False
+
+    def _withdraw(self) -> float | None:
+        try:
+            txn = self.bot.vault.functions.withdraw().build_transaction({
+                'from': self.bot.wallet['address'],
+                'nonce': 0,  # allocated by the broker nonce manager
+                'gas': 200_000,  # should scale by number of shareholders
+                'gasPrice': self.broker.get_gas_price(),
+            })
+            tx_hash = self.broker.send_transaction(self.bot, txn)
+        except Exception as e:
+            self.failures += 1
+            print(f"Error calling vault withdraw ({self.failures}/{self.retries}): {e}")
+            return None if self.failures >= self.retries else self.block_time
+        print(f"Vault withdraw transaction sent: {tx_hash}")
+        self.state['withdraw_tx'] = tx_hash
+        self.state['withdraw_sent'] = time.time()
+        self._set('withdraw')
+        return self.block_time
+
+    def _follow_withdraw(self) -> float | None:
+        receipt = self.broker.get_receipt(self.state['withdraw_tx'])
+        if receipt is None:
+            return self.block_time
+        self.broker.get_vault_state(self.bot).invalidate()
+        if receipt['status'] == 1:
+            print(f"Vault withdraw mined in block {receipt['blockNumber']}, "
+                  f"{time.time() - self.state['withdraw_sent']:.1f}s after it was sent")
+            self._set('done')
+            return None
+        self.failures += 1
+        print(f"Vault withdraw {self.state['withdraw_tx']} reverted ({self.failures}/{self.retries})")
+        self.state['withdraw_tx'] = None
+        self._set('swap')
+        return None if self.failures >= self.retries else self.block_time
+
+    def _give_up(self) -> None:
+        # bar_due does not run the settlement again before retry_at, the bar schedule still does
+        given_up = self.state.get('given_up', 0) + 1
+        wait = min(3600, self.retry_after * 2 ** (given_up - 1))
+        self.state['given_up'] = given_up
+        self.state['retry_at'] = time.time() + wait
+        print(f"Vault settlement of {self.bot.id} given up ({given_up} in a row), retried in {wait:g}s at the latest")
+        self.bot.save_state()
+
+    def _set(self, stage: str) -> None:
+        # every stage change goes to the snapshot, a restart resumes from it
+        self.state['stage'] = stage
+        if stage == 'done':
+            self.state.pop('given_up', None)
+            self.state.pop('retry_at', None)
+        self.state['updated'] = time.time()
+        self.bot.save_state()
+
@@ -0,0 +1,83 @@
+import threading, time
+from contextlib import contextmanager
+from functools import lru_cache
+
+_START = time.perf_counter()  # first import of this module, main.py imports it first
+
+
+class StartupProfile():
+    def __init__(self, start: float = None) -> None:
+        """
+        Timing breakdown of the startup phases.
+        mark(name) closes the phase running since the previous mark, phase(name) times a block
+        (also on other threads, e.g. the warm-up), report() prints everything.
+        start: perf_counter origin, default the import of this module
+        """
+        self.start = start or _START
+        self.phases = []  # (name, seconds, thread name)
+        self._last = self.start
+        self._lock = threading.Lock()
+
+    def mark(self, name: str) -> float:
+        now = time.perf_counter()
+        with self._lock:
+            elapsed, self._last = now - self._last, now
+            self.phases.append((name, elapsed, threading.current_thread().name))
+        return elapsed
+
+    @contextmanager
+    def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((name, time.perf_counter() - t, threading.current_thread().name))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def report(self, title: str = 'Startup') -> str:
+        with self._lock:
+            phases = list(self.phases)
+        width = max([len(name) for name, _, _ in phases] + [5])
+        lines = [f"{title} timing ({self.elapsed():.3f}s since start):"]
+        for name, seconds, thread in phases:
+            where = '' if thread == 'MainThread' else f"  [{thread}]"
+            lines.append(f"  {name:<{width}} {seconds * 1000:9.1f} ms{where}")
+        text = '\n'.join(lines)
+        print(text)
+        return text
+
+
+def warm_up(profile: StartupProfile, tasks: list, on_done=None) -> threading.Thread:
+    """
+    Run the slow startup tasks [(name, function), ...] in order on a background thread,
+    each timed in profile, a failing task is reported and the next one still runs
+    on_done: called at the end, e.g. to print profile.report()
+    """
+    def run():
+        for name, task in tasks:
+            try:
+                with profile.phase(name):
+                    task()
+            except Exception as e:
+                print(f"Warm-up task {name} failed: {e}")
+        if on_done is not None:
+            on_done()
+
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+@lru_cache()
+def load_yaml(path: str) -> dict:
+    """
+    Parse a YAML file once per process, with the C loader when PyYAML was built with libyaml
+    (several times faster on the large ABI lists of the chain config)
+    """
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path, 'r') as file:
+        return yaml.load(file, Loader=loader) or {}
@@ -0,0 +1,112 @@
+import os, threading
+from typing import Optional, Tuple
+import msgpack
+
+
+def _default(obj):
+    # numpy scalars and other non-msgpack values found on orders/plans
+    if hasattr(obj, 'item'):
+        return obj.item()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+def pack(data) -> bytes:
+    return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class StateStore():
+    def __init__(self, path: str, bot_id: str, snapshot_every: int = 500, fsync: bool = True) -> None:
+        """
+        Crash-safe bot state on disk: a msgpack snapshot plus an append-only journal of state transitions.
+        Restart = load the snapshot, replay the journal records written after it.
+        path: directory of the state files
+        snapshot_every: compact the journal into a new snapshot after this many records
+        fsync: fsync every journal record (survives power loss, costs ~1ms per record)
+        """
+        os.makedirs(path, exist_ok=True)
+        self.snap_path = os.path.join(path, f"{bot_id}.snap")
+        self.wal_path = os.path.join(path, f"{bot_id}.wal")
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.seq = 0    # sequence number of the last written record
+        self.records_since_snapshot = 0
+        self._wal = None
+        self._lock = threading.Lock()
+
+    def append(self, record: dict) -> int:
+        """
+        Append one state transition to the journal, returns its sequence number
+        """
+        with self._lock:
+            self.seq += 1
+            record['seq'] = self.seq
+            if self._wal is None:
+                self._wal = open(self.wal_path, 'ab')
+            self._wal.write(pack(record))
+            self._wal.flush()
+            if self.fsync:
+                os.fsync(self._wal.fileno())
+            self.records_since_snapshot += 1
+            return self.seq
+
+    def need_snapshot(self) -> bool:
+        return self.records_since_snapshot >= self.snapshot_every
+
+    def write_snapshot(self, state: dict) -> None:
+        """
+        Atomically replace the snapshot, then truncate the journal it covers
+        """
+        with self._lock:
+            state['seq'] = self.seq
+            tmp_path = self.snap_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(pack(state))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snap_path)
+            # a crash before this point is fine: records with seq <= snapshot seq are skipped on load
+            if self._wal is not None:
+                self._wal.close()
+            self._wal = open(self.wal_path, 'wb')
+            self.records_since_snapshot = 0
+
+    def load(self) -> Tuple[Optional[dict], list]:
+        """
+        Returns the last snapshot (or None) and the journal records written after it.
+        A torn record at the end of the journal (crash while writing) is dropped.
+        """
+        with self._lock:
+            snapshot = None
+            if os.path.exists(self.snap_path):
+                with open(self.snap_path, 'rb') as f:
+                    snapshot = msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+            base_seq = snapshot.get('seq', 0) if snapshot else 0
+
+            records = []
+            if os.path.exists(self.wal_path):
+                with open(self.wal_path, 'rb') as f:
+                    unpacker = msgpack.Unpacker(f, raw=False, strict_map_key=False)
+                    good_offset = 0
+                    try:
+                        for record in unpacker:
+                            good_offset = unpacker.tell()
+                            if record.get('seq', 0) > base_seq:
+                                records.append(record)
+                    except Exception as e:
+                        print(f"Journal {self.wal_path} damaged after offset {good_offset}, ignoring the tail: {e}")
+                if good_offset < os.path.getsize(self.wal_path):
+                    # cut the torn tail so new records are appended after the last good one
+                    with open(self.wal_path, 'r+b') as f:
+                        f.truncate(good_offset)
+
+            self.seq = records[-1]['seq'] if records else base_seq
+            self.records_since_snapshot = len(records)
+            return snapshot, records
+
+    def close(self) -> None:
+        with self._lock:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
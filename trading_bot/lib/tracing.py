@@ -0,0 +1,343 @@
+import functools, json, os, queue, random, threading, time
+from collections import deque
+from lib.metrics import METRICS
+
+
+class Span():
+    def __init__(self, tracer: 'Tracer', name: str, parent: 'Span' = None, start: float = None, **attrs) -> None:
+        """
+        One timed operation of a trace, a context manager: entering makes it the parent of the spans
+        opened on this thread, counts the RPC requests made inside it (attribute rpc) and ends it on exit
+        """
+        self.tracer = tracer
+        self.name = name
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else '%032x' % random.getrandbits(128)
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.start = start or time.time()
+        self.end_time = None
+        self.attrs = attrs
+        self.error = None
+        self._tally = None
+
+    def set(self, **attrs) -> 'Span':
+        self.attrs.update(attrs)
+        return self
+
+    def end(self, end: float = None) -> None:
+        if self.end_time is None:
+            self.end_time = end or time.time()
+            self.tracer.emit(self)
+
+    def __enter__(self) -> 'Span':
+        self.tracer._stack().append(self)
+        self._tally = METRICS.tally()
+        self.rpc = self._tally.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._tally.__exit__(None, None, None)
+        if self.rpc:
+            self.attrs['rpc'] = sum(self.rpc.values())
+        if exc is not None:
+            self.error = repr(exc)
+        stack = self.tracer._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.end()
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            'trace': self.trace_id, 'span': self.span_id, 'parent': self.parent_id, 'name': self.name,
+            'start': self.start, 'end': self.end_time, 'ms': round((self.end_time - self.start) * 1000, 3),
+            'attrs': self.attrs, 'error': self.error,
+        }
+
+
+class _NoopSpan():
+    # returned while tracing is off: no clock, no id, no allocation
+    def set(self, **attrs):
+        return self
+
+    def end(self, end: float = None) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class BatchSink():
+    def __init__(self, export, max_queue: int = 10_000, batch: int = 256, interval: float = 2.) -> None:
+        """
+        Hand finished spans to export(list of spans) from a background thread in batches,
+        the traced code only appends to a bounded queue (spans are dropped, and counted, when it is full)
+        """
+        self.export = export
+        self.batch = batch
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='trace-sink', daemon=True)
+        self._thread.start()
+
+    def put(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            spans = [self._queue.get()]
+            deadline = time.time() + self.interval
+            while len(spans) < self.batch and time.time() < deadline:
+                try:
+                    spans.append(self._queue.get(timeout=max(0., deadline - time.time())))
+                except queue.Empty:
+                    break
+            try:
+                self.export(spans)
+            except Exception as e:
+                print(f"Trace export of {len(spans)} spans failed: {e}")
+
+    def flush(self, timeout: float = 5) -> None:
+        deadline = time.time() + timeout
+        while not self._queue.empty() and time.time() < deadline:
+            time.sleep(0.05)
+
+
+def file_exporter(path: str):
+    """
+    Append spans to path, one json object per line
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    def export(spans: list) -> None:
+        with open(path, 'a') as file:
+            file.write(''.join(json.dumps(s.to_dict(), default=str) + '\n' for s in spans))
+    return export
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_exporter(endpoint: str, service: str = 'trading_bot', headers: dict = None):
+    """
+    POST spans to an OpenTelemetry collector, OTLP/HTTP json (endpoint like http://localhost:4318)
+    """
+    import requests
+    session = requests.Session()
+    url = endpoint.rstrip('/') + ('' if endpoint.rstrip('/').endswith('/v1/traces') else '/v1/traces')
+    resource = {'attributes': [{'key': 'service.name', 'value': {'stringValue': service}}]}
+
+    def export(spans: list) -> None:
+        body = {'resourceSpans': [{'resource': resource, 'scopeSpans': [{'scope': {'name': 'trading_bot'}, 'spans': [
+            {
+                'traceId': s.trace_id,
+                'spanId': s.span_id,
+                'parentSpanId': s.parent_id or '',
+                'name': s.name,
+                'kind': 1,
+                'startTimeUnixNano': str(int(s.start * 1e9)),
+                'endTimeUnixNano': str(int(s.end_time * 1e9)),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s.attrs.items() if v is not None],
+                'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+            } for s in spans
+        ]}]}]}
+        response = session.post(url, json=body, headers=headers or {}, timeout=10)
+        if response.status_code >= 300:
+            raise Exception(f"{response.status_code}: {response.text[:200]}")
+    return export
+
+
+class Tracer():
+    def __init__(self) -> None:
+        """
+        Spans of the bot cycles, sent to the configured sinks (see configure_tracing).
+        Without a sink span() returns NOOP_SPAN and tracing costs one attribute check.
+        """
+        self.sinks = []
+        self.enabled = False
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self) -> Span | None:
+        """
+        Innermost span open on this thread
+        """
+        if not self.enabled:
+            return None
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def span(self, name: str, parent: Span = None, **attrs):
+        """
+        with TRACER.span('broker.estimate', pair=...) as span: ... , child of parent or of the current span
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        if not isinstance(parent, Span):
+            parent = self.current()
+        return Span(self, name, parent, **attrs)
+
+    def record(self, name: str, start: float, end: float, parent: Span = None, **attrs) -> None:
+        """
+        Emit a span measured elsewhere, e.g. a trade from signal to fill
+        """
+        if self.enabled:
+            Span(self, name, parent, start=start, **attrs).end(end)
+
+    def annotate(self, **attrs) -> None:
+        """
+        Add attributes to the current span, e.g. the tx hash once known
+        """
+        if self.enabled:
+            stack = self._stack()
+            if stack:
+                stack[-1].attrs.update(attrs)
+
+    def bind(self, fn):
+        """
+        fn running under the current span when called from another thread (order pool, timers)
+        """
+        parent = self.current()
+        if parent is None:
+            return fn
+
+        def run(*args, **kwargs):
+            stack = self._stack()
+            stack.append(parent)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stack.remove(parent)
+        return run
+
+    def emit(self, span: Span) -> None:
+        for sink in self.sinks:
+            sink.put(span)
+
+    def add_sink(self, sink: BatchSink) -> None:
+        self.sinks.append(sink)
+        self.enabled = True
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+
+TRACER = Tracer()  # one per process, disabled until configure_tracing adds a sink
+
+
+def traced(name: str):
+    """
+    Decorator running the function inside a span name, a plain call while tracing is off
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with TRACER.span(name):
+                return fn(*args, **kwargs)
+        return run
+    return decorate
+
+
+def configure_tracing(file: str = None, otlp: str = None, service: str = 'trading_bot') -> Tracer:
+    """
+    Send the spans to a json-lines file and / or an OTLP/HTTP collector,
+    defaults from the TRACE_FILE and OTEL_EXPORTER_OTLP_ENDPOINT environment variables
+    """
+    file = file or os.getenv('TRACE_FILE')
+    otlp = otlp or os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')
+    if file:
+        TRACER.add_sink(BatchSink(file_exporter(file)))
+        print(f"Tracing to {file}")
+    if otlp:
+        TRACER.add_sink(BatchSink(otlp_exporter(otlp, service=service)))
+        print(f"Tracing to OTLP collector {otlp}")
+    return TRACER
+
+
+class CriticalPath():
+    def __init__(self, keep: int = 200) -> None:
+        """
+        Latency of the orders of a bot from the strategy signal to the tx submitted to the fill,
+        keyed by (trade id, 'open' / 'close'). Completed paths are kept for the cycle summary
+        and sent to the tracer as 'trade.critical_path' spans.
+        """
+        self.pending = {}  # (trade id, action) -> {'signal', 'submitted', 'pair', 'tx'}
+        self.done = deque(maxlen=keep)
+        self._reported = 0  # paths completed when summary() was last called
+        self._completed = 0
+        self._lock = threading.Lock()
+
+    def mark(self, trade_id: str, action: str, stage: str, at: float = None, **attrs) -> None:
+        at = at or time.time()
+        with self._lock:
+            path = self.pending.get((trade_id, action))
+            if stage == 'signal':
+                # first signal wins, a plan held in the netting window keeps its original time
+                self.pending.setdefault((trade_id, action), {'signal': at, **attrs})
+                return
+            if path is None:
+                return  # restored after a restart or placed outside a cycle, no signal time
+            path.update(attrs)
+            path[stage] = at
+            if stage != 'filled':
+                return
+            self.pending.pop((trade_id, action), None)
+            submitted = path.get('submitted', at)
+            row = {
+                'trade': trade_id, 'action': action, 'pair': path.get('pair'), 'tx': path.get('tx'),
+                'to_submit': submitted - path['signal'], 'to_fill': at - submitted, 'total': at - path['signal'],
+            }
+            self.done.append(row)
+            self._completed += 1
+        TRACER.record('trade.critical_path', path['signal'], at, parent=TRACER.current(), **{k: v for k, v in row.items() if v is not None})
+
+    def discard(self, trade_id: str, action: str) -> None:
+        """
+        Forget the path of an order that will never fill (rolled back, cancelled, expired)
+        """
+        with self._lock:
+            self.pending.pop((trade_id, action), None)
+
+    def summary(self) -> str | None:
+        """
+        One line on the paths completed since the previous summary, None if there are none
+        """
+        with self._lock:
+            new = min(self._completed - self._reported, len(self.done))
+            self._reported = self._completed
+            rows = list(self.done)[len(self.done) - new:] if new else []
+            in_flight = len(self.pending)
+        if not rows:
+            return None
+        avg = lambda key: sum(r[key] for r in rows) / len(rows)
+        worst = max(rows, key=lambda r: r['total'])
+        return (f"{len(rows)} orders filled: signal -> submitted {avg('to_submit'):.2f}s, submitted -> filled "
+                f"{avg('to_fill'):.2f}s, total {avg('total'):.2f}s avg / {worst['total']:.2f}s max ({worst['action']} {worst['pair']}), "
+                f"{in_flight} in flight")
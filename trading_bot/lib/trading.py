@@ -1,13 +1,24 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
-import time
-from typing import Optional, Tuple, Union
-import numpy as np
-import pandas as pd
+import time, threading, copy
+from typing import Optional, Tuple, Union, TYPE_CHECKING
+if TYPE_CHECKING:
+    import pandas as pd  # annotations only, pandas is imported by the strategies that use it
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import text
-from db.connection import get_session
+from db.connection import session_scope
 from db.models.order import Order as OrderModel
 from db.models.trade import Trade as TradeModel
+from db.writer import get_writer
+from lib.state import StateStore
+from lib.orderbook import LimitOrderBook
+from lib.protection import ProtectionEngine
+from lib.netting import OrderNetter
+from lib.rollup import EquityTracker, ALL
+from lib.history import TradeHistory
+from lib.runtime import interval_seconds
+from lib.tracing import TRACER, CriticalPath, traced
+from lib.events import EVENTS
 import ulid
 
 import warnings
@@ -35,6 +46,13 @@ class OrderPlan():
     def __repr__(self):
         return f"OrderPlan({self.action}, {self.side}, {self.pair})"
 
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'OrderPlan':
+        return cls(**data)
+
 
 class BaseBroker(ABC):
     def __init__(self, 
@@ -88,11 +106,25 @@ class BaseBroker(ABC):
         """
         # todo: place order
         pass
+
+    def get_price(self, pair: list) -> float:
+        """
+        Current price of pair ['quote', 'base'] in quote per one base, used to trigger limit orders
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} does not quote prices")
+
+    def place_orders(self, order_plans: list[OrderPlan], bot: 'TradingBot') -> list['Order']:
+        """
+        Place several orders, brokers able to submit concurrently should override this
+        Returns orders in the same order as order_plans (None for failed orders)
+        """
+        return [self.place_order(order_plan, bot) for order_plan in order_plans]
     
     @abstractmethod
-    def check_balance(self, bot: 'TradingBot') -> Tuple[float, float]:
+    def check_balance(self, bot: 'TradingBot', re_check: bool = False) -> Tuple[float, float]:
         """
         Check the balance of the bot
+        re_check: force a full rescan instead of using locally tracked balances
         """
         # return balance, pending_money (money in open orders)
         return 0.0, 0.0
@@ -138,6 +170,23 @@ class Order():
     def __repr__(self):
         return f"Order({self.id}, {self.category}, {self.symbol}, {self.side}, {self.status}, tx: {getattr(self, 'tx', '')})"
 
+    def to_dict(self) -> dict:
+        return {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+
+    @classmethod
+    def from_dict(cls, data: dict, broker: BaseBroker) -> 'Order':
+        """
+        Rebuild a saved order without asking the broker (no chain call)
+        """
+        if cls is Order and 'parent_id' in data:
+            return AllocatedOrder.from_dict(data, broker)
+        if cls is Order and 'target_qty' in data:
+            return ScheduledOrder.from_dict(data, broker)
+        order = cls.__new__(cls)
+        order.__dict__.update(data)
+        order._broker = broker
+        return order
+
     def update_info(self, wait_update:bool=False):
         self._broker.update_order(
             self,
@@ -150,7 +199,170 @@ class Order():
             if self.status not in ['Rejected', 'PartiallyFilledCanceled', 'Filled', 'Cancelled', 'Triggered', 'Deactivated']:
                 return False
         return True
-    
+
+
+class AllocatedOrder(Order):
+    def __init__(self, id:str, category:str, pair:list, side:str, broker:BaseBroker, parent:Order=None,
+                 alloc_qty:float=0., cross_price:float=None, fee_share:float=0., **kwargs) -> None:
+        """
+        Share of a netted order: alloc_qty base token filled at the price of the parent swap.
+        parent: the net swap, None when buys and sells crossed fully and no swap was sent
+        cross_price: fill price when there is no parent (quote at submission)
+        fee_share: part of the parent fee charged to this order
+        """
+        self._parent = parent
+        self.parent_id = parent.id if parent is not None else None
+        self.alloc_qty = alloc_qty
+        self.cross_price = cross_price
+        self.fee_share = fee_share
+        super().__init__(id, category, pair, side, broker, tx=getattr(parent, 'tx', None), **kwargs)
+
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data['parent'] = self._parent.to_dict() if self._parent is not None else None
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict, broker: BaseBroker) -> 'AllocatedOrder':
+        data = dict(data)
+        parent = data.pop('parent', None)
+        order = cls.__new__(cls)
+        order.__dict__.update(data)
+        order._broker = broker
+        order._parent = Order.from_dict(parent, broker) if parent is not None else None
+        return order
+
+    def update_info(self, wait_update:bool=False):
+        parent = self._parent
+        if parent is not None and parent.status not in ['Filled', 'PartiallyFilledCanceled', 'Cancelled', 'Rejected']:
+            # siblings share the parent, poll its receipt at most once a second
+            if not wait_update and time.time() - getattr(parent, '_polled_at', 0) < 1:
+                return
+            parent._polled_at = time.time()
+            parent.update_info(wait_update)
+        share = 1.
+        if parent is not None:
+            if parent.status in ['Cancelled', 'Rejected']:
+                # nothing swapped, checking_orders rolls the trade back
+                self.status = 'Cancelled'
+                return
+            if parent.status == 'PartiallyFilledCanceled' and getattr(parent, 'target_qty', 0):
+                # sliced parent stopped early: every allocation gets the same share of the fill
+                share = min(1., parent.filled_qty / parent.target_qty)
+            elif parent.status != 'Filled':
+                return
+        price = parent.price if parent is not None else self.cross_price
+        if price is None:
+            return
+        qty = self.alloc_qty * share
+        value = qty * price
+        if self.side == 'buy':
+            self.amount_in, self.amount_out = value, qty
+        else:
+            self.amount_in, self.amount_out = qty, value
+        self.price = price
+        self.qty = qty
+        self.value = value
+        self.type = 'market'
+        self.create_time = getattr(parent, 'create_time', None) or int(time.time())
+        self.filled_time = getattr(parent, 'filled_time', None) or self.create_time
+        self.fee = (getattr(parent, 'fee', 0) or 0) * self.fee_share
+        self.status = 'Filled' if share >= 1 else 'PartiallyFilledCanceled'
+
+
+class ScheduledOrder(Order):
+    def __init__(self, id:str, category:str, pair:list, side:str, broker:BaseBroker, target_qty:float=0.,
+                 schedule:dict=None, **kwargs) -> None:
+        """
+        Parent of an order executed in slices (twap / iceberg) by the broker scheduler.
+        Amounts and price are the sums / average of the filled slices, status stays 'PartiallyFilled'
+        until the schedule is over, so the trade keeps waiting in its opening / closing queue.
+        target_qty: base token qty of the whole order
+        schedule: execution settings and progress, kept with the order for restarts
+        """
+        self.target_qty = target_qty
+        self.filled_qty = 0.
+        self.schedule = schedule or {}
+        self.children = []  # slice orders
+        self._lock = threading.RLock()
+        super().__init__(id, category, pair, side, broker, **kwargs)
+
+    def to_dict(self) -> dict:
+        data = super().to_dict()
+        data['children'] = [child.to_dict() for child in self.children]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict, broker: BaseBroker) -> 'ScheduledOrder':
+        data = dict(data)
+        children = data.pop('children', [])
+        order = cls.__new__(cls)
+        order.__dict__.update(data)
+        order._broker = broker
+        order._lock = threading.RLock()
+        order.children = [Order.from_dict(child, broker) for child in children]
+        return order
+
+    def add_child(self, order:Order, qty:float) -> None:
+        with self._lock:
+            order.slice_qty = qty
+            self.children.append(order)
+            self.schedule['placed_qty'] = self.schedule.get('placed_qty', 0) + qty
+            self.schedule['sent'] = self.schedule.get('sent', 0) + 1
+            self.schedule['failures'] = 0
+            self.tx = order.tx  # last slice
+
+    def finish(self, cancelled:bool=False) -> None:
+        """
+        End of the schedule, no more slices will be sent
+        """
+        with self._lock:
+            self.schedule['done'] = True
+            self.schedule['cancelled'] = cancelled
+        self.update_info()
+
+    def resume(self, bot:'TradingBot') -> None:
+        """
+        Hand a restored unfinished order back to the broker scheduler
+        """
+        if self.schedule.get('done'):
+            return
+        scheduler = getattr(self._broker, 'scheduler', None)
+        if scheduler is None:
+            self.finish(cancelled=True)
+        else:
+            scheduler.resume(self, bot)
+
+    def update_info(self, wait_update:bool=False):
+        with self._lock:
+            for child in self.children:
+                try:
+                    if not child.is_filled() and wait_update:
+                        child.update_info(True)
+                except Exception as e:
+                    print(f"Could not update slice {child.id} of {self.id}: {e}")
+            filled = [c for c in self.children if c.status == 'Filled' and c.amount_in is not None]
+            # reverted slices are final too, they just add nothing
+            pending = any(c.status not in ['Filled', 'Rejected'] for c in self.children)
+            self.amount_in = sum(c.amount_in for c in filled)
+            self.amount_out = sum(c.amount_out for c in filled)
+            self.filled_qty = self.amount_out if self.side == 'buy' else self.amount_in
+            self.qty = self.filled_qty
+            self.value = self.amount_in if self.side == 'buy' else self.amount_out
+            if self.filled_qty:
+                self.price = self.value / self.filled_qty
+            self.fee = sum(getattr(c, 'fee', 0) or 0 for c in filled)
+            self.type = self.schedule.get('mode')
+            self.create_time = self.create_time or int(self.schedule.get('start', time.time()))
+            if filled:
+                self.filled_time = max(c.filled_time or 0 for c in filled)
+            if not self.schedule.get('done') or pending:
+                self.status = 'PartiallyFilled' if filled else 'New'
+            elif self.schedule.get('cancelled'):
+                self.status = 'PartiallyFilledCanceled' if filled else 'Cancelled'
+            else:
+                self.status = 'Filled'
+
 
 class Trade():
     def __init__(self, id:str, broker:BaseBroker) -> None:
@@ -178,7 +390,8 @@ class Trade():
         self.is_open()
 
     def is_open(self):
-        if self.open_order.is_filled():
+        # a reverted or cancelled order is final without opening anything, checking_orders rolls it back
+        if self.open_order.is_filled() and self.open_order.status not in ['Cancelled', 'Rejected']:
             self.invested_amount = self.open_order.amount_in if self.open_order.side == 'buy' else  self.open_order.amount_out
             self.position_size = self.open_order.amount_out if self.open_order.side == 'buy' else  self.open_order.amount_in
             self.entry_price = self.open_order.price
@@ -189,7 +402,7 @@ class Trade():
             return False
         
     def is_close(self):
-        if self.close_order.is_filled():
+        if self.close_order.is_filled() and self.close_order.status not in ['Cancelled', 'Rejected']:
             self.net_return = self.close_order.amount_out if self.close_order.side =='sell' else self.close_order.amount_in
             self.profit = self.close_order.amount_out - self.open_order.amount_in if self.direction == 'long' else self.open_order.amount_out - self.close_order.amount_in
             self.exit_price = self.close_order.price
@@ -200,7 +413,27 @@ class Trade():
             return False
 
     def __repr__(self):
-        return f"Trade({self.id}, {getattr(self.open_order, 'symbol', None)}, {self.direction}, {self.status}, {getattr(self.open_order, 'price', None)}, {getattr(self.close_order, 'price', None)})"
+        return f"Trade({self.id}, {getattr(self.open_order, 'symbol', None)}, {getattr(self, 'direction', None)}, {self.status}, {getattr(self.open_order, 'price', None)}, {getattr(self.close_order, 'price', None)})"
+
+    def to_dict(self) -> dict:
+        data = {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+        for key in ['open_order', 'close_order', 'order_plan', 'queued_plan']:
+            if data.get(key) is not None:
+                data[key] = data[key].to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict, broker: BaseBroker) -> 'Trade':
+        data = dict(data)
+        trade = cls(id=data.pop('id'), broker=broker)
+        for key in ['open_order', 'close_order']:
+            if data.get(key) is not None:
+                data[key] = Order.from_dict(data[key], broker)
+        for key in ['order_plan', 'queued_plan']:
+            if data.get(key) is not None:
+                data[key] = OrderPlan.from_dict(data[key])
+        trade.__dict__.update(data)
+        return trade
 
 
 class Strategy(ABC): # base template for strategy
@@ -219,6 +452,19 @@ class Strategy(ABC): # base template for strategy
         """
         pass
 
+    def bar_time(self, data: pd.DataFrame) -> float | None:
+        """
+        Open time (epoch seconds) of the newest final candle in data, None when data has no 'timestamp' column
+        Override when the data carries its candle times elsewhere
+        """
+        if 'timestamp' not in getattr(data, 'columns', []) or len(data) == 0:
+            return None
+        last = data['timestamp'].max()
+        if hasattr(last, 'timestamp'):
+            return float(last.timestamp())
+        last = float(last)
+        return last / 1000 if last > 1e12 else last  # milliseconds
+
     @abstractmethod
     def run(self, pair: list, data: pd.DataFrame, budget: float, bot: 'TradingBot') -> OrderPlan | None:
         """
@@ -232,8 +478,13 @@ class Strategy(ABC): # base template for strategy
 class TradingBot():
     def __init__(self, id:str, tokens=[], currency:str='USDT', call_budget:float=5, invest_amount:float=10_000,
             balance:float=None, broker: BaseBroker = None, category:str='spot', strategy:Strategy=None, 
-            default_order_timeout:float = 60*15, db:Session=None, notif_on:bool = True, **kwargs) -> None:
-        self.load_create_bot(id)
+            default_order_timeout:float = 60*15, db:Session=None, notif_on:bool = True, state_dir:str=None, net_window:float=0,
+            history_size:int=200, lazy:bool=False, **kwargs) -> None:
+        # lazy: skip the DB registration and the balance check here, prepare() runs them before the first cycle
+        self.id = id
+        self._prepared = False
+        if not lazy:
+            self.load_create_bot(id)
         self.tokens = tokens if tokens is not None else []  # Safe initialization
         if currency in self.tokens:
             self.tokens.remove(currency)
@@ -248,9 +499,9 @@ class TradingBot():
         self.process_trades = {
             'opening': [],      # Orders being opened (processing)
             'closing': [],      # Orders being closed (processing)
-            'waiting': []       # Limit orders waiting for price or timeout
+            'waiting': LimitOrderBook()  # Limit orders waiting for price or timeout
         }
-        self.history_trades = []
+        self.history_trades = TradeHistory(self.id, maxlen=history_size)  # last closed trades, older ones paged from the DB
         self.strategy = strategy
         self.db = db # todo: use db to save/load state, write orders and trades and logs
         self.wallet_address = None # todo: use wallet address for crypto trading
@@ -258,127 +509,225 @@ class TradingBot():
         for key, value in kwargs.items():
             setattr(self, key, value)
         
-        self.update_balance()  # update balance and pending_money
         self.fund = {}
+        if not lazy:
+            self.update_balance()  # update balance and pending_money
+            self._prepared = True
         self.config_fund_rate({token:1.0 for token in self.tokens})  # default fund rate for each token is 1.0
         self.order_queue = []
+        self._submit_queue = []  # (trade, order_plan) prepared in this cycle, placed together by submit_orders
+        self._collecting = False  # True while strategies run: buy/sell queue plans instead of placing them
+        self.protection = ProtectionEngine()  # tp / sl / trailing stop levels of open trades
+        self.netter = OrderNetter(window=net_window)  # buys and sells of a pair go out as one net swap
+        self.rollup = EquityTracker(self.id)  # minute / hour / day PnL and equity of the bot and its pairs
+        self._marks = {}  # symbol -> last close of the strategy data, prices open trades to market
+        self._bars = {}  # symbol -> open time of the last candle the strategy ran on
+        self.settlement = {}  # progress of the end of vault settlement, see lib/settlement.py
+        self.critical_path = CriticalPath()  # signal -> tx submitted -> filled latency of the orders
+        self._last_cycle = 0.  # start of the last strategy cycle, paces strategies without an interval
+        self.lock = threading.RLock()  # held by a cycle, lets a monitor tick skip instead of overlapping
         self.default_order_timeout = default_order_timeout
         self.notif_on:bool = bool(notif_on)  # whether to send notifications about trades
+        # snapshot + journal of trades, fund and in-flight orders, restored on restart
+        self.state_store = StateStore(state_dir, self.id) if state_dir else None
+        if self.state_store is not None:
+            self.restore_state()
      
     def write_order(self, order: Order) -> None:
         """
         Write order to database or update existing order
+        The row is queued in the write-behind writer, trading never waits on the database
         Parameters:
         order : Order
             Order object to write to database
         """
         try:
-            # Check if order already exists in DB
-            existing_order = OrderModel.get_by_id(order.id)
-            if existing_order:
-                # Update existing order
-                existing_order.update(
-                    symbol=order.symbol,
-                    side=order.side,
-                    price=order.price,
-                    token_in=order.token_in,
-                    token_out=order.token_out,
-                    amount_in=order.amount_in,
-                    amount_out=order.amount_out,
-                    type=order.type,
-                    create_time=order.create_time,
-                    filled_time=order.filled_time,
-                    tx=getattr(order, 'tx', None),
-                    tx_link=getattr(order, 'tx_link', None)
-                )
-            else:
-                # Create new order in DB
-                OrderModel.create(
-                    id=order.id,
-                    symbol=order.symbol,
-                    side=order.side,
-                    price=order.price,
-                    token_in=order.token_in,
-                    token_out=order.token_out,
-                    amount_in=order.amount_in,
-                    amount_out=order.amount_out,
-                    type=order.type,
-                    create_time=order.create_time,
-                    filled_time=order.filled_time,
-                    tx=getattr(order, 'tx', None),
-                    tx_link=getattr(order, 'tx_link', None)
-                )
+            get_writer().put(OrderModel, {
+                'id': order.id,
+                'symbol': order.symbol,
+                'side': order.side,
+                'price': order.price,
+                'token_in': order.token_in,
+                'token_out': order.token_out,
+                'amount_in': order.amount_in,
+                'amount_out': order.amount_out,
+                'type': order.type,
+                'create_time': order.create_time,
+                'filled_time': order.filled_time,
+                'tx': getattr(order, 'tx', None),
+                'tx_link': getattr(order, 'tx_link', None),
+                'fee': getattr(order, 'fee', None),
+            })
         except Exception as e:
             print(f"Error writing order to database: {e}")
 
     def write_trade(self, trade) -> None:
         """
         Write trade to database or update existing trade
+        The row is queued in the write-behind writer, trading never waits on the database
         
         Parameters:
         trade : Trade
             Trade object to write to database
         """
         try:
-            # Extract trade data
-            trade_data = {
-                'bot_id': self.id,
-                'pair': trade.open_order.symbol,
-                'direction': trade.direction,
-                'entry_order_id': trade.open_order_id,
-                'invested_amount': trade.invested_amount,
-                'position_size': getattr(trade, 'position_size', 0),
-                'entry_price': getattr(trade, 'entry_price', 0),
-                'entry_time': getattr(trade, 'entry_time', 0),
-                'status': trade.status
-            }
-            
-            # If trade is closed, add exit information
-            if hasattr(trade, 'close_order') and trade.close_order:
-                trade_data.update({
-                    'exit_order_id': trade.close_order_id,
-                    'net_return': getattr(trade, 'net_return', 0),
-                    'profit': getattr(trade, 'profit', 0),
-                    'exit_price': getattr(trade, 'exit_price', 0),
-                    'exit_time': getattr(trade, 'exit_time', 0),
-                })
-            
-            # Generate trade ID if needed
-            if not trade.id:
-                # Create a unique ID from timestamp and pair
-                trade.id = f"{trade.open_order.symbol}{trade.entry_time}"
-            
-            trade_data['id'] = trade.id
-            
-            # Check if trade already exists in DB
-            existing_trade = TradeModel.get_by_id(trade.id)
-            
-            if existing_trade:
-                # Update existing trade
-                existing_trade.update(**trade_data)
-            else:
-                # Create new trade in DB
-                TradeModel.create(**trade_data)
-                
+            trade_data = self.trade_row(trade)
+            get_writer().put(TradeModel, trade_data)
         except Exception as e:
-            print(f"Error writing trade to database: {e}")        
+            print(f"Error writing trade to database: {e}")
+
+    def trade_row(self, trade) -> dict:
+        """
+        Trade as a row of the trades table, also the slim record kept in history_trades
+        """
+        # Extract trade data
+        trade_data = {
+            'bot_id': self.id,
+            'pair': trade.open_order.symbol,
+            'direction': trade.direction,
+            'entry_order_id': trade.open_order_id,
+            'invested_amount': trade.invested_amount,
+            'position_size': getattr(trade, 'position_size', 0),
+            'entry_price': getattr(trade, 'entry_price', 0),
+            'entry_time': getattr(trade, 'entry_time', 0),
+            'status': trade.status
+        }
+
+        # If trade is closed, add exit information
+        if hasattr(trade, 'close_order') and trade.close_order:
+            trade_data.update({
+                'exit_order_id': trade.close_order_id,
+                'net_return': getattr(trade, 'net_return', 0),
+                'profit': getattr(trade, 'profit', 0),
+                'exit_price': getattr(trade, 'exit_price', 0),
+                'exit_time': getattr(trade, 'exit_time', 0),
+            })
+
+        # Generate trade ID if needed
+        if not trade.id:
+            # Create a unique ID from timestamp and pair
+            trade.id = f"{trade.open_order.symbol}{trade.entry_time}"
+
+        trade_data['id'] = trade.id
+        return trade_data
+
+    def export_state(self) -> dict:
+        """
+        Full bot state as plain data: trades of every queue, fund and balances
+        """
+        trades = [{'where': 'open', 'trade': t.to_dict()} for queue in self.open_trades.values() for t in queue]
+        for where, queue in self.process_trades.items():
+            trades += [{'where': where, 'trade': t.to_dict()} for t in queue]
+        trades += [{'where': 'history', 'trade': row} for row in self.history_trades]
+        trades += [{'where': 'queued', 'trade': t.to_dict()} for t, _ in self._submit_queue if getattr(t, 'queued', False)]
+        return {
+            'id': self.id,
+            'time': time.time(),
+            'trades': trades,
+            'fund': self.fund,
+            'balance': self.balance,
+            'pending_money': self.pending_money,
+            'token_balance': self._token_balance,
+            'bars': self._bars,
+            'settlement': {k: v.to_dict() if isinstance(v, Order) else v for k, v in self.settlement.items()},
+        }
 
     def save_state(self) -> None:
-        # todo: [unnecessary - do if have free time]
-        # save undone state to DB
-        # remove all order and trade have bot id and write new
-        pass
+        """
+        Write a snapshot of the bot state, the journal restarts empty after it
+        """
+        if self.state_store is None:
+            return
+        self.state_store.write_snapshot(self.export_state())
+
+    def journal(self, trade: Trade, where: str) -> None:
+        """
+        Record a trade moving to a queue: 'queued', 'waiting', 'opening', 'closing', 'open', 'history' or 'cancelled'
+        """
+        if self.state_store is None:
+            return
+        self.state_store.append({
+            'where': where,
+            'trade': trade.to_dict(),
+            'fund': self.fund,
+            'balance': self.balance,
+            'pending_money': self.pending_money,
+        })
+        if self.state_store.need_snapshot():
+            self.save_state()
+
+    def journal_order(self, order: Order) -> None:
+        """
+        Record the progress of an order still in the opening / closing queue (slices of a scheduled order)
+        """
+        for where, key in [('opening', 'open_order'), ('closing', 'close_order')]:
+            for trade in self.process_trades[where]:
+                if getattr(trade, key, None) is order:
+                    self.journal(trade, where)
+                    return
+
+    def restore_state(self) -> bool:
+        """
+        Rebuild trades, pending orders and fund from the last snapshot plus the journal tail
+        """
+        snapshot, records = self.state_store.load()
+        if snapshot is None and not records:
+            return False
+        trades = {}  # trade id -> (where, trade data), last record wins
+        if snapshot is not None:
+            for item in snapshot['trades']:
+                trades[item['trade']['id']] = (item['where'], item['trade'])
+            self.fund.update(snapshot['fund'])
+            self.balance = snapshot['balance']
+            self.pending_money = snapshot['pending_money']
+            self._bars.update(snapshot.get('bars', {}))
+            self.settlement = dict(snapshot.get('settlement') or {})
+            if self.settlement.get('swap') is not None:
+                # residual swap of an interrupted settlement, resumed below with the other sliced orders
+                self.settlement['swap'] = Order.from_dict(self.settlement['swap'], self._broker)
+        for record in records:
+            trades[record['trade']['id']] = (record['where'], record['trade'])
+            self.fund.update(record['fund'])
+            self.balance = record['balance']
+            self.pending_money = record['pending_money']
+
+        self.open_trades = {}
+        self.process_trades = {'opening': [], 'closing': [], 'waiting': LimitOrderBook()}
+        self.history_trades = TradeHistory(self.id, maxlen=self.history_trades.maxlen)
+        self._submit_queue = []
+        history = []
+        for where, data in trades.values():
+            if where == 'history':
+                # slim rows, except in journal records and older snapshots
+                history.append(self.trade_row(Trade.from_dict(data, self._broker)) if 'open_order' in data else data)
+                continue
+            trade = Trade.from_dict(data, self._broker)
+            if where == 'queued':
+                # held for netting when the bot stopped, placed with the next submission
+                self._submit_queue.append((trade, trade.queued_plan))
+            elif where == 'open':
+                self.open_trades.setdefault(trade.open_order.symbol, []).append(trade)
+                self.protect(trade)
+            elif where in self.process_trades:
+                self.process_trades[where].append(trade)
+        self.history_trades.load(history)
+        # sliced orders still executing go back to the broker scheduler
+        orders = [t.open_order for t in self.process_trades['opening']] + [t.close_order for t in self.process_trades['closing']]
+        orders.append(self.settlement.get('swap'))
+        for order in orders:
+            if isinstance(order, ScheduledOrder):
+                order.resume(self)
+        print(f"Bot {self.id} state restored: {sum(len(v) for v in self.open_trades.values())} open trades, "
+              f"{sum(len(v) for v in self.process_trades.values())} in process, {len(records)} journal records replayed")
+        return True
 
     def load_state(self, id) -> 'TradingBot':
         # todo: [unnecessary - do if have free time]
         # load state from DB
-        db = get_session()
-        bots = db.execute(text(f"""
-            SELECT id, balance, invested_money FROM trade_bot.bots WHERE id = '{id}'
-        """))
-        bot = None
-        for bot in bots:
-            pass
+        with session_scope(commit=False) as db:
+            bot = db.execute(text(f"""
+                SELECT id, balance, invested_money FROM trade_bot.bots WHERE id = '{id}'
+            """)).first()
         if bot:
             self.id = bot.id
             return self
@@ -390,26 +739,39 @@ class TradingBot():
         bot = self.load_state(id)
         if not bot:
             # create bot state in DB
-            db = get_session()
-            res = db.execute(text(f"""
-            INSERT INTO trade_bot.bots (id, balance, invested_money) VALUES ('{id}', 0, 0)
-            """))
-            db.commit()
-            db.close()
+            with session_scope() as db:
+                db.execute(text(f"""
+                INSERT INTO trade_bot.bots (id, balance, invested_money) VALUES ('{id}', 0, 0)
+                """))
             print(f"Bot {id} created")
             return self
         else:
             print(f"Bot {id} loaded")
             return self
 
-    def update_balance(self):
+    def prepare(self) -> None:
+        """
+        Deferred part of __init__ for bots built with lazy=True: DB registration and first balance check
+        Runs once, from the warm-up thread or at the start of the first cycle, whichever comes first
+        """
+        if self._prepared:
+            return
+        with self.lock:
+            if self._prepared:
+                return
+            self.load_create_bot(self.id)
+            self.update_balance()
+            self._prepared = True
+
+    def update_balance(self, re_check:bool=False):
         """ Check the balance of the bot
         calcualte the _token_balance then adjust the value of:
         - balance: total amount of money in the bot
         - pending_money: money in open orders
+        re_check: force the broker to rescan every token balance instead of its tracked state
         """
         # check balance, pending_money, _token_balance
-        self.balance,self.pending_money = self._broker.check_balance(self)
+        self.balance,self.pending_money = self._broker.check_balance(self, re_check=re_check)
         
         return self.balance, self.pending_money
 
@@ -456,6 +818,7 @@ class TradingBot():
         
         return self.fund
     
+    @traced('bot.checking_orders')
     def checking_orders(self):
         """
         Check and process trades in opening, closing, and waiting queues
@@ -463,67 +826,31 @@ class TradingBot():
         """
         current_time = time.time()
         # Check waiting orders (limit orders with time constraints)
-        for trade in self.process_trades['waiting'][:]:
-            # All waiting trades have an order_plan with action 'open' or 'close'
-            if hasattr(trade, 'order_plan'):
-                order_plan = trade.order_plan
-                target_price = getattr(order_plan, 'limit', None)
-                current_price = self._broker.get_current_price(order_plan.pair)
-                price_condition_met = False
-
-                if order_plan.side == 'buy' and current_price <= target_price:
-                    price_condition_met = True
-                elif order_plan.side == 'sell' and current_price >= target_price:
-                    price_condition_met = True
-
-                # Check if time limit is exceeded
-                time_exceeded = order_plan.exp_time > current_time
-
-                if price_condition_met:
-                    action = getattr(order_plan, 'action', None)
-                    if action is None:
-                        action = 'close' if getattr(trade, 'open_order', None) else 'open'
-
-                    if action == 'open':
-                        order = self._broker.place_order(order_plan, self)
-                        trade.set_open_order(order)
-                        self.process_trades['waiting'].remove(trade)
-                        self.process_trades['opening'].append(trade)
-                        # Write order to database
-                        self.write_order(order)
-
-                    elif action == 'close':
-                        order = self._broker.place_order(order_plan, self)
-                        trade.set_close_order(order)
-                        self.process_trades['waiting'].remove(trade)
-                        self.process_trades['closing'].append(trade)
-                    # Write order to database
-                    self.write_order(order)
-                    
-                elif time_exceeded:
-                    print(f"Time limit exceeded for order {order_plan}")
-                    # Return funds to cash if open, or move back to open_trades if close
-                    if action == 'open':
-                        token = order_plan.pair[1] if order_plan.side == 'buy' else order_plan.pair[0]
-                        estimated_amount = getattr(order_plan, 'estimated_amount', 0)
-                        
-                        if token in self.fund and estimated_amount:
-                            self.fund[token]['pending'] -= estimated_amount
-                            self.fund[token]['cash'] += estimated_amount
-                        self.process_trades['waiting'].remove(trade)
-                        trade.order_plan.status = 'Cancelled'
-                        trade.status = 'cancelled'
-                    elif action == 'close':
-                        # If closing, we might want to keep the trade in open_trades
-                        symbol = ''.join(order_plan.pair[::-1]) 
-                        if symbol not in self.open_trades:
-                            self.open_trades[symbol] = []
-                            trade.order_plan.status = 'Cancelled'
-                        self.open_trades[symbol].append(trade)
-                        self.process_trades['waiting'].remove(trade)
+        book = self.process_trades['waiting']
+        if len(book) > 0:
+            # expired first: an order past its time limit never fills
+            for trade in book.expired(current_time):
+                self._expire_waiting(trade)
+            # one quote per pair, only the crossed orders come out of the book
+            for pair in book.pairs():
+                try:
+                    current_price = self._broker.get_price(pair)
+                except Exception as e:
+                    print(f"Could not get price for {pair}: {e}")
+                    continue
+                for trade in book.crossed(pair, current_price):
+                    self._trigger_waiting(trade)
+
+        # Check protective levels (take profit, stop loss, trailing stop) of open trades
+        self.check_protection()
 
         # Check opening trades (standard logic)
         for trade in self.process_trades['opening'][:]:
+            if trade.open_order.status in ['Cancelled', 'Rejected']:
+                # reverted swap, or sliced order stopped before any fill
+                self.process_trades['opening'].remove(trade)
+                self._rollback_submit(trade, trade.order_plan)
+                continue
             if trade.is_open():
                 # Get token from pair
                 token = trade.open_order.token_out if trade.open_order.side == 'buy' else trade.open_order.token_in
@@ -538,9 +865,9 @@ class TradingBot():
                 
                 # Remove from processing queue
                 self.process_trades['opening'].remove(trade)
+                self.critical_path.mark(trade.id, 'open', 'filled')
                 
-                print(self._token_balance)
-                print(self.fund)
+                EVENTS.balance_update(self.id, self._token_balance, self.fund)
                 # Move money from pending to invested in fund
                 if token in self.fund:
                     # Ensure we don't subtract more than what's pending
@@ -555,24 +882,30 @@ class TradingBot():
                 # Update bot's pending money
                 self.pending_money -= amount
 
+                self.protect(trade)
+                self.journal(trade, 'open')
                 # Write the trade and open order to DB
                 self.write_order(trade.open_order)
                 self.write_trade(trade)  # new trade
-                # Announce the trade
-                if self.notif_on:
-                    print(trade.open_order)
+                # Announce the trade, still logged at debug level when notifications are off
+                EVENTS.fill(self.id, trade.id, 'open', trade.open_order, level='info' if self.notif_on else 'debug')
 
         # Check closing trades (standard logic)
         for trade in self.process_trades['closing'][:]:
+            if trade.close_order.status in ['Cancelled', 'Rejected']:
+                self.process_trades['closing'].remove(trade)
+                self._rollback_submit(trade, OrderPlan(action='close', side=trade.close_order.side, pair=trade.close_order.pair))
+                continue
             if trade.is_close():
                 # Get token from trade
                 token = trade.open_order.token_out if trade.open_order.side == 'buy' else trade.open_order.token_in
                 
-                # Add to history_trades
-                self.history_trades.append(trade)
+                # Add to history_trades, as a slim row
+                self.history_trades.append(self.trade_row(trade))
                 
                 # Remove from processing queue
                 self.process_trades['closing'].remove(trade)
+                self.critical_path.mark(trade.id, 'close', 'filled')
                 
                 # Update fund with trade results
                 if token in self.fund:
@@ -584,25 +917,150 @@ class TradingBot():
                     
                 # Update bot's balance
                 self.balance += trade.net_return
+                try:
+                    self.rollup.record_trade(trade.open_order.symbol, trade.profit)
+                except Exception as e:
+                    print(f"Error recording trade {trade.id} in rollups: {e}")
 
+                self.journal(trade, 'history')
                 # Write the trade and open order to DB
                 self.write_order(trade.close_order)
                 self.write_trade(trade)  # update trade
-                # Announce the trade
-                if self.notif_on:
-                    print(trade.close_order)
+                # Announce the trade, still logged at debug level when notifications are off
+                EVENTS.fill(self.id, trade.id, 'close', trade.close_order, level='info' if self.notif_on else 'debug')
 
 
         
         return self.process_trades
 
-    def open_trade(self, order_plan) -> Trade:
+    def mark_equity(self, now:float=None) -> float:
+        """
+        Mark the bot and each of its pairs to market in the equity rollups, once per cycle
+        bot equity: currency balance + value of the held tokens (the vault NAV)
+        pair equity: capital allocated to the token + realized PnL + unrealized PnL of its open trades
+        Returns
+        float
+            Equity of the bot
+        """
+        try:
+            self.update_balance()
+        except Exception as e:
+            print(f"Could not update balance before marking equity: {e}")
+        equity = (self.balance or 0) + (self.pending_money or 0)
+        self.rollup.mark(ALL, equity, now)
+        for t in self.tokens:
+            symbol = t + self.currency
+            price = self._marks.get(symbol)
+            unrealized = 0.
+            for trade in self.open_trades.get(symbol, []):
+                if price is None or getattr(trade, 'position_size', None) is None:
+                    continue
+                value = trade.position_size * price
+                unrealized += value - trade.invested_amount if trade.direction == 'long' else trade.invested_amount - value
+            capital = self.fund.get(t, {}).get('total', 0)
+            self.rollup.mark(symbol, capital + self.rollup.cum_realized(symbol) + unrealized, now)
+        return equity
+
+    def protect(self, trade:Trade) -> bool:
+        """
+        Attach the take profit / stop loss / trailing stop levels of an open trade (set from its open order plan)
+        """
+        try:
+            return self.protection.attach(
+                trade,
+                tp_price=getattr(trade, 'tp_price', None),
+                sl_price=getattr(trade, 'sl_price', None),
+                trail_pct=getattr(trade, 'trail_pct', None),
+            )
+        except Exception as e:
+            print(f"Could not protect trade {trade.id}: {e}")
+            return False
+
+    def check_protection(self, submit:bool=True) -> list[Trade]:
+        """
+        Quote every protected pair once and close the trades whose level was breached
+        submit: place the closes now, or leave them queued to be netted with the strategy orders of the cycle
+        Returns
+        list
+            Trades sent to close
+        """
+        triggered = []
+        for pair in self.protection.pairs():
+            try:
+                current_price = self._broker.get_price(pair)
+            except Exception as e:
+                print(f"Could not get price for {pair}: {e}")
+                continue
+            for trade, order_plan in self.protection.update(pair, current_price):
+                print(f"{order_plan.trigger} triggered for trade {trade.id} at {current_price}")
+                try:
+                    self.close_trade(trade=trade, order_plan=order_plan, place=False)
+                    triggered.append(trade)
+                except Exception as e:
+                    print(f"Error closing trade {trade.id}: {e}")
+        if triggered and submit:
+            self.submit_orders()
+        return triggered
+
+    def _waiting_action(self, trade:Trade) -> str:
+        action = getattr(trade.order_plan, 'action', None)
+        if action is None:
+            action = 'close' if getattr(trade, 'open_order', None) else 'open'
+        return action
+
+    def _trigger_waiting(self, trade:Trade) -> None:
+        """
+        Place the order of a waiting trade whose limit price was crossed
+        """
+        order_plan = trade.order_plan
+        action = self._waiting_action(trade)
+        order = self._broker.place_order(order_plan, self)
+        if order is None:
+            print(f"Limit order not placed, rollback {order_plan}")
+            self._rollback_submit(trade, order_plan)
+            return
+        if action == 'open':
+            trade.set_open_order(order)
+            self.process_trades['opening'].append(trade)
+            self.journal(trade, 'opening')
+        else:
+            trade.set_close_order(order)
+            self.process_trades['closing'].append(trade)
+            self.journal(trade, 'closing')
+        # Write order to database
+        self.write_order(order)
+
+    def _expire_waiting(self, trade:Trade) -> None:
+        """
+        Time limit exceeded: return funds to cash if open, or move back to open_trades if close
+        """
+        order_plan = trade.order_plan
+        print(f"Time limit exceeded for order {order_plan}")
+        order_plan.status = 'Cancelled'
+        self.critical_path.discard(trade.id, self._waiting_action(trade))
+        if self._waiting_action(trade) == 'open':
+            token = order_plan.pair[1] if order_plan.side == 'buy' else order_plan.pair[0]
+            estimated_amount = getattr(order_plan, 'estimated_amount', 0)
+            if token in self.fund and estimated_amount:
+                self.fund[token]['pending'] -= estimated_amount
+                self.fund[token]['cash'] += estimated_amount
+            trade.status = 'cancelled'
+            self.journal(trade, 'cancelled')
+        else:
+            symbol = trade.open_order.symbol
+            self.open_trades.setdefault(symbol, []).append(trade)
+            self.protect(trade)
+            self.journal(trade, 'open')
+
+    def open_trade(self, order_plan, place:bool=True) -> Trade:
         """
         Open a new trade based on an order plan
         
         Parameters:
         order_plan : OrderPlan
             Complete order plan with all necessary details
+        place : bool
+            Place market orders now, or queue them for submit_orders
         """
         if not isinstance(order_plan, OrderPlan):
             raise TypeError("order_plan must be an instance of OrderPlan")
@@ -617,6 +1075,10 @@ class TradingBot():
             estimated_amount = order_plan.qty * order_plan.price
             order_plan.estimated_amount = estimated_amount
 
+        order_type = getattr(order_plan, 'order_type', 'market')
+        if order_type == 'limit' and getattr(order_plan, 'limit', None) is None:
+            raise ValueError(f"Limit order plan needs a limit price: {order_plan}")
+
         # Verify we have enough cash in the fund
         if token in self.fund and estimated_amount:
             if self.fund[token]['cash'] < estimated_amount:
@@ -627,35 +1089,44 @@ class TradingBot():
 
         # Create a trade object
         trade = Trade(id=str(ulid.new()), broker=self._broker)
+        trade.order_plan = order_plan
+        # protective levels, attached once the trade is open
+        trade.tp_price = getattr(order_plan, 'tp_price', None)
+        trade.sl_price = getattr(order_plan, 'sl_price', None)
+        trade.trail_pct = getattr(order_plan, 'trail_pct', None)
 
         # Check if this is a market order or limit order with time constraint
-        order_type = getattr(order_plan, 'order_type', 'market')
-        
-        if order_type == 'market':
+        if order_type == 'market' and not place:
+            # Market order - placed with the rest of the cycle in submit_orders
+            self._submit_queue.append((trade, order_plan))
+        elif order_type == 'market':
             # Market order - process immediately
             order = self._broker.place_order(order_plan, self)
             trade.set_open_order(order)
             self.process_trades['opening'].append(trade)
+            self.journal(trade, 'opening')
         elif order_type == 'limit':
             time_limit = getattr(order_plan, 'time_limit', self.default_order_timeout)
             order_plan.exp_time = time.time() + time_limit
             # Limit order with time constraint
-            trade.order_plan = order_plan
             trade.status = 'waiting'
             # Add the trade to waiting queue
             self.process_trades['waiting'].append(trade)
+            self.journal(trade, 'waiting')
         else:
             # If order type is not market or limit, raise an error
             raise ValueError(f"Unknown order type {order_type} in order plan")        
         return trade
 
-    def close_trade(self, trade:Trade=None, order_plan:OrderPlan=None) -> Union[Trade, list]:
+    def close_trade(self, trade:Trade=None, order_plan:OrderPlan=None, place:bool=True) -> Union[Trade, list]:
         """
         Close trades according to an order plan
         
         Parameters:
         order_plan : OrderPlan
             Order plan with details for closing trades
+        place : bool
+            Place market orders now, or queue them for submit_orders
         Returns:
         Trade or list of Trades
             The closed trade(s)
@@ -704,27 +1175,34 @@ class TradingBot():
                     qty=trade.open_order.amount_out # amount base token
                 )
             else:
-                close_op = order_plan # .copy()  # Create a copy of the order_plan to avoid modifying the original
+                close_op = copy.copy(order_plan)  # one plan per trade, qty differs between trades
                 close_op.qty = trade.open_order.amount_out
 
             # Check if this is a market order or limit order with time constraint
             order_type = getattr(close_op, 'order_type', 'market')
             time_limit = getattr(close_op, 'time_limit', None)
             
-            if order_type == 'market' or time_limit is None:
+            if (order_type == 'market' or time_limit is None) and not place:
+                # Market order - placed with the rest of the cycle in submit_orders
+                self._submit_queue.append((trade, close_op))
+            elif order_type == 'market' or time_limit is None:
                 # Market order - process immediately
                 closed_order = self._broker.place_order(close_op, self)
                 trade.set_close_order(closed_order)
                 # Add to closing process queue
                 self.process_trades['closing'].append(trade)
+                self.journal(trade, 'closing')
             else:
                 # Limit order with time constraint
-                trade.order_plan = order_plan
+                close_op.exp_time = time.time() + time_limit
+                trade.order_plan = close_op
                 trade.order_plan.status = 'waiting'
                 # Add the trade to waiting queue for closing
                 self.process_trades['waiting'].append(trade)
+                self.journal(trade, 'waiting')
             
             # Remove from open_trades
+            self.protection.detach(trade)
             if symbol in self.open_trades and trade in self.open_trades[symbol]:
                 try:
                     self.open_trades[symbol].remove(trade)
@@ -742,9 +1220,13 @@ class TradingBot():
                 action='open',
                 qty=qty,
                 price=price,
-                estimated_amount=estimated_amount
+                estimated_amount=estimated_amount,
+                **kwargs  # order_type, limit, time_limit, tp_price, sl_price, trail_pct, ...
         )
-        self.open_trade(order_plan=order_plan)
+        if self._collecting:
+            self.order_queue.append(order_plan)
+            return None
+        return self.open_trade(order_plan=order_plan)
 
     def sell(self, pair:list, price:float, qty:float=None, estimated_amount=None, **kwargs) -> Trade:
         order_plan = OrderPlan(
@@ -753,10 +1235,15 @@ class TradingBot():
             action='close',
             qty=qty,
             price=price,
-            estimated_amount=estimated_amount
-        )           
-        self.close_trade(order_plan=order_plan)
+            estimated_amount=estimated_amount,
+            **kwargs
+        )
+        if self._collecting:
+            self.order_queue.append(order_plan)
+            return None
+        return self.close_trade(order_plan=order_plan)
     
+    @traced('bot.process_orders')
     def process_orders(self):
         """
         Process orders in the order queue
@@ -773,6 +1260,7 @@ class TradingBot():
             order_queue = list(self.order_queue)  # Create a copy
             print("Processing order queue:", order_queue)
             self.order_queue.clear()  # Clear the queue
+            TRACER.annotate(bot=self.id, plans=len(order_queue))
 
         for order_plan in order_queue:
             if not isinstance(order_plan, OrderPlan):
@@ -780,10 +1268,10 @@ class TradingBot():
                 
             try:
                 if order_plan.action == 'open':
-                    trade = self.open_trade(order_plan=order_plan)
+                    trade = self.open_trade(order_plan=order_plan, place=False)
                     processed_trades.append(trade)
                 elif order_plan.action == 'close':
-                    result = self.close_trade(order_plan=order_plan)
+                    result = self.close_trade(order_plan=order_plan, place=False)
                     # Handle both single trade and list of trades
                     if isinstance(result, list):
                         processed_trades.extend(result)
@@ -795,8 +1283,136 @@ class TradingBot():
                 print(f"Error processing order plan: {e}")
                 # Continue with next order
 
+        # place every market order of the queue at once
+        self.submit_orders()
         return processed_trades
+
+    def submit_orders(self, flush:bool=False) -> list[Trade]:
+        """
+        Place all market orders queued by open_trade/close_trade(place=False) concurrently through the broker
+        Plans of the same pair are netted first: one swap for the remainder, allocated back to every trade
+        Failed orders are rolled back: cash is returned to the fund, trades to close go back to open_trades
+        Parameters:
+        flush : bool
+            Place plans still inside their netting window too
+        Returns
+        list
+            Trades with a submitted order
+        """
+        if len(self._submit_queue) == 0:
+            return []
+        jobs, self._submit_queue = self._submit_queue, []
+        groups, held = self.netter.split(jobs, flush=flush)
+        for trade, order_plan in held:
+            if not getattr(trade, 'queued', False):
+                trade.queued, trade.queued_plan = True, order_plan
+                self.journal(trade, 'queued')
+        self._submit_queue = held
+
+        # fully crossed pairs fill internally at the current quote, no swap at all
+        for group in [g for g in groups if g['netted'] and g['plan'] is None]:
+            try:
+                group['price'] = self._broker.get_price(group['pair'])
+            except Exception as e:
+                print(f"Could not get price for {group['pair']}, placing its plans one by one: {e}")
+                groups.remove(group)
+                groups += [self.netter.single(*job) for job in group['jobs']]
+
+        # signal time of the plans: when the strategy returned them, else now (protective exits)
+        now = time.time()
+        for trade, order_plan in [job for g in groups for job in g['jobs']]:
+            self.critical_path.mark(trade.id, order_plan.action, 'signal', at=getattr(order_plan, 'signal_at', None) or now,
+                                    pair='/'.join(order_plan.pair))
+
+        placing = [g for g in groups if g['plan'] is not None]
+        orders = self._broker.place_orders([g['plan'] for g in placing], self)
+        for group, order in zip(placing, orders):
+            group['order'] = order
+
+        submitted = []
+        for group in groups:
+            order = group.get('order')
+            if group['plan'] is not None and order is None:
+                for trade, order_plan in group['jobs']:
+                    print(f"Order not placed, rollback {order_plan}")
+                    self._rollback_submit(trade, order_plan)
+                continue
+            total = sum(op.qty for _, op in group['jobs']) if group['netted'] else 0
+            for trade, order_plan in group['jobs']:
+                if group['netted']:
+                    order = AllocatedOrder(
+                        id=str(ulid.new()),
+                        category=self.category,
+                        pair=order_plan.pair,
+                        side=order_plan.side,
+                        broker=self._broker,
+                        parent=group.get('order'),
+                        alloc_qty=order_plan.qty,
+                        cross_price=group.get('price'),
+                        fee_share=order_plan.qty / total,
+                        estimated_amount=getattr(order_plan, 'estimated_amount', None),
+                    )
+                trade.queued, trade.queued_plan = False, None
+                self.critical_path.mark(trade.id, order_plan.action, 'submitted', tx=getattr(group.get('order'), 'tx', None))
+                EVENTS.order_submitted(self.id, trade.id, order_plan.action, order)
+                if order_plan.action == 'open':
+                    trade.set_open_order(order)
+                    self.process_trades['opening'].append(trade)
+                    self.journal(trade, 'opening')
+                else:
+                    trade.set_close_order(order)
+                    self.process_trades['closing'].append(trade)
+                    self.journal(trade, 'closing')
+                submitted.append(trade)
+        return submitted
+
+    def _rollback_submit(self, trade:Trade, order_plan:OrderPlan) -> None:
+        self.critical_path.discard(trade.id, order_plan.action)
+        if order_plan.action == 'open':
+            token = order_plan.pair[1] if order_plan.side == 'buy' else order_plan.pair[0]
+            estimated_amount = getattr(order_plan, 'estimated_amount', 0) or 0
+            if token in self.fund:
+                self.fund[token]['pending'] -= estimated_amount
+                self.fund[token]['cash'] += estimated_amount
+            trade.status = 'cancelled'
+            self.journal(trade, 'cancelled')
+        else:
+            symbol = trade.open_order.symbol
+            self.open_trades.setdefault(symbol, []).append(trade)
+            self.protect(trade)
+            self.journal(trade, 'open')
         
+    def bar_due(self, now:float=None) -> bool:
+        """
+        Whether a strategy cycle can find a new final candle now, time arithmetic only (no API or RPC call)
+        A candle opened at t is final at t + interval, so after the one at last the next is final at last + 2 * interval
+        Strategies without an interval run at most once a minute
+        """
+        now = now or time.time()
+        if self._settlement_due(now):
+            return True
+        interval = interval_seconds(getattr(self.strategy, 'interval', None))
+        if not interval:
+            return now - self._last_cycle >= 60
+        symbols = [t + self.currency for t in self.tokens]
+        if any(symbol not in self._bars for symbol in symbols):
+            return True
+        return now >= min(self._bars[symbol] for symbol in symbols) + 2 * interval
+
+    def _settlement_due(self, now:float) -> bool:
+        """
+        Whether the vault is past its stop time and not settled yet, from the cached vault state (no RPC):
+        the settlement steps then run on every tick instead of waiting for the next bar,
+        except after a run that gave up (see VaultSettlement.retry_after)
+        """
+        vault = getattr(self, 'vault', None)
+        cache = getattr(self._broker, 'vault_states', {}).get(getattr(vault, 'address', None))
+        state = getattr(cache, 'state', None)
+        if not state or state['vault_closed'] or now < state['stop_timestamp']:
+            return False
+        settlement = self.settlement or {}
+        return settlement.get('stage') != 'done' and now >= settlement.get('retry_at', 0)
+
     def run(self):
         """
         Run the strategy
@@ -805,6 +1421,8 @@ class TradingBot():
         list
             Processed trades
         """
+        self.prepare()
+        self._last_cycle = time.time()
         if self.strategy is None:
             raise ValueError("Strategy is not set")
         if not isinstance(self.strategy, Strategy):
@@ -830,10 +1448,11 @@ class TradingBot():
 
         # Get data
         try:
-            data = self.strategy.get_data(
-                tokens=self.tokens, 
-                currency=self.currency,
-            )
+            with TRACER.span('strategy.get_data', bot=self.id, tokens=','.join(self.tokens)):
+                data = self.strategy.get_data(
+                    tokens=self.tokens, 
+                    currency=self.currency,
+                )
         except Exception as e:
             print(f"Error getting market data: {e}")
             return []
@@ -847,25 +1466,49 @@ class TradingBot():
                 print(f"No data for symbol {symbol}: please check your strategy.get_data() implementation")
                 continue
             pair = [self.currency, t]
+            if 'close' in df.columns:
+                self._marks[symbol] = float(df['close'].iloc[-1])
+            # run once per final candle: the same bar never gives the same signal twice
+            bar = self.strategy.bar_time(df)
+            if bar is not None:
+                if bar <= self._bars.get(symbol, 0):
+                    print(f"No new {symbol} candle since {self._bars[symbol]}, strategy not run")
+                    continue
+                self._bars[symbol] = bar
             if self.call_budget < 1:
                 budget = self.fund[t]['cash'] * self.call_budget
             else:
                 budget = self.call_budget
                 
-            # run strategy to get order_queue
-            # order_plan = 
-            self.strategy.run(
-                pair,
-                df,
-                budget=budget,
-                bot=self
-            )
-            # if order_plan is not None:
-            #     if isinstance(order_plan, OrderPlan):
-            #         self.order_queue.append(order_plan)
-            #     else:
-            #         raise TypeError("Order plan must be an instance of OrderPlan class")
-        # process order_queue
+            # run strategy to get order_queue, bot.buy / bot.sell only queue plans here
+            self._collecting = True
+            queued = len(self.order_queue)
+            try:
+                with TRACER.span('strategy.run', bot=self.id, pair=symbol, bar=bar) as span:
+                    order_plan = self.strategy.run(
+                        pair,
+                        df,
+                        budget=budget,
+                        bot=self
+                    )
+                    span.set(signals=len(self.order_queue) - queued + (order_plan is not None))
+            finally:
+                self._collecting = False
+            # start of the critical path of the orders of this signal
+            signal_at = time.time()
+            for plan in self.order_queue[queued:]:
+                plan.signal_at = signal_at
+                EVENTS.signal(self.id, symbol, plan)
+            if order_plan is not None:
+                if isinstance(order_plan, OrderPlan):
+                    order_plan.signal_at = signal_at
+                    EVENTS.signal(self.id, symbol, order_plan)
+                    self.order_queue.append(order_plan)
+                else:
+                    raise TypeError("Order plan must be an instance of OrderPlan class")
+        # exits due now join the cycle's submission, so they net against new entries of the same pair
+        self.check_protection(submit=False)
+        # process order_queue: plans of all tokens are placed together
         return self.process_orders()
 
  
\ No newline at end of file
@@ -1,54 +1,81 @@
+from __future__ import annotations
+from lib.startup import StartupProfile, warm_up, load_yaml
+startup = StartupProfile()  # timing breakdown printed when the scheduler starts
 from datetime import datetime
-from web3 import Web3
-import sys, time, yaml, requests
-from apscheduler.schedulers.blocking import BlockingScheduler
-import pandas as pd
-import talib
+from typing import TYPE_CHECKING
+import sys, time
+# web3, pandas, talib, requests and apscheduler are imported where they are used,
+# so the process reaches the scheduler before paying for them
+if TYPE_CHECKING:
+    import pandas as pd
 from db import init_db
-from lib.trading_v1 import Order, Trade, TradingBot, Strategy,OrderPlan
+from lib.trading import Order, Trade, TradingBot, Strategy,OrderPlan
 # from lib.broker.dex.bsc_pancake import PancakeBroker
-from lib.broker.dex.hedera_swap import SwapBroker
-from db.connection import get_engine, get_session
+from lib.runtime import BotRuntime, CandleCache, load_bot_definitions, interval_seconds
+from lib.metrics import METRICS, serve_metrics
+from lib.tracing import TRACER, configure_tracing
+from lib.events import EVENTS, configure_events
+from lib.profiler import configure_profiler
+from db.connection import get_engine
+from db.writer import get_writer
+startup.mark('imports')
 
-with open('configs/hedera_chain.yaml', 'r') as file:
-    chain_info = yaml.safe_load(file)
+def load_chain_info() -> dict:
+    # parsed once, on first use (the ABIs make it the largest file read at startup)
+    return load_yaml('configs/hedera_chain.yaml')
 
 
 class MyStrategy(Strategy):
-    def __init__(self, interval:str, db_engine):
+    def __init__(self, interval:str, db_engine, pool:str='0xc5b707348da504e9be1bd4e21525459830e7b11d', candle_cache:CandleCache=None):
         # order -> add parent trade id | state new / open / closed
         self.order_queue = []
 
         super().__init__(
             interval=interval,
-            db_engine=db_engine)
+            db_engine=db_engine,
+            pool=pool,  # GeckoTerminal pool address of the traded pair
+            candle_cache=candle_cache)  # shared between bots in fleet mode
         
     # === customize this function to fetch data from your database or API ===
     def get_data(self, tokens: list, currency: str) -> pd.DataFrame:
         """
         Get market data for the given tokens
         """
+        import pandas as pd
+        import talib
         current = int(time.time()) + 5
-        # WHBAR/USDC
-        api_url = f"https://api.geckoterminal.com/api/v2/networks/hedera-hashgraph/pools/0xc5b707348da504e9be1bd4e21525459830e7b11d/ohlcv/minute?aggregate=5&before_timestamp={current}&limit=60&include_empty_intervals=true"
+        # WHBAR/USDC by default
+        api_url = f"https://api.geckoterminal.com/api/v2/networks/hedera-hashgraph/pools/{self.pool}/ohlcv/minute?aggregate=5&before_timestamp={current}&limit=60&include_empty_intervals=true"
         rsi_period = 14
 
-        response = requests.get(api_url)
-        if response.status_code != 200:
-            raise Exception(f"Error {response.status_code}: {response.text}")
+        with TRACER.span('strategy.fetch', pool=self.pool, cached=self.candle_cache is not None):
+            if self.candle_cache is not None:
+                raw_data = self.candle_cache.get(api_url, key=(self.pool, self.interval))
+            else:
+                import requests
+                from lib.cassette import CASSETTE
+                response = CASSETTE.mount(requests.Session()).get(api_url)
+                if response.status_code != 200:
+                    raise Exception(f"Error {response.status_code}: {response.text}")
+                raw_data = response.json()
 
         # Parse OHLCV
-        raw_data = response.json()
         candles = raw_data.get("data", {}).get("attributes", {}).get("ohlcv_list", [])
 
-        # Create DataFrame
-        df = pd.DataFrame(candles, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-        df[['open', 'high', 'low', 'close', 'volume']] = df[['open', 'high', 'low', 'close', 'volume']].astype(float)
+        # keep final candles only, the one still forming changes until it closes
+        interval = interval_seconds(self.interval) or 300
+        candles = [c for c in candles if c[0] + interval <= time.time()]
 
-        # Calculate RSI
-        df[f'RSI_{rsi_period}'] = talib.RSI(df['close'], timeperiod=rsi_period)
-        df['symbol'] = tokens[0]+currency  # Assuming single token for simplicity
+        with TRACER.span('strategy.indicators', candles=len(candles)):
+            # Create DataFrame
+            df = pd.DataFrame(candles, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+            df = df.sort_values('timestamp').reset_index(drop=True)  # the API lists the newest candle first
+            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
+            df[['open', 'high', 'low', 'close', 'volume']] = df[['open', 'high', 'low', 'close', 'volume']].astype(float)
+
+            # Calculate RSI
+            df[f'RSI_{rsi_period}'] = talib.RSI(df['close'], timeperiod=rsi_period)
+            df['symbol'] = tokens[0]+currency  # Assuming single token for simplicity
         return df
 
     # === customize this function to run your trading strategy ===
@@ -75,200 +102,66 @@ class MyStrategy(Strategy):
         return None
 
 # === Run the bot ===
+# The cycle functions below are generators: `yield seconds` replaces time.sleep(seconds),
+# BotRuntime resumes them after the wait without holding a worker (see BotRuntime),
+# so bot.lock is only taken around the steps, never across a yield.
 def bot_run(bot: TradingBot):
-    bot.run()
-    bot.checking_orders()
-    num_process_trade = sum([len(v) for k, v in bot.process_trades.items()])
+    with bot.lock:
+        bot.run()
+        bot.checking_orders()
+        num_process_trade = sum([len(v) for k, v in bot.process_trades.items()])
     if num_process_trade > 0:
-        print(f"Processing {num_process_trade} trades: {bot.process_trades}")
+        EVENTS.emit('processing', 'info', bot=bot.id, trades=num_process_trade)
     i = 0
     while i < 3 and num_process_trade > 0:
-        bot.checking_orders()
-        num_process_trade = sum([len(v) for k, v in bot.process_trades.items()])
+        with bot.lock:
+            bot.checking_orders()
+            num_process_trade = sum([len(v) for k, v in bot.process_trades.items()])
         i += 1
-        time.sleep(5)
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print('Time', now, " - process trades: ",bot.checking_orders(), "open trades: ", bot.open_trades, "history trades: ", bot.history_trades)
+        yield 5
+    with bot.lock:
+        # equity / PnL rollups of the cycle, queued with the orders and trades
+        try:
+            bot.mark_equity()
+        except Exception as e:
+            print(f"Error marking equity: {e}")
+        # compact the journal of this cycle into a snapshot
+        if bot.state_store is not None and bot.state_store.records_since_snapshot > 0:
+            bot.save_state()
+        # write the cycle's orders and trades in one transaction, in the background
+        get_writer().flush()
+        # counts only, the event stays the same size however long the history grows
+        process = bot.checking_orders()
+        EVENTS.emit('cycle', 'info', bot=bot.id, process={k: len(v) for k, v in process.items()},
+                    open={k: len(v) for k, v in bot.open_trades.items() if v},
+                    closed=bot.history_trades.closed, profit=bot.history_trades.profit)
 
-def get_vault_state(vault_contract):
-    """Get vault state from vault contract"""
+def get_vault_state(bot):
+    """Get vault state from the broker vault cache (one batched read, refreshed on vault events)"""
     try:
-        # Get vault state to check if it's active
-        vault_state = vault_contract.functions.getVaultState().call()
-        # Get run and stop timestamps from vault contract
-        run_timestamp = vault_contract.functions.runTimestamp().call()
-        stop_timestamp = vault_contract.functions.stopTimestamp().call()
-        
-        state = {
-            "total_shares": vault_state[0],
-            "total_balance" : vault_state[1],
-            "shareholder_count" : vault_state[2],
-            "deposits_closed" : vault_state[3],
-            "vault_closed" : vault_state[4],
-            "run_timestamp" : run_timestamp,
-            "stop_timestamp" : stop_timestamp
-        } 
-        return state
+        return bot._broker.get_vault_state(bot).get()
     except Exception as e:
         print(f"Error getting vault state: {e}")
         return None
 
-def close_all_trades(bot, trade_token, currency):
-    """Close all open trades/orders for the given token pair"""
-    print(f"Closing all open trades for {trade_token}/{currency}")
-    
-    # Create symbol in the format expected by the bot (currency + trade_token)
-    symbol = currency + trade_token
-    
-    # Check if there are open trades for this symbol
-    open_trades = bot.open_trades.get(symbol, [])
-    if not open_trades:
-        print("No open trades to close")
-        return True
-    
-    print(f"Found {len(open_trades)} open trades to close")
-    
-    # Close all open trades by selling
-    try:
-        print(f"Closing trade {trade_token}")
-        # Use the pair format [currency, trade_token] as expected by the bot
-        bot.sell(pair=[currency, trade_token], price=0)  # Market order to close
-    except Exception as e:
-        print(f"Error closing trade: {e}")
-    
-    return False  # Return False if there were trades to close
-
-def wait_for_orders(bot, max_wait=60):
-    """Wait for all orders to close or fail"""
-    print("Waiting for orders to complete...")
-    start_time = time.time()
-    
-    while time.time() - start_time < max_wait:
-        # Check orders status
-        bot.checking_orders()
-        
-        # Count open trades
-        total_open = sum([len(v) for k, v in bot.open_trades.items()])
-        
-        if total_open == 0:
-            print("All orders completed successfully")
-            return True
-        
-        print(f"Still waiting... {total_open} open trades remaining")
-        time.sleep(5)
-    
-    print(f"Timeout waiting for orders after {max_wait} seconds")
-    return False
-
-def swap_remaining_tokens(bot, trade_token, currency):
-    """Swap all remaining token2 (trade_token) to token1 (currency)"""
-    print(f"Swapping remaining {trade_token} to {currency}")
-    
-    try:
-        # Check vault balance of trade_token using broker's check_balance method
-        balance, pending = bot._broker.check_balance(bot)
-        
-        # Get the specific token balance from bot's token balance
-        token2_balance = bot._token_balance.get(trade_token, {}).get('qty', 0)
-        if token2_balance > 0:
-            token2_balance = bot._broker.from_wei(trade_token, token2_balance)
-        
-        print(f"Vault {trade_token} balance: {token2_balance}")
-        
-        if token2_balance <= 0:
-            print(f"No {trade_token} to swap")
-            return True
-        
-        # Get current price for swap
-        current_price = bot._broker.get_price([trade_token, currency])
-        print(f"Current {trade_token}/{currency} price: {current_price}")
-        
-        # Swap all remaining token2 to token1
-        swap_amount = token2_balance * 0.99  # Leave small amount for gas
-        print(f"Swapping {swap_amount} {trade_token} to {currency}")
-        
-        # Convert to wei for the swap
-        swap_amount_wei = bot._broker.to_wei(trade_token, swap_amount)
-        
-        # Execute swap through vault using path format
-        result = bot._broker.swap_exact_in(
-            bot=bot,
-            path=[trade_token, currency],  # Use path format as required by the broker
-            amount_in=swap_amount_wei,
-            amount_out_min=0  # No slippage protection for closing
-        )
-        
-        print(f"Swap transaction: {result}")
-        return True
-        
-    except Exception as e:
-        print(f"Error swapping remaining tokens: {e}")
-        return False
-
 def vault_withdraw(bot, trade_token, currency):
-    """Execute vault withdrawal sequence"""
-    # check vault state
-    vault_state = bot.vault.functions.getVaultState().call()
-    if vault_state[4]:  # is closed
-        print("Vault is closed, skipping withdraw")
-        return False
-    print("=== Starting vault withdraw sequence ===")
-    
-    # Step 1: Close all open trades/orders
-    print("Step 1: Closing all open trades...")
-    close_all_trades(bot, trade_token, currency)
-    
-    # Step 2: Wait for all orders to close or fail
-    print("Step 2: Waiting for orders to complete...")
-    if not wait_for_orders(bot):
-        print("Warning: Some orders may not have completed")
-    
-    # Step 3: Check vault token2 balance and swap to token1
-    print("Step 3: Swapping remaining tokens...")
-    if not swap_remaining_tokens(bot, trade_token, currency):
-        print("Warning: Failed to swap remaining tokens")
-    
-    # Step 4: Wait for swap transaction receipt
-    print("Step 4: Waiting for swap transaction...")
-    time.sleep(10)  # Wait for transaction to be mined
-    
-    # Step 5: Call vault withdraw
-    print("Step 5: Calling vault withdraw...")
-    try:
-        # Call vault withdraw function directly (only manager can call this)
-        result = bot.vault.functions.withdraw().build_transaction({
-            'from': bot.wallet['address'],
-            'nonce': bot._broker.gateway.eth.get_transaction_count(bot.wallet['address']),
-            'gas': 200_000,  # should scale by number of shareholders
-            'gasPrice': bot._broker.gateway.eth.gas_price
-        })
-        
-        # Sign and send transaction
-        signed_txn = bot._broker.gateway.eth.account.sign_transaction(result, bot.wallet['private'])
-        tx_hash = bot._broker.gateway.eth.send_raw_transaction(signed_txn.raw_transaction)
-        
-        print(f"Vault withdraw transaction sent: {tx_hash.hex()}")
-        
-        # Wait for receipt
-        # receipt = bot._broker.gateway.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
-        # print(f"Vault withdraw completed: {receipt}")        
-        return True
-        
-    except Exception as e:
-        print(f"Error calling vault withdraw: {e}")
-        return False
+    """
+    Execute vault withdrawal sequence: close trades, swap the remaining token, withdraw, each step on confirmed
+    receipts (see lib/settlement.py), yields the seconds to wait between its steps (use with yield from)
+    """
+    from lib.settlement import VaultSettlement
+    return (yield from VaultSettlement(bot, trade_token, currency).run())
 
 def bot_run_with_vault_check(bot, trade_token, currency):
-    """Run bot with vault time checking logic"""
+    """Run bot with vault time checking logic, a generator driven by BotRuntime"""
     try:
         # Get vault timestamps
-        vault_state = get_vault_state(bot.vault)
+        vault_state = get_vault_state(bot)
         if vault_state is None:
             print("Could not get vault state, skipping execution")
             return
         
         current_time = int(time.time())
-        print(f"Current time: {datetime.fromtimestamp(current_time)}")
         
         # Check if we should run the bot
         if current_time < vault_state['run_timestamp']:
@@ -276,41 +169,213 @@ def bot_run_with_vault_check(bot, trade_token, currency):
             return
         elif current_time >= vault_state['stop_timestamp']:
             print(f"After stop time ({datetime.fromtimestamp(vault_state['stop_timestamp'])}), executing vault withdrawal")
-            vault_withdraw(bot, trade_token, currency)
+            yield from vault_withdraw(bot, trade_token, currency)
             return
         else:
-            print(f"During run time, executing normal bot operations")
-            print(f"Vault state: {vault_state}")
-            bot.update_balance()
-            bot.update_fund()
-            bot_run(bot)
+            if bot.settlement:
+                bot.settlement.clear()  # vault renewed, a new settlement starts at its next stop
+            EVENTS.emit('vault_state', 'debug', bot=bot.id, **vault_state)
+            # monitor_tick skips while a step of the cycle holds the bot
+            with bot.lock:
+                bot.update_balance()
+                bot.update_fund()
+            yield from bot_run(bot)
             
     except Exception as e:
+        # the runtime counts the failed cycle (and pauses the bot after max_errors), the other bots keep running
         print(f"Error in bot run with vault check: {e}")
-        sys.exit(1)
+        raise
+
+def monitor_tick(bot):
+    """
+    Light tick between strategy cycles: follow orders in process, trigger take profit / stop loss / trailing stop exits
+    and place netted orders whose window is over. Does nothing (no RPC) when the bot has nothing in flight.
+    """
+    in_process = sum(len(v) for v in bot.process_trades.values())
+    if (in_process == 0 and len(bot.protection) == 0 and len(bot._submit_queue) == 0) or not bot.lock.acquire(blocking=False):
+        return
+    try:
+        if in_process:
+            bot.checking_orders()
+        if len(bot.protection) or len(bot._submit_queue):
+            bot.check_protection(submit=False)
+            bot.submit_orders()
+    except Exception as e:
+        print(f"Error monitoring orders: {e}")
+    finally:
+        bot.lock.release()
 
 def renew_vault_state(bot, deposit_time:int=3600, live_time:int=7200, max_shareholders:int=50):
-    """Update vault state"""
-    block = bot._broker.gateway.eth.get_block('latest')
-    update_txn = bot.vault.functions.updateVault(
-        bot.currency,
-        bot.trade_token,
-        block['timestamp'] + deposit_time,                        # runTimestamp
-        block['timestamp'] + live_time,                        # stopTimestamp
-        max_shareholders                                                # maxShareholders
-    ).build_transaction({
-        'from': bot.wallet['address'],
-        'nonce': bot._broker.gateway.eth.get_transaction_count(bot.wallet['address']),
-        'gas': 100_000,
-        'gasPrice': bot._broker.gateway.eth.gas_price
-    })
-    signed_txn = bot._broker.gateway.eth.account.sign_transaction(update_txn, bot.wallet['private'])
-    tx_hash = bot._broker.gateway.eth.send_raw_transaction(signed_txn.raw_transaction)
-    print(f"Vault update transaction sent: {tx_hash.hex()}")
-    return tx_hash.hex()
+    """Update vault state, through the same pipeline as fleet renewals (see VaultFleet.renew)"""
+    from lib.broker.dex.vault_fleet import VaultFleet
+    fleet = VaultFleet(bot._broker)
+    fleet.add(bot, renew={'deposit_time': deposit_time, 'live_time': live_time, 'max_shareholders': max_shareholders})
+    tx_hash = fleet.renew([bot.vault.address]).get(bot.vault.address)
+    print(f"Vault update transaction sent: {tx_hash}")
+    bot._broker.get_vault_state(bot).invalidate()
+    return tx_hash
+
+def build_fleet(config:dict, runtime:BotRuntime, lazy:bool=False):
+    """
+    Create the shared broker and every bot of config, each bot joins runtime as soon as it is built
+    Returns the broker
+    """
+    from web3 import Web3
+    from lib.broker.dex.hedera_swap import SwapBroker
+
+    chain = load_chain_info().get(config.get('network', 'mainnet'), {})
+    init_db()
+    broker = SwapBroker(
+        rpcs=chain.get('rpcs'),
+        ecosystem_token=config.get('ecosystem_token', 'WHBAR'),
+        contract_info=chain.get('contracts'),
+        abi_url='',
+        pool_size=runtime.max_workers * 2,
+        max_impact=config.get('max_impact'),
+        lazy=lazy,
+    )
+    engine = get_engine()
+    candle_cache = CandleCache(ttl=float(config.get('candle_ttl', 30)))
+    vault_abi = chain.get('contracts').get('vault')[1]
+
+    for d in config['bots']:
+        trade_token = str(d.get('token', 'WHBAR')).upper()
+        currency = str(d.get('currency', 'USDC')).upper()
+        try:
+            strat = MyStrategy(
+                interval=d.get('interval', '5m'),
+                db_engine=engine,
+                pool=d.get('pool', '0xc5b707348da504e9be1bd4e21525459830e7b11d'),
+                candle_cache=candle_cache)
+            vault = broker.gateway.eth.contract(
+                address=Web3.to_checksum_address(d.get('vault') or chain.get('contracts').get('vault')[0]),
+                abi=vault_abi
+            )
+            bot = TradingBot(
+                id=d['id'],
+                tokens=[trade_token],
+                currency=currency,
+                call_budget=float(d.get('call_budget', 0.5)),
+                invest_amount=float(d.get('invest_amount', 1)),
+                balance=None,
+                broker=broker,
+                category='spot',
+                strategy=strat,
+                wallet=chain.get('wallet', {}),
+                vault=vault,
+                state_dir=config.get('state_dir', 'state'),
+                net_window=float(d.get('net_window', 0)),
+                lazy=lazy,
+            )
+        except Exception as e:
+            # a broken definition must not stop the rest of the fleet
+            print(f"Could not start bot {d.get('id')}: {e}")
+            continue
+        runtime.add_bot(bot, trade_token=trade_token, currency=currency)
+        print(f"Bot {bot.id} added: {trade_token}/{currency} vault {vault.address}")
+    return broker
+
+def run_fleet(config_path:str):
+    """
+    Run every bot/vault defined in config_path in this process.
+    All bots share one broker (web3 gateway, path and decimal caches), one candle cache and one DB engine,
+    their cycles are scheduled together on a bounded worker pool.
+    With lazy_start (default) the scheduler starts first, the broker, bots and caches are built
+    by a background warm-up and each bot joins the cycles once it is ready.
+    """
+    config = load_bot_definitions(config_path)
+    max_workers = int(config.get('max_workers', 4))
+    lazy = bool(config.get('lazy_start', True))
+    runtime = BotRuntime(cycle=bot_run_with_vault_check, max_workers=max_workers, max_errors=int(config.get('max_errors', 5)))
+    METRICS.add_collector(runtime.collect)
+    if config.get('metrics_port'):
+        serve_metrics(config['metrics_port'], profile_token=config.get('profile_token'))
+    configure_tracing(**(config.get('tracing') or {}))
+    configure_events(**(config.get('events') or {}))
+    configure_profiler(**(config.get('profiler') or {}))  # kill -USR2 <pid>, PROFILE_CYCLES or POST /profile (profile_token)
+    if config.get('cassette'):
+        from lib.cassette import configure_cassette
+        configure_cassette(**config['cassette'])  # before the broker and the candle cache open their sessions
+    startup.mark('config')
+
+    fleet = {}
+    def build_vaults():
+        # stop times start settlements right away, settled vaults are renewed in one pipeline
+        from lib.broker.dex.vault_fleet import VaultFleet
+        vaults = VaultFleet(fleet['broker'], renew=config.get('renew'), on_stop=lambda bot: runtime.run_now(bot.id),
+                            sync_interval=float(config.get('vault_poll', 5)))
+        renewals = {d['id']: d.get('renew') for d in config['bots']}
+        for bot_id, slot in list(runtime.bots.items()):
+            vaults.add(slot['bot'], renew=renewals.get(bot_id))
+        fleet['vaults'] = vaults
+
+    if lazy:
+        def build():
+            fleet['broker'] = build_fleet(config, runtime, lazy=True)
+        def caches():
+            pairs = [[slot['kwargs']['currency'], slot['kwargs']['trade_token']] for slot in list(runtime.bots.values())]
+            fleet['broker'].warm_up(pairs)
+        def prepare():
+            for slot in list(runtime.bots.values()):
+                slot['bot'].prepare()
+        warm_up(startup, [('build fleet', build), ('chain caches', caches), ('bot balances', prepare), ('vault fleet', build_vaults)],
+                on_done=lambda: startup.report('Warm-up'))
+    else:
+        fleet['broker'] = build_fleet(config, runtime)
+        build_vaults()
+        startup.mark('build fleet')
+
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    scheduler = BlockingScheduler()
+    try:
+        # cheap poll: a bot only cycles once its next candle can be final (TradingBot.bar_due)
+        scheduler.add_job(
+            runtime.run_cycle,
+            trigger='interval',
+            seconds=float(config.get('bar_poll', 10)),
+            max_instances=1,
+        )
+        scheduler.add_job(
+            lambda: [monitor_tick(slot['bot']) for slot in list(runtime.bots.values())],
+            trigger='interval',
+            seconds=float(config.get('protect_interval', 3)),
+            max_instances=1,
+        )
+        # vault states, stop times, renewals and their receipts of the whole fleet
+        scheduler.add_job(
+            lambda: fleet['vaults'].tick() if 'vaults' in fleet else None,
+            trigger='interval',
+            seconds=float(config.get('vault_poll', 5)),
+            max_instances=1,
+        )
+        # cycle timing: drift, duration, late and merged ticks of every bot, then the costliest rpc calls
+        scheduler.add_job(
+            lambda: (runtime.report(), METRICS.report()),
+            trigger='interval',
+            seconds=float(config.get('report_interval', 900)),
+        )
+        startup.mark('scheduler')
+        startup.report()
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        print("Process interrupted by user.")
+    finally:
+        scheduler.shutdown(wait=False)
+        print("Waiting for running bot cycles to complete…")
+        runtime.shutdown(wait=True)
+        runtime.report()
+        METRICS.report()
+        TRACER.flush()
+        EVENTS.flush()
+        print("All bots stopped. Exiting.")
 
 if __name__ == '__main__':
-    chain = chain_info.get('mainnet', {})  # testnet or 'mainnet'
+    if len(sys.argv) > 1 and sys.argv[1].endswith(('.yaml', '.yml')):
+        # fleet mode: python main.py configs/bots.yaml
+        run_fleet(sys.argv[1])
+        sys.exit(0)
+
+    chain = load_chain_info().get('mainnet', {})  # testnet or 'mainnet'
 
     native_token='HBAR'
     ecosystem_token='WHBAR'  
@@ -330,71 +395,113 @@ if __name__ == '__main__':
         trade_token = 'WHBAR'  # default token to trade
 
     print(f"Trading token: {trade_token}")
+    startup.mark('config')
 
-    init_db()
-    # === Broker ===
-    broker = SwapBroker(
-        rpcs=chain.get('rpcs'),
-        ecosystem_token=ecosystem_token,
-        contract_info=chain.get('contracts'),
-        abi_url='',
-        # router_address=chain.get('contracts').get('router'),
-        # factory_address=chain.get('contracts').get('factory'),
-    )
-    db = get_session()
-    engine = get_engine()
-    # === Setup your strategy ===
-    strat = MyStrategy(
-        interval='5m',
-        db_engine=engine)
-    # === Trading bot ===
-    vault = broker.gateway.eth.contract(
-        address=Web3.to_checksum_address(chain.get('contracts').get('vault')[0]),
-        abi=chain.get('contracts').get('vault')[1]
-    )
-    # print(vault.functions.getVaultState().call())
-
-    bot = TradingBot(
-        id='hedera_bot_v1',
-        tokens=[trade_token], # , 'ETH'
-        currency=currency,
-        call_budget=0.5,
-        invest_amount=1,
-        balance=None,
-        broker=broker,
-        category='spot',
-        strategy=strat,
-        db=db,
-        wallet=chain.get('wallet', {}),
-        vault=vault
-    )
+    # broker, strategy and bot are built by the warm-up thread, the scheduler starts meanwhile
+    # and the bot joins the cycles once it is built. Failed cycles never pause it (max_errors=0).
+    app = {}
+    runtime = BotRuntime(cycle=bot_run_with_vault_check, max_workers=1, max_errors=0)
+    METRICS.add_collector(runtime.collect)
+    import os
+    if os.getenv('METRICS_PORT'):
+        serve_metrics(int(os.getenv('METRICS_PORT')))
+    configure_tracing()  # TRACE_FILE / OTEL_EXPORTER_OTLP_ENDPOINT
+    configure_events()  # EVENT_LOG / EVENT_LEVEL / EVENT_CONSOLE
+    configure_profiler()  # kill -USR2 <pid>, PROFILE_CYCLES or POST /profile on METRICS_PORT (PROFILE_TOKEN)
+    if os.getenv('CASSETTE_FILE'):
+        from lib.cassette import configure_cassette
+        configure_cassette()  # CASSETTE_FILE / CASSETTE_MODE / CASSETTE_SPEED
+
+    def build():
+        app['bot'] = build_bot()
+        runtime.add_bot(app['bot'], trade_token=trade_token, currency=currency)
 
-    # print("bot balance:", bot.invest_amount, bot.balance, bot.pending_money)
+    def build_bot():
+        from web3 import Web3
+        from lib.broker.dex.hedera_swap import SwapBroker
+        init_db()
+        # === Broker ===
+        broker = SwapBroker(
+            rpcs=chain.get('rpcs'),
+            ecosystem_token=ecosystem_token,
+            contract_info=chain.get('contracts'),
+            abi_url='',
+            # router_address=chain.get('contracts').get('router'),
+            # factory_address=chain.get('contracts').get('factory'),
+            lazy=True,
+        )
+        engine = get_engine()
+        # === Setup your strategy ===
+        strat = MyStrategy(
+            interval='5m',
+            db_engine=engine)
+        # === Trading bot ===
+        vault = broker.gateway.eth.contract(
+            address=Web3.to_checksum_address(chain.get('contracts').get('vault')[0]),
+            abi=chain.get('contracts').get('vault')[1]
+        )
+        # print(vault.functions.getVaultState().call())
+
+        bot = TradingBot(
+            id='hedera_bot_v1',
+            tokens=[trade_token], # , 'ETH'
+            currency=currency,
+            call_budget=0.5,
+            invest_amount=1,
+            balance=None,
+            broker=broker,
+            category='spot',
+            strategy=strat,
+            wallet=chain.get('wallet', {}),
+            vault=vault,
+            state_dir='state',  # snapshot + journal, restored on restart
+            lazy=True,
+        )
+        return bot
+
+    def tick():
+        if 'bot' in app:
+            monitor_tick(app['bot'])
 
+    warm_up(startup, [
+        ('build bot', build),
+        ('chain caches', lambda: app['bot']._broker.warm_up([[currency, trade_token]])),
+        ('bot balance', lambda: app['bot'].prepare()),
+    ], on_done=lambda: startup.report('Warm-up'))
 
+    from apscheduler.schedulers.blocking import BlockingScheduler
     # === SCHEDULER === 
     scheduler = BlockingScheduler()
     try:
+        # polled every 10s, the strategy runs once per new final 5m candle (usually 9-10s after the close)
         scheduler.add_job(
-            bot_run_with_vault_check,
-            trigger='cron',
-            # minute='0-55/5',
-            second=20, # thong thuong du lieu 5p co sau 9-10s 
-            kwargs={'bot': bot, 'trade_token': trade_token, 'currency': currency},
+            runtime.run_cycle,
+            trigger='interval',
+            seconds=10,
+            max_instances=1,
         )
+        # order follow-up and tp / sl / trailing checks about once per block
+        scheduler.add_job(
+            tick,
+            trigger='interval',
+            seconds=3,
+        )
+        startup.mark('scheduler')
+        startup.report()
         scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        print("Process interrupted by user.")
     except Exception as e:
-        if isinstance(e, KeyboardInterrupt):
-            print("Process interrupted by user.")
-        else:
-            print(f"An error occurred: {e}")
-
+        print(f"An error occurred: {e}")
+    finally:
         print("Shutting down scheduler…")
         scheduler.shutdown(wait=False)  # stop scheduling new runs
-        # Wait for running jobs to finish
-        while scheduler.get_jobs():
-            print(f"Waiting for {len(scheduler.get_jobs())} jobs to complete…")
-            time.sleep(1)
+        # Wait for the running cycle to finish
+        runtime.shutdown(wait=True)
+        runtime.report()
+        METRICS.report()
+        TRACER.flush()
+        EVENTS.flush()
         print("All jobs done. Exiting.")
-        sys.exit(0)
+    sys.exit(0)
 
@@ -0,0 +1,49 @@
+from eth_account import Account
+from web3 import Web3
+from bench.mock_node import MockChain, MockNode, ERC20_ABI
+from lib.broker.dex.balance_ledger import BalanceLedger
+
+
+def _transfer(w3, chain, wallet, token, to, amount):
+    contract = w3.eth.contract(address=token, abi=ERC20_ABI)
+    txn = contract.functions.transfer(to, amount).build_transaction({
+        'from': wallet.address, 'nonce': w3.eth.get_transaction_count(wallet.address),
+        'gas': 200_000, 'gasPrice': w3.eth.gas_price, 'chainId': chain.chain_id,
+    })
+    signed = w3.eth.account.sign_transaction(txn, private_key=wallet.key)
+    return w3.eth.send_raw_transaction(signed.raw_transaction)
+
+
+def _setup():
+    chain = MockChain()
+    token = Web3.to_checksum_address(chain.add_token('USDC', 6))
+    wallet, vault = Account.create(), Account.create().address
+    chain.mint('USDC', wallet.address, 1_000)
+    chain.mint('USDC', vault, 2_000)
+    node = MockNode(chain).start()
+    w3 = Web3(Web3.HTTPProvider(node.url))
+    ledger = BalanceLedger(w3, vault, {'USDC': [token, ERC20_ABI]})
+    return chain, node, w3, wallet, vault, token, ledger
+
+
+def test_receipt_of_tx_covered_by_seed_is_not_applied_twice():
+    chain, node, w3, wallet, vault, token, ledger = _setup()
+    try:
+        ledger.seed()
+        tx = _transfer(w3, chain, wallet, token, vault, 1_000_000)  # mined after the first seed
+        ledger.reconcile()  # rescan at a block that already includes the tx
+        ledger.apply_receipt(w3.eth.get_transaction_receipt(tx))
+        assert ledger.get('USDC') == int(chain.balance('USDC', vault) * 10 ** 6) == 2_001_000_000
+    finally:
+        node.stop()
+
+
+def test_receipt_mined_after_seed_is_applied():
+    chain, node, w3, wallet, vault, token, ledger = _setup()
+    try:
+        ledger.seed()
+        tx = _transfer(w3, chain, wallet, token, vault, 1_000_000)
+        assert ledger.apply_receipt(w3.eth.get_transaction_receipt(tx))
+        assert ledger.get('USDC') == 2_001_000_000
+    finally:
+        node.stop()
@@ -0,0 +1,22 @@
+import json
+from lib.cassette import Cassette
+
+
+def _call(to, data):
+    return json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': 'eth_call', 'params': [{'to': to, 'data': data}, 'latest']})
+
+
+def test_replay_matches_contract_and_function_before_method(tmp_path):
+    path = str(tmp_path / 'rpc.jsonl.gz')
+    recorder = Cassette().load(path, 'record')
+    recorder.record('POST', 'http://node', _call('0xA', '0x70a08231' + '11' * 32), 200, {}, '"balance"', 0.01)
+    recorder.record('POST', 'http://node', _call('0xB', '0x0902f1ac'), 200, {}, '"reserves"', 0.01)
+    recorder.close()
+
+    cassette = Cassette().load(path, 'replay')
+    assert cassette.play('POST', 'http://node', _call('0xA', '0x70a08231' + '11' * 32))['response'] == '"balance"'
+    # a poll of the same call repeats it, it does not take the next eth_call of the recording
+    assert cassette.play('POST', 'http://node', _call('0xA', '0x70a08231' + '11' * 32))['response'] == '"balance"'
+    # other arguments: same contract and selector only
+    assert cassette.play('POST', 'http://node', _call('0xA', '0x70a08231' + '22' * 32))['response'] == '"balance"'
+    assert cassette.play('POST', 'http://node', _call('0xB', '0x0902f1ac'))['response'] == '"reserves"'
@@ -0,0 +1,51 @@
+import pytest
+from bench.run import Bench
+from lib.trading import AllocatedOrder, OrderPlan, ScheduledOrder
+
+
+@pytest.fixture(scope='module')
+def bench():
+    bench = Bench()
+    yield bench
+    bench.node.stop()
+
+
+def _reverted_swap(bench):
+    # the router reverts on an output minimum no pool can pay
+    plan = OrderPlan(action='slice', side='sell', pair=['USDC', 'WHBAR'], order_type='market', qty=10., amount_out_min=10 ** 30)
+    return bench.broker.place_swap(plan, bench.bot)
+
+
+def _parent(bench, target_qty=20.):
+    return ScheduledOrder(id='parent', category='spot', pair=['USDC', 'WHBAR'], side='sell', broker=bench.broker,
+                          target_qty=target_qty, schedule={'placed_qty': 0., 'sent': 0, 'failures': 0})
+
+
+def test_reverted_swap_is_rejected(bench):
+    order = _reverted_swap(bench)
+    bench.broker.update_order(order)
+    assert order.status == 'Rejected'
+    assert order.amount_in is None
+
+
+def test_parent_of_reverted_slices_is_cancelled(bench):
+    parent = _parent(bench)
+    parent.add_child(_reverted_swap(bench), 10.)
+    parent.finish(cancelled=True)
+    assert parent.status == 'Cancelled'
+    share = AllocatedOrder(id='share', category='spot', pair=['USDC', 'WHBAR'], side='sell', broker=bench.broker,
+                           parent=parent, alloc_qty=5.)
+    assert share.status == 'Cancelled'
+
+
+def test_allocation_of_partial_parent_is_pro_rated(bench):
+    parent = _parent(bench)
+    plan = OrderPlan(action='slice', side='sell', pair=['USDC', 'WHBAR'], order_type='market', qty=5.)
+    parent.add_child(bench.broker.place_swap(plan, bench.bot), 5.)
+    parent.add_child(_reverted_swap(bench), 10.)
+    parent.finish(cancelled=True)
+    assert parent.status == 'PartiallyFilledCanceled'
+    share = AllocatedOrder(id='share', category='spot', pair=['USDC', 'WHBAR'], side='sell', broker=bench.broker,
+                           parent=parent, alloc_qty=8.)
+    assert share.status == 'PartiallyFilledCanceled'
+    assert share.qty == pytest.approx(8. * parent.filled_qty / 20.)
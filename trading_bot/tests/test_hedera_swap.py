@@ -0,0 +1,21 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.run import Bench
+
+
+def test_concurrent_swaps_of_a_token_approve_what_they_need_together():
+    # receipts come late: an approve sent by one swap is not on chain when the next one checks the allowance
+    bench = Bench(confirm_delay=0.3)
+    broker = bench.broker
+    try:
+        with ThreadPoolExecutor(4) as pool:
+            txs = list(pool.map(lambda _: broker.swap_exact_in(bench.bot, ['USDC', 'WHBAR'], 100 * 10 ** 6), range(4)))
+        receipts = []
+        for tx in txs:
+            while (receipt := broker.get_receipt(tx)) is None:
+                time.sleep(0.05)
+            receipts.append(receipt)
+        assert [r['status'] for r in receipts] == [1] * 4
+        assert not broker._allowance_txs
+    finally:
+        bench.node.stop()
@@ -0,0 +1,103 @@
+import threading, time
+from types import SimpleNamespace
+from lib.profiler import PROFILER
+from lib.runtime import BotRuntime
+
+
+def _until(check, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not check():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_one_cycle_in_flight_second_tick_queued_third_merged():
+    release, calls = threading.Event(), []
+
+    def cycle(bot):
+        calls.append(time.time())
+        release.wait(5)
+
+    runtime = BotRuntime(cycle, max_workers=2)
+    runtime.add_bot(SimpleNamespace(id='bot_1'))
+    try:
+        assert len(runtime.run_cycle()) == 1
+        _until(lambda: len(calls) == 1)
+        assert runtime.run_cycle() == []  # queued
+        assert runtime.run_cycle() == []  # merged into the queued one
+        status = runtime.status()['bot_1']
+        assert (status['running'], status['skipped'], status['merged']) == (True, 2, 1)
+        release.set()
+        _until(lambda: runtime.status()['bot_1']['cycles'] == 2 and not runtime.status()['bot_1']['running'])
+        assert len(calls) == 2  # the merged tick never ran on its own
+    finally:
+        release.set()
+        runtime.shutdown()
+
+
+def test_yield_frees_the_worker():
+    order = []
+
+    def cycle(bot):
+        if bot.id == 'slow':
+            order.append('slow step 1')
+            yield 0.3  # waiting on the chain, off the worker
+            order.append('slow step 2')
+        else:
+            order.append('fast')
+
+    runtime = BotRuntime(cycle, max_workers=1)
+    runtime.add_bot(SimpleNamespace(id='slow'))
+    runtime.add_bot(SimpleNamespace(id='fast'))
+    try:
+        runtime.run_cycle()
+        _until(lambda: 'fast' in order)
+        assert order == ['slow step 1', 'fast']
+        assert runtime.status()['slow']['waiting']
+        _until(lambda: runtime.status()['slow']['cycles'] == 1)
+        assert order[-1] == 'slow step 2'
+    finally:
+        runtime.shutdown()
+
+
+def test_bot_paused_after_max_errors():
+    def cycle(bot):
+        raise RuntimeError('rpc down')
+
+    runtime = BotRuntime(cycle, max_workers=1, max_errors=2)
+    runtime.add_bot(SimpleNamespace(id='bot_1'))
+    try:
+        for errors in (1, 2):
+            futures = runtime.run_cycle()
+            assert len(futures) == 1 and futures[0].result(5) is False
+            _until(lambda: not runtime.status()['bot_1']['running'])
+            assert runtime.status()['bot_1']['errors'] == errors
+        assert runtime.status()['bot_1']['paused']
+        assert runtime.run_cycle() == []
+        runtime.resume('bot_1')
+        assert not runtime.status()['bot_1']['paused'] and runtime.status()['bot_1']['errors'] == 0
+    finally:
+        runtime.shutdown()
+
+
+def test_shutdown_drops_cycles_waiting_on_a_continuation(tmp_path, monkeypatch):
+    closed = threading.Event()
+    monkeypatch.setattr(PROFILER, 'out_dir', str(tmp_path))
+    PROFILER.arm(1)
+
+    def cycle(bot):
+        try:
+            yield 10
+        finally:
+            closed.set()
+
+    runtime = BotRuntime(cycle, max_workers=1)
+    runtime.add_bot(SimpleNamespace(id='bot_1'))
+    runtime.run_cycle()
+    _until(lambda: runtime.status()['bot_1']['waiting'])
+    written = len(PROFILER.written)
+    runtime.shutdown()
+    assert closed.is_set()
+    assert runtime.bots['bot_1']['running'] is None
+    assert len(PROFILER.written) == written + 1  # the profiled cycle was closed, not left running
+    assert not PROFILER._sessions
@@ -0,0 +1,55 @@
+import time
+import pytest
+from bench.run import Bench
+from lib.settlement import VaultSettlement
+
+
+@pytest.fixture
+def bench():
+    bench = Bench()
+    yield bench
+    bench.node.stop()
+
+
+def _stopped(bench):
+    bot = bench.bot
+    bot._bars = {'WHBARUSDC': time.time()}  # next bar not due
+    cache = bench.broker.get_vault_state(bot)
+    cache.seed()
+    cache.state['stop_timestamp'] = time.time() - 1
+    return bot
+
+
+def _run(settlement):
+    for _ in settlement.run():
+        pass
+
+
+def test_settlement_given_up_waits_before_running_off_schedule(bench, monkeypatch):
+    bot = _stopped(bench)
+    monkeypatch.setattr(bot, 'save_state', lambda: None)
+    assert bot.bar_due()  # stop time passed, not settled
+
+    settlement = VaultSettlement(bot, 'WHBAR', 'USDC', block_time=0, retry_after=60)
+    monkeypatch.setattr(settlement, 'step', lambda: 1 / 0)
+    _run(settlement)
+    assert settlement.failures == settlement.retries
+    assert bot.settlement['retry_at'] == pytest.approx(time.time() + 60, abs=5)
+    assert not bot.bar_due()
+    assert bot.bar_due(now=bot.settlement['retry_at'] + 1)
+
+    # given up again: the wait doubles
+    settlement = VaultSettlement(bot, 'WHBAR', 'USDC', block_time=0, retry_after=60)
+    monkeypatch.setattr(settlement, 'step', lambda: 1 / 0)
+    _run(settlement)
+    assert bot.settlement['retry_at'] == pytest.approx(time.time() + 120, abs=5)
+
+
+def test_settlement_done_clears_the_retry(bench, monkeypatch):
+    bot = _stopped(bench)
+    monkeypatch.setattr(bot, 'save_state', lambda: None)
+    bot.settlement.update({'stage': 'withdraw', 'given_up': 2, 'retry_at': time.time() + 600})
+    settlement = VaultSettlement(bot, 'WHBAR', 'USDC', block_time=0)
+    settlement._set('done')
+    assert 'retry_at' not in bot.settlement and 'given_up' not in bot.settlement
+    assert not bot.bar_due()
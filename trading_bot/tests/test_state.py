@@ -0,0 +1,72 @@
+import os, shutil
+from lib.state import StateStore, pack
+
+
+def _store(tmp_path):
+    return StateStore(str(tmp_path), 'bot_1', fsync=False)
+
+
+def test_torn_final_record_is_dropped_and_cut(tmp_path):
+    store = _store(tmp_path)
+    store.append({'event': 'open', 'trade': 't1'})
+    store.append({'event': 'open', 'trade': 't2'})
+    store.close()
+    good_size = os.path.getsize(store.wal_path)
+    with open(store.wal_path, 'ab') as f:
+        f.write(pack({'event': 'close', 'trade': 't1', 'seq': 3})[:-4])  # crash while writing
+
+    store = _store(tmp_path)
+    snapshot, records = store.load()
+    assert snapshot is None
+    assert [r['trade'] for r in records] == ['t1', 't2']
+    assert store.seq == 2
+    assert os.path.getsize(store.wal_path) == good_size
+
+
+def test_append_after_truncation_is_read_back(tmp_path):
+    store = _store(tmp_path)
+    store.append({'event': 'open', 'trade': 't1'})
+    store.close()
+    with open(store.wal_path, 'ab') as f:
+        f.write(pack({'event': 'open', 'trade': 't2', 'seq': 2})[:5])
+
+    store = _store(tmp_path)
+    store.load()
+    assert store.append({'event': 'open', 'trade': 't3'}) == 2
+    store.close()
+
+    _, records = _store(tmp_path).load()
+    assert [(r['seq'], r['trade']) for r in records] == [(1, 't1'), (2, 't3')]
+
+
+def test_records_covered_by_the_snapshot_are_skipped(tmp_path):
+    store = _store(tmp_path)
+    store.append({'event': 'open', 'trade': 't1'})
+    store.append({'event': 'open', 'trade': 't2'})
+    store._wal.flush()
+    # crash after the snapshot replaced the old one, before the journal was truncated
+    shutil.copy(store.wal_path, str(tmp_path / 'wal.bak'))
+    store.write_snapshot({'open_trades': ['t1', 't2']})
+    store.close()
+    shutil.copy(str(tmp_path / 'wal.bak'), store.wal_path)
+    with open(store.wal_path, 'ab') as f:
+        f.write(pack({'event': 'close', 'trade': 't1', 'seq': 3}))
+
+    store = _store(tmp_path)
+    snapshot, records = store.load()
+    assert snapshot['open_trades'] == ['t1', 't2'] and snapshot['seq'] == 2
+    assert [(r['seq'], r['event']) for r in records] == [(3, 'close')]
+    assert store.seq == 3 and store.records_since_snapshot == 1
+
+
+def test_snapshot_replaces_the_journal(tmp_path):
+    store = _store(tmp_path)
+    store.append({'event': 'open', 'trade': 't1'})
+    store.write_snapshot({'open_trades': ['t1']})
+    store.append({'event': 'close', 'trade': 't1'})
+    store.close()
+    assert not os.path.exists(store.snap_path + '.tmp')
+
+    snapshot, records = _store(tmp_path).load()
+    assert snapshot['seq'] == 1
+    assert [(r['seq'], r['event']) for r in records] == [(2, 'close')]
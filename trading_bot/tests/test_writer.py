@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import Column, Float, Integer, String, create_engine, select
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import StaticPool
+from db.writer import WriteBehind
+
+Base = declarative_base()
+
+
+class Row(Base):
+    __tablename__ = 'rows'
+    id = Column(String(20), primary_key=True)
+    status = Column(String(20), nullable=False)
+    qty = Column(Float)
+    fills = Column(Integer)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def writer(engine):
+    writer = WriteBehind(engine, interval=3600)  # only flushes when asked
+    yield writer
+    writer.close()
+
+
+def _rows(engine) -> dict:
+    with engine.connect() as conn:
+        return {r.id: r._asdict() for r in conn.execute(select(Row.__table__))}
+
+
+def test_puts_of_the_same_id_are_coalesced(engine, writer):
+    writer.put(Row, {'id': 'o1', 'status': 'New', 'qty': 1.})
+    writer.put(Row, {'id': 'o1', 'status': 'Filled'})
+    writer.put(Row, {'id': 'o1', 'fills': 2})
+    writer.flush(wait=True)
+    assert _rows(engine) == {'o1': {'id': 'o1', 'status': 'Filled', 'qty': 1., 'fills': 2}}
+    assert writer.stats['coalesced'] == 2 and writer.stats['rows'] == 1
+
+
+def test_partial_update_keeps_the_other_columns(engine, writer):
+    writer.put(Row, {'id': 'o1', 'status': 'New', 'qty': 1., 'fills': 0})
+    writer.flush(wait=True)
+    writer.put(Row, {'id': 'o1', 'status': 'Filled'})
+    writer.flush(wait=True)
+    assert _rows(engine)['o1'] == {'id': 'o1', 'status': 'Filled', 'qty': 1., 'fills': 0}
+
+
+def test_bad_row_does_not_block_the_batch(engine, writer):
+    writer.put(Row, {'id': 'o1', 'status': 'New'})
+    writer.put(Row, {'id': 'o2', 'qty': 1.})  # new row without its NOT NULL status
+    writer.put(Row, {'id': 'o3', 'status': 'New'})
+    writer.flush(wait=True)
+    assert sorted(_rows(engine)) == ['o1', 'o3']
+    assert writer.stats['errors'] == 1
+    assert not writer._pending  # the rejected row is dropped, not retried forever
+
+
+def test_rows_requeued_when_the_database_is_unreachable(engine, writer):
+    Base.metadata.drop_all(engine)  # "no such table" is an OperationalError on sqlite
+    writer.put(Row, {'id': 'o1', 'status': 'New', 'qty': 1.})
+    writer._write()
+    assert writer.stats['errors'] == 1 and 'o1' in writer._pending['rows']
+    writer.put(Row, {'id': 'o1', 'status': 'Filled'})  # newer write wins over the requeued one
+    Base.metadata.create_all(engine)
+    writer.flush(wait=True)
+    assert _rows(engine)['o1'] == {'id': 'o1', 'status': 'Filled', 'qty': 1., 'fills': None}